@@ -1,8 +1,12 @@
 import uasyncio as asyncio
 from machine import Pin, I2C, PWM
-from aiot_tools import WebApp, now_time, render_template
+from aiot_tools import WebApp, Stream, JsonSplitter, HttpError, now_time, static_file
+from alarm_sched import (AlarmScheduler, TriggerLedger, localtime_secs,
+                         A_ID, A_Y, A_M, A_D, A_H, A_MIN, A_ON, A_SONG, A_MASK, A_EVERY, A_ANCHOR,
+                         compile_rule, rule_match, next_fire, days_from_civil, civil_from_days, DAY)
+from alarm_store import AlarmJournal, OP_PUT, OP_DEL, OP_CLEAR, from_dict, to_dict, pack, renumber, song_name, sort_key
 from ssd1306 import SSD1306_I2C
-import time, utime, json, os
+import time, utime, gc
 import network
 from bitmap_font_tool import set_font_path, draw_text
 from umqtt.simple import MQTTClient
@@ -33,6 +37,15 @@ def mqtt_init():
     )
     mqtt_client.connect()
     print("📡 MQTT connected")
+
+def mqtt_publish(sub, data):
+    """發佈 JSON 到 MQTT 並計數；失敗只記錄，不讓呼叫的任務中斷"""
+    try:
+        mqtt_client.publish(topic(sub), ujson.dumps(data))
+        app.metrics.inc("mqtt_published_total")
+    except Exception as e:
+        app.metrics.inc("mqtt_errors_total")
+        print("⚠️ MQTT 發佈失敗:", sub, e)
     
     
 # ----------------------------
@@ -149,63 +162,189 @@ async def ring_task():
 # ----------------------------
 # ⏰ 鬧鐘管理
 # ----------------------------
-ALARM_FILE = "alarms.json"
+ALARM_FILE = "alarms.bin"
+BULK_MAX = 1000   # 批次匯入一次最多幾組
+
+# 時鐘跳動 / 任務卡住時錯過的鬧鐘：
+#   CATCHUP_POLICY = "fire" 補響（最多一次），"skip" 只記錄不響
+#   CATCHUP_WINDOW 只補最近幾秒內錯過的鬧鐘，更早的一律略過
+#   JUMP_TOLERANCE RTC 與 ticks_ms 經過時間相差超過幾秒視為時鐘跳動
+CATCHUP_POLICY = "fire"
+CATCHUP_WINDOW = 3600
+JUMP_TOLERANCE = 2
 
 
 # === 檔案存取 ===
+# 鬧鐘以 18 位元組的二進位紀錄存在 AlarmTable 裡，只有網頁 / MQTT 才轉成 dict。
+# alarms.bin 是快照，每次異動只附加到 alarms.jnl；journal.run() 在背景合併寫入與壓縮。
+# 舊版 alarms.json / alarms.log 會在第一次開機時自動轉換。
+journal = AlarmJournal(ALARM_FILE, "alarms.jnl")
+
 def load_alarms():
-    
-    """開機時載入 alarms.json"""
-    if ALARM_FILE in os.listdir():
-        try:
-            with open(ALARM_FILE, "r") as f:
-                return json.load(f)
-        except Exception as e:
-            print("⚠️ 載入鬧鐘失敗:", e)
-            return []
-    else:
-        # 檔案不存在時建立空清單
-        with open(ALARM_FILE, "w") as f:
-            json.dump([], f)
-        return []
-        
-    
+    """開機時載入快照並重播異動日誌"""
+    data = journal.load()
+    print(f"📂 載入 {len(data)} 組鬧鐘（重播 {journal.stats['replayed']} 筆異動，{journal.stats['load_ms']} ms）")
+    return data
 
 def save_alarms(data):
-    """儲存鬧鐘清單到 alarms.json"""
+    """把整份鬧鐘紀錄表寫成快照（清空異動日誌）"""
     try:
-        with open(ALARM_FILE, "w") as f:
-            json.dump(data, f)
-            mqtt_client.publish(
-                topic("user_set"),
-                ujson.dumps({
-                    "count": len(data),
-                    "alarms": data
-                })
-            )
-            print("儲存鬧鐘成功:")
+        journal.compact(data)
+        print("儲存鬧鐘成功:")
     except Exception as e:
         print("儲存鬧鐘失敗:", e)
-        
+
+def alarm_list():
+    """API 用的鬧鐘 dict 清單（依日期時間排序）"""
+    return table.dicts()
+
+def publish_alarms():
+    """把鬧鐘清單推播給網頁 (SSE) 並發佈到 MQTT"""
+    app.events.publish("alarms")
+    data = alarm_list()
+    mqtt_publish("user_set", {
+        "count": len(data),
+        "alarms": data
+    })
+
+def log_change(op, rec=None):
+    """把一筆異動附加到日誌"""
+    try:
+        journal.append(op, rec)
+    except Exception as e:
+        print("⚠️ 寫入異動日誌失敗:", e)
+
+def now_secs():
+    return localtime_secs(utime.localtime())
+
+# === 鬧鐘 id 與紀錄表維護 ===
+def insert_alarm(a):
+    """給新 id 後存入紀錄表，並更新排程；欄位超出範圍時丟出 ValueError"""
+    global next_id
+    a["id"] = next_id
+    rec = table.put(from_dict(a))
+    next_id += 1
+    scheduler.add(rec, now_secs())
+    log_change(OP_PUT, rec)
+    return rec
+
+def remove_alarm(aid):
+    rec = table.remove(aid)
+    if rec:
+        ledger.forget(aid)
+        scheduler.remove(rec)
+        log_change(OP_DEL, rec)
+    return rec
+
+def flip_alarm(aid):
+    rec = table.get(aid)
+    if rec:
+        rec = table.set_enabled(aid, not rec[A_ON])
+        scheduler.update(rec, now_secs())
+        log_change(OP_PUT, rec)
+    return rec
+
+def clear_alarms():
+    ledger.clear()
+    table.clear()
+    scheduler.clear()
+    log_change(OP_CLEAR)
+
+def build_alarm(data):
+    """
+    把 API 送來的欄位整理成鬧鐘 dict（重複規則在這裡編譯）；格式錯誤時丟出例外，
+    重複規則永遠不會觸發時丟出 HttpError 400
+    """
+    y = int(data.get("y", data.get("year", 0)))
+    m = int(data.get("m", data.get("month", 0)))
+    d = int(data.get("d", data.get("day", 0)))
+    h = int(data.get("h", data.get("hour", 0)))
+    minute = int(data.get("min", data.get("minute", 0)))
+    song = data.get("song", "NOTES_STAR")  # 預設值
+    new_alarm = {
+        "y": y, "m": m, "d": d, "h": h, "min": minute,
+        "enabled": data.get("enabled", True),
+        "song": song
+    }
+
+    # 🔁 重複規則：存檔時編譯一次，之後比對只測位元
+    # 每 N 天從指定日期起算，沒填日期就從今天起算；匯出的資料帶有已編譯的 r，直接沿用
+    if data.get("r"):
+        rule = (data.get("repeat", ""), [int(x) for x in data["r"][:3]])
+    else:
+        t = utime.localtime()
+        anchor = days_from_civil(y, m, d) if y > 0 and m > 0 and d > 0 \
+            else days_from_civil(t[0], t[1], t[2])
+        rule = compile_rule(data, anchor)
+    if rule:
+        new_alarm["y"] = new_alarm["m"] = new_alarm["d"] = -1
+        new_alarm["repeat"], new_alarm["r"] = rule
+        # 永遠不會成立的組合（例如每 7 天都落在別的星期）存了也不會響，直接拒絕
+        if next_fire(from_dict(dict(new_alarm, id=0)), now_secs()) is None:
+            raise HttpError("400 Bad Request")
+    return new_alarm
+
+def import_alarms(batch, replace=False):
+    """
+    把已驗證、已打包的紀錄一次合併進紀錄表：只存檔一次、重排一次、發佈一次。
+    紀錄的 id 在這裡（不會讓出控制權）依序重新編號，不會和其他請求新增的鬧鐘撞號
+    """
+    global next_id
+    if replace:
+        ledger.clear()
+        table.clear()
+    renumber(batch, next_id)
+    table.merge(batch)
+    next_id = max(next_id, table.next_id())
+    save_alarms(table)  # 直接寫成新一代的快照，不逐筆寫日誌；舊日誌開機時不會再重播
+    scheduler.rebuild(table, now_secs())
+    publish_alarms()
+
+def export_chunks(as_array=False, per_chunk=16):
+    """依 id 順序逐段產生匯出內容：JSON Lines，或 as_array 時為 JSON 陣列"""
+    lines = []
+    first = True
+    if as_array:
+        yield "["
+    for rec in table:
+        line = ujson.dumps(to_dict(rec))
+        if as_array and not first:
+            line = "," + line
+        first = False
+        lines.append(line)
+        if len(lines) >= per_chunk:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+    if as_array:
+        yield "]"
+
+def alarm_at(idx):
+    """舊版 API 以顯示順序的索引指定鬧鐘，回傳 id（無效時回傳 None）"""
+    data = alarm_list()
+    return data[idx]["id"] if 0 <= idx < len(data) else None
+
 def add_alarm(a):
-    alarms.append(a)
-    save_alarms(alarms)
+    insert_alarm(a)
+    publish_alarms()
     update_oled()
 
-def delete_alarm(i):
-    if 0 <= i < len(alarms):
-        del alarms[i]
-        save_alarms(alarms)
+def delete_alarm(aid):
+    if remove_alarm(aid):
+        publish_alarms()
         update_oled()
 
-def toggle_alarm(i):
-    if 0 <= i < len(alarms):
-        alarms[i]["enabled"] = not alarms[i].get("enabled", True)
-        save_alarms(alarms)
+def toggle_alarm(aid):
+    if flip_alarm(aid):
+        publish_alarms()
         update_oled()
 
     
-alarms = load_alarms()
+table = load_alarms()
+next_id = table.next_id()
+ledger = TriggerLedger()      # ✅ 記錄已觸發的鬧鐘（防止重複響）
+scheduler = AlarmScheduler(table)  # ⏰ 下一次觸發時間的最小堆積
 speaker = speaker_init(14)
 is_ringing = False
 
@@ -217,119 +356,241 @@ is_ringing = False
 
 app = WebApp("ESP32 智慧鬧鐘")
 
-@app.route("/")
+# 網頁連上 /api/events 後先收到這些狀態，之後只在變更時推播；時間每 30 秒校正一次，
+# 其餘由網頁自己走秒
+app.events.source("time", now_time)
+app.events.source("alarms", lambda: {"alarms": alarm_list()})
+app.events.source("ring", lambda: {"ringing": is_ringing})
+
+# /api/metrics：WebApp 自己記錄路由與連線，這裡加上各任務的計數
+metrics = app.metrics
+metrics.counter("alarm_wakeups_total", "alarm_task 醒來檢查的次數")
+metrics.counter("alarm_fired_total", "鬧鐘觸發（含補響）的次數")
+metrics.counter("alarm_missed_total", "錯過而略過的鬧鐘")
+metrics.counter("clock_jumps_total", "偵測到的 RTC 跳動")
+metrics.counter("oled_frames_total", "OLED 重繪次數")
+metrics.counter("oled_errors_total", "OLED 更新錯誤")
+metrics.gauge("oled_frame_us", "最近一次 OLED 重繪的耗時（微秒）")
+metrics.counter("mqtt_published_total", "成功發佈的 MQTT 訊息")
+metrics.counter("mqtt_errors_total", "發佈失敗的 MQTT 訊息")
+metrics.gauge("alarms", "鬧鐘數", lambda: len(table))
+metrics.gauge("alarm_ringing", "是否正在響鈴", lambda: 1 if is_ringing else 0)
+if hasattr(gc, "mem_free"):
+    metrics.gauge("mem_free_bytes", "可用的 heap", gc.mem_free)
+
+@app.route("/", methods=["GET"])
 def index(req):
-    alarm_html = ""
-    for i, a in enumerate(alarms):
-        alarm_html += f"<li>{a['y']}/{a['m']}/{a['d']} {a['h']}:{a['min']}</li>\n"
-    return render_template("hw3_clock_v3.html", time=now_time(), alarms=alarm_html)
+    """控制頁本身是靜態的（資料由 /api/* 取得），帶 ETag 讓手機重新整理時只拿到 304"""
+    return static_file(req, "hw3_clock_v3.html")
 
 
 @app.route("/add")
 def add(req):
     y,m,d,h,min = (req.args.get(k) for k in ["y","m","d","h","min"])
-    alarms.append(dict(y=int(y), m=int(m), d=int(d), h=int(h), min=int(min)))
-    save_alarms(alarms)
+    insert_alarm(dict(y=int(y), m=int(m), d=int(d), h=int(h), min=int(min)))
+    publish_alarms()
     return "<meta http-equiv='refresh' content='0;url=/' />"
 
 @app.route("/del")
 def delete(req):
-    idx = int(req.args.get("i", -1))
-    if 0 <= idx < len(alarms):
-        del alarms[idx]
-        save_alarms(alarms)
+    aid = alarm_at(int(req.args.get("i", -1)))
+    if aid is not None:
+        remove_alarm(aid)
+        publish_alarms()
     return "<meta http-equiv='refresh' content='0;url=/' />"
 
 @app.route("/api/alarms/reset")
 def api_reset(req):
     """清空所有鬧鐘"""
-    global alarms,last_triggered
-    last_triggered.clear()
-    alarms.clear()
-    save_alarms(alarms)
+    clear_alarms()
+    publish_alarms()
     print("🧹 所有鬧鐘已清空")
-    return {"ok": True, "alarms": alarms}
+    return {"ok": True, "alarms": []}
 
-@app.route("/api/alarms")
+@app.route("/api/alarms", methods=["GET"])
 def api_alarms(req):
-    """管理鬧鐘資料 (GET 取得全部, POST 新增或切換, DELETE 單筆或全部刪除)"""
-    global alarms, last_triggered
-    import ujson
-
-    if req.method == "GET":
-        #print("📤 回傳 alarms =", alarms)
-        return json.dumps({"alarms": alarms})
-
-    elif req.method == "POST":
+    """
+    取得全部鬧鐘。回應帶 ETag（開機代號-版本），If-None-Match 相同時回 304，不必重新序列化。
+    ?since=<版本>（可加 &epoch=<開機代號>）只回傳該版本之後新增、修改與刪除的鬧鐘；
+    版本太舊或來自上次開機時改回傳整份清單（有 "alarms" 欄位）。
+    """
+    etag = '"%x-%d"' % (table.epoch, table.version)
+    head = "ETag: " + etag + "\r\nCache-Control: no-cache"
+    inm = req.headers.get("if-none-match")
+    if inm and etag in inm:
+        return "304 Not Modified", "application/json", b"", head
+
+    data = {"version": table.version, "epoch": table.epoch}
+    delta = None
+    if "since" in req.args:
         try:
-            data = ujson.loads(req.body)
-
-            # ✅ 處理 toggle 指令
-            if "toggle" in data:
-                idx = int(data["toggle"])
-                if 0 <= idx < len(alarms):
-                    alarms[idx]["enabled"] = not alarms[idx].get("enabled", True)
-                    print(f"🔁 切換鬧鐘 {idx+1} 為 {alarms[idx]['enabled']}")
-                    save_alarms(alarms)
-                return {"ok": True, "alarms": alarms}
-
-            # ✅ 一般新增鬧鐘
-            y = int(data.get("y", data.get("year", 0)))
-            m = int(data.get("m", data.get("month", 0)))
-            d = int(data.get("d", data.get("day", 0)))
-            h = int(data.get("h", data.get("hour", 0)))
-            minute = int(data.get("min", data.get("minute", 0)))
-            song = data.get("song", "NOTES_STAR")  # 預設值
-            new_alarm = {
-                "y": y, "m": m, "d": d, "h": h, "min": minute,
-                "enabled": data.get("enabled", True),
-                "song": song
-            }
-            alarms.append(new_alarm)
-            alarms = sorted(alarms, key=lambda a: (a['y'], a['m'], a['d'], a['h'], a['min']))
-            save_alarms(alarms)
-            print("✅ 新增鬧鐘：", new_alarm)
-            return {"ok": True, "alarms": alarms}
+            if int(req.args.get("epoch", table.epoch)) == table.epoch:
+                delta = table.changes_since(int(req.args["since"]))
+        except ValueError:
+            raise HttpError("400 Bad Request")
+    if delta is None:
+        data["alarms"] = alarm_list()
+    else:
+        added, changed, removed = delta
+        data["added"] = [to_dict(table.get(aid)) for aid in added]
+        data["changed"] = [to_dict(table.get(aid)) for aid in changed]
+        data["removed"] = removed
+    return "200 OK", "application/json", ujson.dumps(data), head
+
+@app.route("/api/alarms", methods=["POST"])
+def api_alarms_post(req):
+    """
+    新增鬧鐘；舊的切換寫法 {"toggle_id": id} / {"toggle": 索引} 仍可使用
+    （新的寫法為 POST /api/alarms/<id>/toggle）
+    """
+    try:
+        data = ujson.loads(req.body)
 
-        except Exception as e:
-            print("⚠️ POST 錯誤：", e)
-            return {"ok": False, "err": str(e)}
+        # ✅ 處理 toggle 指令
+        if "toggle_id" in data or "toggle" in data:
+            if "toggle_id" in data:
+                aid = int(data["toggle_id"])
+            else:
+                aid = alarm_at(int(data["toggle"]))
+            rec = flip_alarm(aid) if aid is not None else None
+            if rec:
+                print(f"🔁 切換鬧鐘 #{aid} 為 {rec[A_ON]}")
+                publish_alarms()
+            return {"ok": True, "alarms": alarm_list()}
+
+        # ✅ 一般新增鬧鐘
+        new_alarm = build_alarm(data)
+        insert_alarm(new_alarm)
+        publish_alarms()
+        print("✅ 新增鬧鐘：", new_alarm)
+        return {"ok": True, "alarms": alarm_list()}
+
+    except HttpError:
+        raise
+    except Exception as e:
+        print("⚠️ POST 錯誤：", e)
+        return {"ok": False, "err": str(e)}
 
-    elif req.method == "DELETE":
-        try:
-            data = ujson.loads(req.body or "{}")
-
-            # ✅ 重置全部
-            if data.get("all"):
-                print("🧹 重置所有鬧鐘")
-                last_triggered.clear()
-                alarms.clear()
-                save_alarms(alarms)
-                try: os.sync()
-                except: pass
-                return {"ok": True, "alarms": alarms}
-
-            # ✅ 刪除單筆
-            i = int(data.get("i", -1))
-            if 0 <= i < len(alarms):
-                print("🗑 刪除鬧鐘：", alarms[i])
-                del alarms[i]
-                last_triggered.clear()
-                save_alarms(alarms)
-                try: os.sync()
-                except: pass
-            return {"ok": True, "alarms": alarms}
+@app.route("/api/alarms", methods=["DELETE"])
+def api_alarms_delete(req):
+    """
+    刪除全部 {"all": true}；舊的單筆寫法 {"id": id} / {"i": 索引} 仍可使用
+    （新的寫法為 DELETE /api/alarms/<id>）
+    """
+    try:
+        data = ujson.loads(req.body or "{}")
+
+        # ✅ 重置全部
+        if data.get("all"):
+            print("🧹 重置所有鬧鐘")
+            clear_alarms()
+            publish_alarms()
+            return {"ok": True, "alarms": []}
+
+        # ✅ 刪除單筆
+        if "id" in data:
+            aid = int(data["id"])
+        else:
+            aid = alarm_at(int(data.get("i", -1)))
+        rec = remove_alarm(aid) if aid is not None else None
+        if rec:
+            print("🗑 刪除鬧鐘：", rec)
+            publish_alarms()
+        return {"ok": True, "alarms": alarm_list()}
 
-        except Exception as e:
-            print("⚠️ DELETE 錯誤：", e)
-            return {"ok": False, "err": str(e)}
+    except Exception as e:
+        print("⚠️ DELETE 錯誤：", e)
+        return {"ok": False, "err": str(e)}
+
+def path_alarm(req):
+    """取出路徑中的 <id> 對應的鬧鐘紀錄，找不到時回 404"""
+    try:
+        rec = table.get(int(req.params["id"]))
+    except ValueError:
+        rec = None
+    if rec is None:
+        raise HttpError("404 NOT FOUND")
+    return rec
+
+@app.route("/api/alarms/<id>", methods=["GET"])
+def api_alarm_get(req):
+    return to_dict(path_alarm(req))
+
+@app.route("/api/alarms/<id>", methods=["DELETE"])
+def api_alarm_delete(req):
+    rec = remove_alarm(path_alarm(req)[A_ID])
+    print("🗑 刪除鬧鐘：", rec)
+    publish_alarms()
+    return {"ok": True, "alarms": alarm_list()}
+
+@app.route("/api/alarms/<id>/toggle", methods=["POST"])
+def api_alarm_toggle(req):
+    rec = flip_alarm(path_alarm(req)[A_ID])
+    print(f"🔁 切換鬧鐘 #{rec[A_ID]} 為 {rec[A_ON]}")
+    publish_alarms()
+    return {"ok": True, "alarms": alarm_list()}
+
+
+@app.route("/api/alarms/bulk", methods=["GET"])
+def api_bulk_export(req):
+    """依 id 順序串流匯出全部鬧鐘，預設 JSON Lines（一行一組），?format=json 則為 JSON 陣列"""
+    as_array = req.args.get("format") == "json"
+    return Stream(export_chunks(as_array),
+                  "application/json" if as_array else "application/x-ndjson")
+
+@app.route("/api/alarms/bulk", methods=["POST"], limit=(0.1, 2))  # 批次匯入很重，每 10 秒一次
+async def api_bulk_import(req):
+    """
+    批次匯入：本文為 JSON 陣列或 JSON Lines，邊讀邊驗證；全部有效才一次合併、存檔、發佈，
+    ?replace=1 會先清空既有鬧鐘。
+    讀本文時會讓出控制權，期間其他請求可能新增鬧鐘，所以讀完後才一次給 id。
+    """
+    batch = bytearray()
+    n = 0
+    splitter = JsonSplitter()
+    try:
+        while True:
+            chunk = await req.read(512)
+            if not chunk:
+                break
+            for data in splitter.feed(chunk):
+                if n >= BULK_MAX:
+                    raise ValueError("一次最多匯入 %d 組鬧鐘" % BULK_MAX)
+                a = build_alarm(data)
+                a["id"] = n + 1  # 暫時的 id，讀完後由 import_alarms 重新編號
+                batch += pack(from_dict(a))  # 打包時順便檢查欄位範圍
+                n += 1
+        splitter.close()
+    except Exception as e:
+        print(f"⚠️ 批次匯入第 {n} 筆錯誤：", e)
+        return {"ok": False, "err": str(e), "index": n}
+    import_alarms(batch, req.args.get("replace") == "1")
+    print(f"📥 批次匯入 {n} 組鬧鐘")
+    return {"ok": True, "count": n}
 
         
 @app.route("/api/time")
 def api_time(req):
     return now_time()
 
-@app.route("/api/ring/test")
+@app.route("/api/server", methods=["GET"])
+def api_server(req):
+    """網頁伺服器的連線計數：處理中 / 排隊中 / 已拒絕（503）等"""
+    data = dict(app.stats)
+    data["sse"] = len(app.events.streams)
+    return data
+
+@app.route("/api/metrics", methods=["GET"])
+def api_metrics(req):
+    """Prometheus 文字格式的路由延遲直方圖與各任務計數"""
+    return app.metrics_stream()
+
+@app.route("/api/events", methods=["GET"])
+def api_events(req):
+    """Server-Sent Events：鬧鐘清單、響鈴狀態與時間，取代網頁每秒輪詢"""
+    return app.events.stream()
+
+@app.route("/api/ring/test", limit=(0.5, 2))  # 測試響鈴不能被連按
 def test(req):
     global is_ringing
     is_ringing = True
@@ -343,6 +604,7 @@ def stop(req):
     is_ringing = False
     print("🔔 鬧鐘關閉！")
     speaker.duty(0)
+    app.events.publish("ring")
     return "<meta http-equiv='refresh' content='0;url=/' />"
 
 # ----------------------------
@@ -352,7 +614,7 @@ def stop(req):
 max_repeat = 3
 
 async def play_song_async(spk, notes):
-    global is_ringing,last_triggered
+    global is_ringing
     for note, duration in notes:
         if not is_ringing:
             print("🛑 停止播放")
@@ -374,14 +636,12 @@ async def ring_task(song):
     is_ringing = True
     play_count = 0
     print("🔔 鬧鐘觸發，開始連續播放！")
+    app.events.publish("ring")
     
-    mqtt_client.publish(
-        topic("alarm_state"),
-        ujson.dumps({
-            "is_ringing": True,
-            "time": "start_ring"
-        })
-    )
+    mqtt_publish("alarm_state", {
+        "is_ringing": True,
+        "time": "start_ring"
+    })
     
     try:
         while is_ringing and play_count < max_repeat:
@@ -393,47 +653,63 @@ async def ring_task(song):
     is_ringing = False
     speaker.duty(0)
     print("🛑 鬧鐘已停止")
+    app.events.publish("ring")
     
-    mqtt_client.publish(
-        topic("alarm_state"),
-        ujson.dumps({
-            "is_ringing": False,
-            "alarm": "finish_ring"
-        })
-    )
+    mqtt_publish("alarm_state", {
+        "is_ringing": False,
+        "alarm": "finish_ring"
+    })
     
     
-def is_alarm_match(alarm, now):
-    y, m, d, h, minute = alarm["y"], alarm["m"], alarm["d"], alarm["h"], alarm["min"]
+def is_alarm_match(rec, now):
+    y, m, d, h, minute = rec[A_Y], rec[A_M], rec[A_D], rec[A_H], rec[A_MIN]
     ny, nm, nd, nh, nmin = now
-    print(h,nh,minute,nmin)
     if h != nh or minute != nmin:
         return False
 
+    if rec[A_MASK]:
+        return rule_match((rec[A_MASK], rec[A_EVERY], rec[A_ANCHOR]), ny, nm, nd)
+
     if y == -1 and m == -1 and d == -1:
         return True
 
     return (y, m, d) == (ny, nm, nd)
 
+oled_cache = (-1, [])
+
+def oled_alarm_lines():
+    """最前面三組鬧鐘的顯示文字；紀錄表沒變時直接用快取，變了才掃一次（不排序整張表）"""
+    global oled_cache
+    if oled_cache[0] == table.version:
+        return oled_cache[1]
+    top = []
+    for rec in table:
+        if len(top) < 3 or sort_key(rec) < sort_key(top[-1]):
+            top.append(rec)
+            top.sort(key=sort_key)
+            del top[3:]
+    lines = [f"鬧鐘 ：{a[A_M]:02d}/{a[A_D]:02d} {a[A_H]:02d}:{a[A_MIN]:02d}" for a in top]
+    oled_cache = (table.version, lines)
+    return lines
+
 async def oled_task():
     """持續更新 OLED 畫面：顯示時間 + 鬧鐘 + 鈴聲狀態"""
-    global alarms, is_ringing
+    global is_ringing
     while True:
         try:
             #print("OLED更新")
+            t0 = utime.ticks_us()
             oled.fill(0)
             t = utime.localtime(utime.time())  # 加上時區偏移 (+8 小時)
             time_str = "%04d-%02d-%02d %02d:%02d:%02d" % (t[0], t[1], t[2], t[3], t[4], t[5])
             draw_text(oled, time_str, 0, 0)
             
             # 顯示鬧鐘清單（最多三筆）
-            if not alarms:
+            lines = oled_alarm_lines()
+            if not lines:
                 draw_text(oled, "無鬧鐘", 0, 16)
             else:
-                #print(alarms)
-                for i, a in enumerate(alarms[:3]):
-                    #mark = "✔" if a.get("enabled", True) else "✖"
-                    txt = f"鬧鐘 ：{a['m']:02d}/{a['d']:02d} {a['h']:02d}:{a['min']:02d}"
+                for i, txt in enumerate(lines):
                     draw_text(oled, txt, 0, 16 + i * 12)
 
             # 若正在響鈴
@@ -441,43 +717,105 @@ async def oled_task():
                 draw_text(oled, "RINGING!", 0, 56)
 
             oled.show()
+            metrics.set("oled_frame_us", utime.ticks_diff(utime.ticks_us(), t0))
+            metrics.inc("oled_frames_total")
             await asyncio.sleep(1)
 
         except Exception as e:
+            metrics.inc("oled_errors_total")
             print("⚠️ OLED 更新錯誤:", e)
             await asyncio.sleep(2)
 
+def catch_up(late):
+    """
+    處理錯過的鬧鐘 [(應響時間, 鬧鐘, 可補響), ...]：依 CATCHUP_POLICY 補響或只記錄；
+    超出 CATCHUP_WINDOW 的一律只記錄
+    """
+    rang = False
+    for when, a, recent in sorted(late, key=lambda x: x[0]):
+        day = civil_from_days(when // DAY)
+        if ledger.fired(a[A_ID], day):
+            continue
+        hm = "%02d:%02d" % (when % DAY // 3600, when % 3600 // 60)
+        if not recent:
+            metrics.inc("alarm_missed_total")
+            print(f"⚠️ 略過錯過太久的鬧鐘 #{a[A_ID]}（原定 {day} {hm}）")
+        elif CATCHUP_POLICY == "fire" and not rang and not is_ringing:
+            print(f"⏰ 補響錯過的鬧鐘 #{a[A_ID]}（原定 {day} {hm}）")
+            song_data = globals().get(song_name(a[A_SONG]), NOTES_STAR)
+            asyncio.create_task(ring_task(song_data))
+            metrics.inc("alarm_fired_total")
+            rang = True
+        else:
+            metrics.inc("alarm_missed_total")
+            print(f"⚠️ 略過錯過的鬧鐘 #{a[A_ID]}（原定 {day} {hm}）")
+        ledger.mark(a[A_ID], day)
+
 async def alarm_task():
-    global is_ringing,last_triggered
+    global is_ringing
 
-    last_triggered = set()  # ✅ 記錄已觸發的鬧鐘（防止重複響）
     print("🕒 鬧鐘監聽啟動")
+    last_secs, last_ticks = now_secs(), utime.ticks_ms()
+    scheduler.rebuild(table, last_secs)
 
     while True:
+        metrics.inc("alarm_wakeups_total")
         t = utime.localtime()
         now = (t[0], t[1], t[2], t[3], t[4])  # (年,月,日,時,分)
-        #print(f"讀取到的alarms:{alarms}")
-        # 檢查每一組鬧鐘
-        for i, a in enumerate(alarms):
-            if not a.get("enabled", True):
-                continue  # 跳過停用的鬧鐘
-            
-            alarm_time = (a["y"], a["m"], a["d"], a["h"], a["min"])
-            print("🕵️ 檢查鬧鐘", i, "時間:", alarm_time, "現在:", now, "last_triggered",last_triggered)
-            trigger_key = (t[0], t[1], t[2], i)
-            #print (f"is_alarm_match:{is_alarm_match(a, now)}")
-            #print(f"trigger_key:{trigger_key}")
-            #print(f"is_ringing{is_ringing}")
-            if is_alarm_match(a, now) and (trigger_key not in last_triggered) and (not is_ringing):
-                print(f"🔔 鬧鐘 {i+1} 觸發！ {alarm_time}")
-                song_name = a.get("song", "NOTES_STAR")  # 取出指定音樂名稱（字串)
-                print(f"🎵 播放指定曲目：{song_name}")
-                song_data = globals().get(song_name, NOTES_STAR) # 把字串轉成對應變數，例如 "NOTES_STAR" → NOTES_STAR
-
-                # ✅ 使用非阻塞任務播放音樂
-                asyncio.create_task(ring_task(song_data))
-                last_triggered.add(trigger_key)
-        await asyncio.sleep(1)
+        secs = localtime_secs(t)
+        minute = secs - secs % 60
+
+        # ⏩ 比對 RTC 與 ticks_ms 的經過時間，找出 set_time / NTP 造成的跳動
+        ticks = utime.ticks_ms()
+        drift = (secs - last_secs) - utime.ticks_diff(ticks, last_ticks) // 1000
+        if drift > JUMP_TOLERANCE:
+            print(f"⏩ 時鐘往前跳了 {drift} 秒")
+        elif drift < -JUMP_TOLERANCE:
+            # 往回跳：期限可能排得太晚，重新計算（觸發紀錄仍會防止重複響）
+            print(f"⏪ 時鐘往回跳了 {-drift} 秒，重新排程")
+            scheduler.rebuild(table, secs)
+        if abs(drift) > JUMP_TOLERANCE:
+            metrics.inc("clock_jumps_total")
+            app.events.publish("time")  # 網頁自己走秒，時鐘跳動時要重新校正
+        last_secs, last_ticks = secs, ticks
+
+        # 只處理期限已到的分鐘桶，每桶只看同一分鐘的鬧鐘
+        late = []
+        for deadline, key in scheduler.pop_due(secs):
+            if deadline < minute:
+                # 期限落在已經過去的分鐘：只對這一桶做範圍查詢
+                late += scheduler.missed(key, deadline, minute, CATCHUP_WINDOW)
+            pending = False
+            for a in scheduler.bucket(key):
+                if not is_alarm_match(a, now):
+                    continue  # 同一分鐘但不同日期的單次鬧鐘
+                if is_ringing:
+                    pending = True  # 響鈴中，下一秒再試
+                    continue
+
+                alarm_time = a[A_Y:A_MIN + 1]
+                today = (t[0], t[1], t[2])
+                if not ledger.fired(a[A_ID], today):
+                    print(f"🔔 鬧鐘 #{a[A_ID]} 觸發！ {alarm_time}")
+                    name = song_name(a[A_SONG])  # 曲目 id → 名稱（字串）
+                    print(f"🎵 播放指定曲目：{name}")
+                    song_data = globals().get(name, NOTES_STAR) # 把字串轉成對應變數，例如 "NOTES_STAR" → NOTES_STAR
+
+                    # ✅ 使用非阻塞任務播放音樂
+                    asyncio.create_task(ring_task(song_data))
+                    metrics.inc("alarm_fired_total")
+                    ledger.mark(a[A_ID], today)
+            if pending:
+                scheduler.defer(key, secs + 1)
+            else:
+                # 該分鐘已處理完（或已錯過），排下一次
+                scheduler.reschedule(key, max(deadline, minute) + 60)
+
+        if late:
+            catch_up(late)
+
+        # 睡到最早的期限（有變更時會被提早喚醒）
+        await scheduler.wait(localtime_secs(utime.localtime()))
 
 # ----------------------------
 # MQTT 資料發送
@@ -494,10 +832,7 @@ async def mqtt_time_task():
             "minute": t[4],
             "second": t[5]
         }
-        mqtt_client.publish(
-            topic("time_now"),
-            ujson.dumps(data)
-        )
+        mqtt_publish("time_now", data)
         await asyncio.sleep(10)
 
         
@@ -513,6 +848,7 @@ async def main():
         app.start(80),
         oled_task(),
         alarm_task(),
+        journal.run(lambda: table),
         mqtt_time_task()
     )
 
@@ -0,0 +1,196 @@
+# 比較 ESPWebServer 舊版與非阻塞模式送靜態檔的速度（在電腦 (CPython) 上以本機迴路位址量測）：
+#   舊版   ：handleClient() 一次只服務一個用戶端，逐行讀標頭，每次 f.read(64) 送出
+#   非阻塞 ：begin(nonBlocking=True)，同時輪詢監聽 socket 與所有用戶端，
+#            以共用緩衝區 readinto() 讀檔，bufSize 1 KB / 4 KB
+# 伺服器在一個執行緒裡不斷呼叫 handleClient()（代表呼叫端的主迴圈），
+# 報告每秒請求數、MB/s，以及單次 handleClient() 最久佔住主迴圈多久。
+# 另外比較 .p.html 樣板：舊版每個請求每一行都 l.format(**tplData)，
+# 新版編譯一次（依路徑與修改時間快取）後逐段寫出；並確認含 CSS / JS 大括號（包括巢狀的 }}）的樣板原樣輸出。
+#
+# 用法：python tools/bench_espweb.py [--size 16384] [--requests 200] [--concurrency 1,4] [--rounds 500]
+
+import os, sys, time, socket, shutil, tempfile, threading, importlib, argparse
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+for p in (os.path.join(HERE, "..", "模組"), os.path.join(HERE, "fakes"), HERE):
+    sys.path.insert(0, p)
+
+from bench_http import free_port, percentile
+
+
+class LegacySock:
+    """舊版用到 MicroPython socket 的 readline() / write()，CPython 的 socket 沒有，這裡補上"""
+    def __init__(self, sock):
+        self.sock = sock
+        self.f = sock.makefile("rb")
+
+    def settimeout(self, t):
+        self.sock.settimeout(t)
+
+    def readline(self):
+        return self.f.readline()
+
+    def write(self, data):
+        self.sock.sendall(data.encode() if isinstance(data, str) else data)
+
+    def close(self):
+        self.f.close()
+        self.sock.close()
+
+
+class LegacyServer:
+    def __init__(self, sock):
+        self.sock = sock
+
+    def accept(self):
+        c, addr = self.sock.accept()
+        return LegacySock(c), addr
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+TEMPLATE_ROW = "<tr><td>{name}</td><td>{value}</td><td>第 {n} 列</td></tr>\n"
+TEMPLATE_CSS = ("<style>body{margin:0} .x{color:red} @media(max-width:600px){.a{color:red}}</style>\n"
+                "<p>{name}</p>\n<script>var o={a:{b:1}};function f(){if(x){y()}}</script>\n")
+
+
+class Sink:
+    """代替 socket：只計算寫了幾次、多少位元組（板子上每次 write() 都是一次 lwIP 呼叫）"""
+    def __init__(self):
+        self.n = 0
+        self.writes = 0
+
+    def write(self, data):
+        self.n += len(data.encode() if isinstance(data, str) else data)
+        self.writes += 1
+
+
+def legacy_template(sock, file, data):
+    """user-025 之前的寫法：每一行都重新解析 format 字串"""
+    f = open(file, "r")
+    for l in f:
+        sock.write(l.format(**data))
+    f.close()
+
+
+def bench_template(docdir, rounds):
+    srv = fresh_server()
+    file = docdir + "bench.p.html"
+    with open(file, "w") as f:
+        f.write("<html><body><h1>{name}</h1><table>\n" + TEMPLATE_ROW * 200 + "</table></body></html>\n")
+    data = {"name": "ESP32", "value": 42, "n": 7}
+    srv.setTplData(data)
+    send = getattr(srv, "__sendTemplate")
+    rows = []
+    for label, fn in (("舊版 format", lambda s: legacy_template(s, file, data)), ("編譯快取", lambda s: send(s, file))):
+        sink = Sink()
+        fn(sink)  # 暖身：新版在這裡編譯
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            fn(Sink())
+        rows.append((label, (time.perf_counter() - t0) / rounds * 1e6, sink.writes, sink.n))
+
+    css = docdir + "css.p.html"
+    with open(css, "w") as f:
+        f.write(TEMPLATE_CSS)
+    try:
+        legacy_template(Sink(), css, data)
+        old = "正常"
+    except (KeyError, ValueError, IndexError) as e:
+        old = "失敗（%s: %s）" % (type(e).__name__, e)
+    out = []
+    send(type("W", (), {"write": lambda self, d: out.append(d.encode() if isinstance(d, str) else d)})(), css)
+    new = b"".join(out).decode()
+    assert new == TEMPLATE_CSS.replace("{name}", "ESP32"), new
+    return rows, old
+
+
+def fresh_server():
+    sys.modules.pop("ESPWebServer", None)
+    return importlib.import_module("ESPWebServer")
+
+
+def fetch(port, path):
+    """送出 GET 並讀到連線關閉，回傳 (毫秒, 本文長度)"""
+    t0 = time.perf_counter()
+    c = socket.create_connection(("127.0.0.1", port))
+    c.sendall(("GET %s HTTP/1.1\r\nHost: bench\r\n\r\n" % path).encode())
+    data = b""
+    while True:
+        x = c.recv(65536)
+        if not x:
+            break
+        data += x
+    c.close()
+    return (time.perf_counter() - t0) * 1000, len(data.partition(b"\r\n\r\n")[2])
+
+
+def run(label, docdir, size, requests, conc, nonblocking, bufsize):
+    srv = fresh_server()
+    port = free_port()
+    if not nonblocking:
+        srv.server = LegacyServer(srv.server)
+    srv.setDocPath(docdir)
+    srv.begin(port, nonBlocking=nonblocking, bufSize=bufsize)
+
+    stop = []
+    worst = [0.0]
+
+    def loop():
+        while not stop:
+            t0 = time.perf_counter()
+            srv.handleClient()
+            worst[0] = max(worst[0], time.perf_counter() - t0)
+
+    th = threading.Thread(target=loop)
+    th.start()
+    path = docdir + "asset.css"
+    per = requests // conc
+    pool = ThreadPoolExecutor(conc)
+    t0 = time.perf_counter()
+    parts = list(pool.map(lambda _: [fetch(port, path) for _ in range(per)], range(conc)))
+    wall = time.perf_counter() - t0
+    pool.shutdown()
+    stop.append(1)
+    th.join()
+    srv.close()
+
+    lat = [ms for part in parts for ms, n in part]
+    bad = sum(1 for part in parts for ms, n in part if n != size)
+    return (label, conc, len(lat) / wall, len(lat) * size / wall / 1e6,
+            percentile(lat, 50), percentile(lat, 99), worst[0] * 1000, bad)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="比較 ESPWebServer 舊版與非阻塞模式")
+    ap.add_argument("--size", type=int, default=16384, help="靜態檔大小（位元組）")
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--concurrency", default="1,4")
+    ap.add_argument("--rounds", type=int, default=500, help="樣板輸出的重複次數")
+    args = ap.parse_args()
+
+    docdir = tempfile.mkdtemp(prefix="espweb_") + "/"
+    with open(docdir + "asset.css", "wb") as f:
+        f.write((b"body{margin:0}\n" * (args.size // 15 + 1))[:args.size])
+    print("%-14s %4s %9s %8s %9s %9s %14s %6s" % ("模式", "並行", "req/s", "MB/s", "p50 ms", "p99 ms",
+                                                  "單次最久 ms", "錯誤"))
+    try:
+        for conc in [int(x) for x in args.concurrency.split(",")]:
+            for label, nb, bufsize in (("舊版 64 B", False, 0), ("非阻塞 1 KB", True, 1024),
+                                       ("非阻塞 4 KB", True, 4096)):
+                row = run(label, docdir, args.size, args.requests, conc, nb, bufsize)
+                print("%-14s %4d %9.0f %8.2f %9.2f %9.2f %14.2f %6d" % row)
+        print()
+        rows, old = bench_template(docdir, args.rounds)
+        print("%-14s %10s %10s %10s" % ("樣板", "µs/次", "write 次數", "大小 B"))
+        for row in rows:
+            print("%-14s %10.1f %10d %10d" % row)
+        print("含 CSS / JS 大括號的樣板：舊版%s，新版正常" % old)
+    finally:
+        shutil.rmtree(docdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+# 比較 WebApp 兩種接受連線的方式（在電腦 (CPython) 上以本機迴路位址量測）：
+#   poll   ：舊版非阻塞 accept()，沒有連線時 sleep(0.05)
+#   stream ：asyncio.start_server 事件驅動，每個請求一條新連線
+#   keep   ：同上，但每個用戶端沿用同一條持久連線（HTTP/1.1 keep-alive）
+# 報告 p50 / p99 延遲、每秒請求數、建立的連線數，以及閒置時每秒消耗的 CPU 時間；
+# 最後檢查管線化：一次送出多個請求，確認依序收到同樣多個完整回應，
+# 並比較控制頁完整下載、gzip 與 304 三種情況實際傳送的位元組數，
+# 以及同一個用戶端連續送請求時被限流（429）的次數，最後讀 /api/metrics 的延遲直方圖。
+# --flood 另外模擬大量慢速用戶端同時湧入，比較有無連線名額限制時
+# 同時處理的連線數、503 數，以及事件迴圈延遲（代表 alarm_task 的準時程度）。
+#
+# 用法：python tools/bench_http.py [--requests 400] [--concurrency 1,4] [--modes poll,stream,keep] [--flood 40]
+
+import os, sys, time, socket, argparse
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+for p in (os.path.join(HERE, "..", "模組"), os.path.join(HERE, "fakes")):
+    sys.path.insert(0, p)
+
+import asyncio
+from aiot_tools import WebApp, static_file
+from precompress import compress
+
+PAGE = os.path.join(HERE, "..", "hw3_clock_v3.html")
+
+REQUEST = b"GET /api/time HTTP/1.1\r\nHost: bench\r\n\r\n"
+REQUEST_CLOSE = b"GET /api/time HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n"
+
+
+def make_app():
+    app = WebApp("bench")
+    app.api_limit = None  # 量測吞吐量時不限流；限流另外用 /api/limited 檢查
+
+    @app.route("/api/time")
+    def api_time(req):
+        return "2026-01-01 00:00:00"
+
+    @app.route("/api/limited", limit=(5, 10))
+    def api_limited(req):
+        return {"alarms": list(range(50))}
+
+    @app.route("/")
+    def index(req):
+        return static_file(req, PAGE)
+
+    @app.route("/api/metrics", limit=(100, 100))
+    def api_metrics(req):
+        return app.metrics_stream()
+
+    return app
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def one_request(port):
+    """開一條新連線送出一個請求並讀到連線關閉，回傳耗時（毫秒）"""
+    t0 = time.perf_counter()
+    c = socket.create_connection(("127.0.0.1", port))
+    try:
+        c.sendall(REQUEST_CLOSE)
+        while c.recv(4096):
+            pass
+    finally:
+        c.close()
+    return (time.perf_counter() - t0) * 1000
+
+
+class KeepAliveClient:
+    """沿用同一條連線，依 Content-Length 切出每個回應"""
+    def __init__(self, port):
+        self.port = port
+        self.sock = None
+        self.buf = b""
+        self.connects = 0
+
+    def _connect(self):
+        self.sock = socket.create_connection(("127.0.0.1", self.port))
+        self.buf = b""
+        self.connects += 1
+
+    def read_response(self):
+        while b"\r\n\r\n" not in self.buf:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ConnectionError("連線被關閉")
+            self.buf += data
+        head, rest = self.buf.split(b"\r\n\r\n", 1)
+        length = 0
+        close = False
+        for h in head.split(b"\r\n")[1:]:
+            k, _, v = h.partition(b":")
+            if k.lower() == b"content-length":
+                length = int(v)
+            elif k.lower() == b"connection" and v.strip().lower() == b"close":
+                close = True
+        while len(rest) < length:
+            rest += self.sock.recv(4096)
+        self.buf = rest[length:]
+        if close:
+            self.sock.close()
+            self.sock = None
+        return head, rest[:length]
+
+    def request(self, data=REQUEST):
+        t0 = time.perf_counter()
+        if self.sock is None:
+            self._connect()
+        self.sock.sendall(data)
+        self.read_response()
+        return (time.perf_counter() - t0) * 1000
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+
+
+def percentile(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p / 100))]
+
+
+async def run_mode(mode, requests, concurrencies, idle_secs):
+    port = free_port()
+    keep = mode == "keep"
+    with open(os.devnull, "w") as null:
+        out, sys.stdout = sys.stdout, null
+        try:
+            server = asyncio.ensure_future(make_app().start(port, mode="stream" if keep else mode))
+            await asyncio.sleep(0.2)
+        finally:
+            sys.stdout = out
+
+    loop = asyncio.get_running_loop()
+    results = []
+    for conc in concurrencies:
+        pool = ThreadPoolExecutor(conc)
+        per = requests // conc
+
+        def worker():
+            if not keep:
+                return [one_request(port) for _ in range(per)], per
+            c = KeepAliveClient(port)
+            lat = [c.request() for _ in range(per)]
+            c.close()
+            return lat, c.connects
+
+        t0 = time.perf_counter()
+        lat = []
+        connects = 0
+        for part, n in await asyncio.gather(*[loop.run_in_executor(pool, worker) for _ in range(conc)]):
+            lat += part
+            connects += n
+        wall = time.perf_counter() - t0
+        pool.shutdown()
+        results.append((conc, percentile(lat, 50), percentile(lat, 99), len(lat) / wall, connects))
+
+    # 閒置時的 CPU 用量：輪詢模式即使沒有連線也會一直醒來
+    c0 = time.process_time()
+    await asyncio.sleep(idle_secs)
+    idle = (time.process_time() - c0) / idle_secs * 1000
+
+    pipelined = await loop.run_in_executor(None, check_pipelining, port) if keep else None
+    static = await loop.run_in_executor(None, check_static, port) if keep else None
+    limited = await loop.run_in_executor(None, check_limit, port) if keep else None
+    metrics = await loop.run_in_executor(None, check_metrics, port) if keep else None
+
+    server.cancel()
+    try:
+        await server
+    except BaseException:
+        pass
+    return results, idle, pipelined, static, limited, metrics
+
+
+def check_pipelining(port, n=10):
+    """一次送出 n 個請求（最後一個要求關閉連線），回傳收到的完整回應數"""
+    c = KeepAliveClient(port)
+    c._connect()
+    c.sock.sendall(REQUEST * (n - 1) + REQUEST_CLOSE)
+    got = 0
+    try:
+        while got < n:
+            head, body = c.read_response()
+            if head.startswith(b"HTTP/1.1 200") and body:
+                got += 1
+    except (ConnectionError, AttributeError):
+        pass
+    c.close()
+    return got
+
+
+def check_limit(port, n=100):
+    """同一個用戶端連續送 n 個請求，統計各狀態碼的次數與平均延遲"""
+    c = KeepAliveClient(port)
+    c._connect()
+    out = {}
+    for _ in range(n):
+        t0 = time.perf_counter()
+        c.sock.sendall(b"GET /api/limited HTTP/1.1\r\nHost: bench\r\n\r\n")
+        head, body = c.read_response()
+        ms = (time.perf_counter() - t0) * 1000
+        code = head.split(b" ")[1].decode()
+        cnt, total = out.get(code, (0, 0))
+        out[code] = (cnt + 1, total + ms)
+    c.close()
+    return {k: (cnt, total / cnt) for k, (cnt, total) in out.items()}
+
+
+def check_metrics(port):
+    """讀 /api/metrics，回傳 {路由: (次數, 錯誤, 中位數落在哪一格的上限)} 與本文大小"""
+    c = socket.create_connection(("127.0.0.1", port))
+    c.sendall(b"GET /api/metrics HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n")
+    data = b""
+    while True:
+        x = c.recv(4096)
+        if not x:
+            break
+        data += x
+    c.close()
+    text = data.partition(b"\r\n\r\n")[2].decode()
+    out = {}
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        name, _, value = line.rpartition(" ")
+        if "{" not in name:
+            continue
+        metric, labels = name[:-1].split("{", 1)
+        route = labels.split('"')[1]
+        row = out.setdefault(route, {"count": 0, "errors": 0, "le": []})
+        if metric == "webapp_requests_total":
+            row["count"] = int(value)
+        elif metric == "webapp_request_errors_total":
+            row["errors"] = int(value)
+        elif metric == "webapp_request_duration_seconds_bucket":
+            row["le"].append((labels.split('le="')[1].rstrip('"'), int(value)))
+    res = {}
+    for route, row in out.items():
+        p50 = next(le for le, n in row["le"] if n * 2 >= row["count"])
+        res[route] = (row["count"], row["errors"], p50)
+    return res, len(text)
+
+
+def check_static(port):
+    """控制頁：完整下載、接受 gzip、帶 If-None-Match 重新整理時各傳了多少位元組"""
+    c = KeepAliveClient(port)
+    c._connect()
+    out = []
+    etag = None
+    for name, extra in (("完整", ""), ("gzip", "Accept-Encoding: gzip, deflate\r\n"), ("304", None)):
+        if extra is None:
+            extra = "Accept-Encoding: gzip\r\nIf-None-Match: %s\r\nConnection: close\r\n" % etag
+        c.sock.sendall(("GET / HTTP/1.1\r\nHost: bench\r\n%s\r\n" % extra).encode())
+        head, body = c.read_response()
+        for h in head.split(b"\r\n"):
+            if h.lower().startswith(b"etag:"):
+                etag = h[5:].strip().decode()
+        out.append((name, head.split(b" ")[1].decode(), len(head) + 4 + len(body)))
+    c.close()
+    return out
+
+
+def slow_request(port, delay):
+    """送出請求行後停 delay 秒才送完標頭，回傳狀態碼（連線失敗為 0）"""
+    try:
+        c = socket.create_connection(("127.0.0.1", port), timeout=10)
+        c.sendall(b"GET /api/time HTTP/1.1\r\n")
+        time.sleep(delay)
+        c.sendall(b"Host: bench\r\nConnection: close\r\n\r\n")
+        data = b""
+        while True:
+            x = c.recv(4096)
+            if not x:
+                break
+            data += x
+        c.close()
+        return int(data.split(b" ", 2)[1])
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+async def run_flood(clients, limit):
+    app = make_app()
+    if not limit:
+        app.max_conns = app.max_queue = 10 ** 6
+    port = free_port()
+    with open(os.devnull, "w") as null:
+        out, sys.stdout = sys.stdout, null
+        try:
+            server = asyncio.ensure_future(app.start(port))
+            await asyncio.sleep(0.2)
+        finally:
+            sys.stdout = out
+
+    lag = []
+    stop = []
+
+    async def ticker():
+        # 代替 alarm_task：每 10 ms 醒來一次，記錄比預定晚了多少
+        while not stop:
+            t0 = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag.append((time.perf_counter() - t0) * 1000 - 10)
+
+    tick = asyncio.ensure_future(ticker())
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(clients)
+    codes = await asyncio.gather(*[loop.run_in_executor(pool, slow_request, port, 0.3)
+                                   for _ in range(clients)])
+    pool.shutdown()
+    stop.append(1)
+    await tick
+    server.cancel()
+    try:
+        await server
+    except BaseException:
+        pass
+    return app.stats, codes, lag
+
+
+def main():
+    ap = argparse.ArgumentParser(description="比較 WebApp 輪詢與事件驅動模式")
+    ap.add_argument("--requests", type=int, default=400)
+    ap.add_argument("--concurrency", default="1,4")
+    ap.add_argument("--modes", default="poll,stream,keep")
+    ap.add_argument("--idle", type=float, default=2.0, help="量測閒置 CPU 的秒數")
+    ap.add_argument("--flood", type=int, default=0, help="同時湧入的慢速用戶端數（0 = 不測）")
+    args = ap.parse_args()
+    concs = [int(x) for x in args.concurrency.split(",")]
+
+    print("%-8s %6s %10s %10s %10s %8s" % ("模式", "並行", "p50 ms", "p99 ms", "req/s", "連線數"))
+    gz = compress(PAGE)[1] is not None
+    try:
+        run_all(args, concs)
+    finally:
+        if gz:
+            os.remove(PAGE + ".gz")
+    if args.flood:
+        print()
+        print("%-8s %8s %8s %8s %8s %10s" % ("名額", "同時最多", "200", "503", "逾時", "迴圈延遲 p99"))
+        default = WebApp("bench")
+        for limit in (False, True):
+            stats, codes, lag = asyncio.run(run_flood(args.flood, limit))
+            print("%-8s %8d %8d %8d %8d %9.2f ms" % (
+                "%d+%d" % (default.max_conns, default.max_queue) if limit else "不限",
+                stats["peak"], codes.count(200), codes.count(503), stats["timeouts"], percentile(lag, 99)))
+
+
+def run_all(args, concs):
+    for mode in args.modes.split(","):
+        results, idle, pipelined, static, limited, metrics = asyncio.run(
+            run_mode(mode, args.requests, concs, args.idle))
+        for conc, p50, p99, rps, connects in results:
+            print("%-8s %6d %10.2f %10.2f %10.0f %8d" % (mode, conc, p50, p99, rps, connects))
+        print("%-8s 閒置 CPU %.2f ms/s" % (mode, idle))
+        if pipelined is not None:
+            print("%-8s 管線化：一次送出 10 個請求，收到 %d 個回應" % (mode, pipelined))
+        if static is not None:
+            print("%-8s 控制頁：" % mode + "、".join("%s %s %d B" % s for s in static))
+        if limited is not None:
+            print("%-8s 限流（每秒 5 個、突發 10）：" % mode + "、".join(
+                "%s × %d（平均 %.2f ms）" % (k, n, ms) for k, (n, ms) in sorted(limited.items())))
+        if metrics is not None:
+            routes, size = metrics
+            print("%-8s /api/metrics %d B：" % (mode, size) + "、".join(
+                "%s %d 次（錯誤 %d，p50 ≤ %s s）" % ((r,) + v) for r, v in sorted(routes.items())))
+
+
+if __name__ == "__main__":
+    main()
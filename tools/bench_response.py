@@ -0,0 +1,198 @@
+# 量測 WebApp 組回應的成本（在電腦 (CPython) 上執行）：
+#   舊版：str(result) 當本文、每次用 % 組整段標頭再 encode() 後串接本文
+#   新版：ujson.dumps 產生真正的 JSON、快取的標頭前綴、寫進可重複使用的緩衝區
+# 兩者都從已序列化好的本文開始組，只比較組回應本身；
+# 報告每個回應的耗時，以及組回應期間 heap 的峰值增量（tracemalloc），
+# 也就是 MicroPython 上 GC 要回收的暫存量的參考值。
+# 另外比較首頁樣板：舊版整頁讀進來逐一 replace，新版編譯快取後分段輸出；
+# 以及 /api/alarms 整份清單與 ?since= 差異查詢（只改一筆時）的序列化成本，
+# 和每個請求記錄延遲直方圖 (Metrics.observe) 的耗時與配置量。
+#
+# 用法：python tools/bench_response.py [--alarms 20] [--rounds 2000]
+
+import os, sys, json, time, argparse, tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+for p in (os.path.join(HERE, "..", "模組"), os.path.join(HERE, "fakes")):
+    sys.path.insert(0, p)
+
+import aiot_tools
+from aiot_tools import WebApp
+from alarm_store import AlarmTable, from_dict, to_dict
+
+PAGE = os.path.join(HERE, "..", "hw3_clock_v3.html")
+
+
+def legacy_frame(app, result, keep):
+    """user-015 之前組回應的寫法，留作比較"""
+    status, ctype, body = result
+    body = body.encode() if isinstance(body, str) else body
+    if keep:
+        conn = "keep-alive\r\nKeep-Alive: timeout=%d, max=%d" % (app.idle_timeout, app.max_requests)
+    else:
+        conn = "close"
+    return (("HTTP/1.1 %s\r\n"
+             "Content-Type: %s\r\n"
+             "Content-Length: %d\r\n"
+             "Connection: %s\r\n\r\n" % (status, ctype, len(body), conn)).encode() + body,)
+
+
+def new_frame(app, result, keep):
+    return app._response(result, keep)
+
+
+def make_payloads(n):
+    """(名稱, 舊版的 (狀態, 類型, 本文), 新版的 (狀態, 類型, 本文))；本文已先序列化好"""
+    alarms = [{"id": i + 1, "y": -1, "m": -1, "d": -1, "h": i % 24, "min": i % 60,
+               "enabled": True, "song": "NOTES_STAR", "repeat": "weekdays"} for i in range(n)]
+    text = ("200 OK", "text/html", "2026-01-01 00:00:00")
+    out = [("時間字串", text, text)]
+    for name, d in (("小 JSON", {"ok": True}), ("鬧鐘清單", {"alarms": alarms})):
+        out.append((name, ("200 OK", "application/json", str(d)),
+                    ("200 OK", "application/json", json.dumps(d))))
+    return out
+
+
+def measure(fn, app, result, rounds):
+    fn(app, result, True)  # 暖身：讓快取的標頭前綴先建好
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        fn(app, result, True)
+    us = (time.perf_counter() - t0) / rounds * 1e6
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    parts = fn(app, result, True)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    size = sum(len(p) for p in parts)
+    del parts
+    return us, peak, size
+
+
+def legacy_template(file, **kwargs):
+    """user-016 之前的 render_template"""
+    with open(file, "r") as f:
+        html = f.read()
+    for key, value in kwargs.items():
+        html = html.replace("{" + key + "}", str(value))
+    return html.encode()
+
+
+def serve_template():
+    stream = aiot_tools.render_template(PAGE, time="2026-01-01 00:00:00", alarms="<li>1</li>" * 20)
+    n = 0
+    for chunk in stream.chunks:  # 模擬逐段送到 socket：每段用完即丟
+        n += len(chunk)
+    return n
+
+
+def bench_template(rounds):
+    kw = dict(time="2026-01-01 00:00:00", alarms="<li>1</li>" * 20)
+    rows = []
+    for label, fn in (("舊", lambda: len(legacy_template(PAGE, **kw))), ("新", serve_template)):
+        fn()  # 暖身：新版在這裡編譯並快取樣板
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            fn()
+        us = (time.perf_counter() - t0) / rounds * 1e6
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        size = fn()
+        peak = tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+        rows.append((label, us, peak, size))
+    return rows
+
+
+def bench_delta(n, rounds):
+    """n 組鬧鐘、只切換一組之後：整份清單 vs 差異查詢的 µs 與位元組數"""
+    t = AlarmTable()
+    for i in range(n):
+        t.put(from_dict({"id": i + 1, "y": -1, "m": -1, "d": -1, "h": i % 24, "min": i % 60,
+                         "enabled": True, "song": "NOTES_STAR"}))
+    t.rebase()
+    t.set_enabled(n // 2, False)
+
+    def full():
+        return json.dumps({"version": t.version, "alarms": t.dicts()})
+
+    def delta():
+        added, changed, removed = t.changes_since(0)
+        return json.dumps({"version": t.version, "added": [to_dict(t.get(a)) for a in added],
+                           "changed": [to_dict(t.get(a)) for a in changed], "removed": removed})
+
+    out = []
+    for fn in (full, delta):
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            body = fn()
+        out.append(((time.perf_counter() - t0) / rounds * 1e6, len(body)))
+    return out
+
+
+def bench_observe(rounds):
+    """Metrics.observe() 的 µs/次與 heap 峰值；延遲值涵蓋每一格直方圖"""
+    m = aiot_tools.Metrics()
+    func = bench_observe
+    m.route(func, "/api/time", None)
+    samples = [50 << (i % 18) for i in range(64)]
+    t0 = time.perf_counter()
+    for i in range(rounds):
+        m.observe(func, samples[i & 63], False)
+    us = (time.perf_counter() - t0) / rounds * 1e6
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    for us_ in samples:
+        m.observe(func, us_, True)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    text = "".join(m.lines())
+    assert 'le="+Inf"} %d' % (rounds + len(samples)) in text
+    return us, peak, len(text)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="比較新舊回應序列化的耗時與暫存配置")
+    ap.add_argument("--alarms", type=int, default=20, help="鬧鐘清單的筆數")
+    ap.add_argument("--rounds", type=int, default=2000)
+    args = ap.parse_args()
+
+    app = WebApp("bench")
+    print("%-10s %-4s %10s %12s %10s" % ("回應", "版本", "µs/次", "heap 峰值 B", "大小 B"))
+    for name, old, new in make_payloads(args.alarms):
+        for label, fn, result in (("舊", legacy_frame, old), ("新", new_frame, new)):
+            us, peak, size = measure(fn, app, result, args.rounds)
+            print("%-10s %-4s %10.2f %12d %10d" % (name, label, us, peak, size))
+    print("（本文已先序列化；新版 %d B 以內的回應整個寫在同一塊緩衝區）" % len(app._out))
+
+    print()
+    print("%-10s %-4s %10s %12s %10s" % ("首頁", "版本", "µs/次", "heap 峰值 B", "大小 B"))
+    for label, us, peak, size in bench_template(args.rounds // 10 or 1):
+        print("%-10s %-4s %10.2f %12d %10d" % ("樣板", label, us, peak, size))
+    print("（新版每段最多 %d B）" % aiot_tools.TEMPLATE_CHUNK)
+
+    print()
+    print("%8s %14s %10s %14s %10s" % ("鬧鐘數", "整份 µs", "整份 B", "差異 µs", "差異 B"))
+    for n in (10, 100, 1000):
+        (fu, fb), (du, db) = bench_delta(n, max(1, args.rounds // n))
+        print("%8d %14.1f %10d %14.1f %10d" % (n, fu, fb, du, db))
+
+    us, peak, size = bench_observe(args.rounds * 10)
+    print()
+    print("記錄一次路由延遲：%.2f µs/次，連續 64 次的 heap 峰值 %d B；/api/metrics 一條路由 %d B"
+          % (us, peak, size))
+    print("（CPython 的 int 超過 256 就是物件，峰值是暫存的 int；MicroPython 的 small int 不配置 heap）")
+
+    # 確認新版的 JSON 本文可以被瀏覽器解析（舊版 str(dict) 產生的是 Python 語法）
+    result = ("200 OK", "application/json", json.dumps({"ok": True, "x": None}))
+    head, _, body = bytes(new_frame(app, result, False)[0]).partition(b"\r\n\r\n")
+    assert json.loads(body) == {"ok": True, "x": None}
+    assert b"Content-Length: %d" % len(body) in head
+
+
+if __name__ == "__main__":
+    main()
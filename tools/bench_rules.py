@@ -0,0 +1,42 @@
+# 在電腦 (CPython) 上量測重複規則的比對成本
+# 用法：python tools/bench_rules.py
+#
+# 規則在存檔時就編譯成位元遮罩，比對時只做固定幾次位元運算，
+# 所以規則越複雜，每次比對的時間應該維持不變。
+
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "模組"))
+
+from alarm_sched import compile_rule, rule_match, days_from_civil, civil_from_days
+
+N = 200000
+
+RULES = [
+    ("每天", {"repeat": "daily"}),
+    ("平日", {"repeat": "weekdays"}),
+    ("每週一三五", {"days": [0, 2, 4]}),
+    ("每 3 天", {"every": 3}),
+    ("每月第 2 個星期一", {"nth": 2, "wday": 0}),
+    ("1、7 月最後一個星期四，每 14 天", {"nth": -1, "wday": 3, "months": [1, 7], "every": 14}),
+]
+
+
+def bench(r, dates):
+    t0 = time.perf_counter()
+    for y, m, d in dates:
+        rule_match(r, y, m, d)
+    return (time.perf_counter() - t0) / len(dates) * 1e9
+
+
+def main():
+    start = days_from_civil(2026, 1, 1)
+    dates = [civil_from_days(start + i % 3650) for i in range(N)]
+    print("%-32s %10s" % ("規則", "ns/次"))
+    for name, spec in RULES:
+        _, r = compile_rule(spec, start)
+        print("%-32s %10.1f" % (name, bench(r, dates)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# 量測鬧鐘存檔的成本：
+#   1. 緊湊紀錄 (AlarmTable) 與舊版 dict 清單的記憶體用量、檔案大小
+#   2. 每次異動寫入的位元組與開機載入時間
+#   3. 網頁連續操作時合併寫入的效果（以虛擬時鐘模擬）
+# 用法：python tools/bench_store.py [鬧鐘數 ...]
+#
+# 記憶體以 tracemalloc 量測 CPython 的配置量；MicroPython 的 dict 每個
+# 鍵值對同樣要配置雜湊表與物件，比例相近，可作為板子上的參考。
+
+import os, sys, time, shutil, tempfile, random, tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+for p in (os.path.join(HERE, "..", "模組"), os.path.join(HERE, "fakes"), HERE):
+    sys.path.insert(0, p)
+
+import json
+import vclock
+vclock.install(0)
+import uasyncio as asyncio
+from alarm_store import AlarmJournal, AlarmTable, OP_PUT, SNAP_HEAD, from_dict
+
+MUTATIONS = 100
+
+
+def make_alarms(n, seed=1):
+    rnd = random.Random(seed)
+    return [{"y": -1, "m": -1, "d": -1, "h": rnd.randrange(24), "min": rnd.randrange(60),
+             "enabled": True, "song": "NOTES_STAR", "id": i + 1} for i in range(n)]
+
+
+def make_table(alarms):
+    t = AlarmTable()
+    for a in alarms:
+        t.put(from_dict(a))
+    return t
+
+
+def measure(build):
+    """回傳 build() 產生的物件仍存活時多配置的位元組"""
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del obj
+    return used
+
+
+def bench_size(n):
+    """dict 清單 + JSON 與緊湊紀錄表 + 二進位快照的記憶體、檔案大小"""
+    dict_ram = measure(lambda: json.loads(json.dumps(make_alarms(n))))
+    table_ram = measure(lambda: AlarmTable(bytes(make_table(make_alarms(n)).buf)))
+    json_file = len(json.dumps(make_alarms(n)))
+    bin_file = SNAP_HEAD + len(make_table(make_alarms(n)).buf)
+    return dict_ram, table_ram, json_file, bin_file
+
+
+def bench(n):
+    alarms = make_alarms(n)
+    table = make_table(alarms)
+    rewrite = SNAP_HEAD + len(table.buf)  # 舊做法：每次異動重寫整個快照
+
+    j = AlarmJournal("alarms.bin", "alarms.jnl", limit=1 << 30)
+    j.compact(table)
+    for i in range(MUTATIONS):
+        aid = alarms[i % n]["id"]
+        rec = table.set_enabled(aid, not table.get(aid)[6])
+        j.append(OP_PUT, rec)
+        j.flush()  # 每筆都立即寫入，量測單筆異動的成本
+    per_mut = (j.stats["bytes_written"] - rewrite) / MUTATIONS
+
+    t0 = time.perf_counter()
+    loaded = AlarmJournal("alarms.bin", "alarms.jnl").load()
+    load_ms = (time.perf_counter() - t0) * 1000
+    assert list(loaded) == list(table)
+    return rewrite, per_mut, load_ms
+
+
+def bench_burst(edits=30, gap_ms=150):
+    """每 gap_ms 毫秒一次異動，連續 edits 次，統計實際寫入次數"""
+    loop = asyncio.get_event_loop()
+    alarms = make_alarms(edits)
+    j = AlarmJournal("burst.bin", "burst.jnl", legacy=("burst.json", "burst.log"))
+    table = j.load()
+    base = dict(j.stats)
+
+    async def burst():
+        for a in alarms:
+            j.append(OP_PUT, table.put(from_dict(a)))
+            await asyncio.sleep_ms(gap_ms)
+
+    loop.spawn(j.run(lambda: table))
+    loop.spawn(burst())
+    loop.run_until(loop.clock.time() + 60)
+    return {k: j.stats[k] - base.get(k, 0) for k in ("mutations", "coalesced", "flushes", "bytes_written")}
+
+
+def main():
+    sizes = [int(x) for x in sys.argv[1:]] or [10, 100, 1000, 10000]
+    work = tempfile.mkdtemp(prefix="alarm_store_")
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        print("%8s %12s %12s %7s %12s %12s %7s" % (
+            "鬧鐘數", "dict RAM", "紀錄 RAM", "倍數", "JSON 檔", "二進位檔", "倍數"))
+        for n in sizes:
+            dr, tr, jf, bf = bench_size(n)
+            print("%8d %12d %12d %6.1fx %12d %12d %6.1fx" % (n, dr, tr, dr / tr, jf, bf, jf / bf))
+        print()
+        print("%8s %14s %14s %12s" % ("鬧鐘數", "重寫 B/次", "日誌 B/次", "載入 ms"))
+        for n in sizes:
+            rewrite, per_mut, load_ms = bench(n)
+            print("%8d %14d %14.1f %12.2f" % (n, rewrite, per_mut, load_ms))
+        st = bench_burst()
+        print("\n連續 %d 次異動（間隔 150 ms）：寫入 %d 次、合併 %d 次、共 %d B" % (
+            st["mutations"], st["flushes"], st["coalesced"], st["bytes_written"]))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
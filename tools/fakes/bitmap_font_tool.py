@@ -0,0 +1,17 @@
+# bitmap_font_tool 替身：真正的 draw_text 只在 MicroPython 上定義，
+# 這裡只計算繪製的字數，不讀字型檔
+
+drawn = 0
+
+
+def set_font_path(path):
+    pass
+
+
+def get_bitmap(ch):
+    return bytes(12)
+
+
+def draw_text(oled, text, x, y):
+    global drawn
+    drawn += len(text)
@@ -0,0 +1,18 @@
+# framebuf 替身：保留緩衝區與尺寸，繪圖操作只計數
+
+MONO_VLSB = 0
+MONO_HLSB = 3
+MONO_HMSB = 4
+
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, format, stride=None):
+        self.buffer = buffer
+        self.width = width
+        self.height = height
+        self.draws = 0
+
+    def _draw(self, *args):
+        self.draws += 1
+
+    fill = pixel = hline = vline = line = rect = fill_rect = text = scroll = blit = _draw
@@ -0,0 +1,82 @@
+# machine 模組替身：讓主程式能在電腦 (CPython) 上匯入與執行
+# 只記錄呼叫，不碰任何硬體
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 2
+
+    def __init__(self, id, mode=-1, *args, **kwargs):
+        self.id = id
+        self._value = 0
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = v
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+
+class PWM:
+    def __init__(self, pin, freq=1000, duty=0):
+        self.pin = pin
+        self._freq = freq
+        self._duty = duty
+
+    def freq(self, f=None):
+        if f is None:
+            return self._freq
+        self._freq = f
+
+    def duty(self, d=None):
+        if d is None:
+            return self._duty
+        self._duty = d
+
+    def deinit(self):
+        self._duty = 0
+
+
+class I2C:
+    def __init__(self, id, scl=None, sda=None, freq=400000):
+        self.writes = 0
+
+    def writeto(self, addr, buf):
+        self.writes += 1
+        return len(buf)
+
+    def writevto(self, addr, vector):
+        self.writes += 1
+
+    def scan(self):
+        return [0x3C]
+
+
+class SoftSPI:
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+SPI = SoftSPI
+
+
+class RTC:
+    _datetime = (2000, 1, 1, 5, 0, 0, 0, 0)
+
+    def datetime(self, dt=None):
+        if dt is None:
+            return RTC._datetime
+        RTC._datetime = tuple(dt)
+
+
+def reset():
+    raise SystemExit("machine.reset()")
+
+
+def freq(f=None):
+    return 240000000
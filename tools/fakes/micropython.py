@@ -0,0 +1,9 @@
+# micropython 模組替身
+
+
+def const(x):
+    return x
+
+
+def mem_info(*args):
+    pass
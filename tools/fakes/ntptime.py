@@ -0,0 +1,6 @@
+# ntptime 替身：settime() 不做事
+host = "pool.ntp.org"
+
+
+def settime():
+    pass
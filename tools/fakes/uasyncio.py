@@ -0,0 +1,6 @@
+# uasyncio 替身（真實時間版）：直接使用 CPython 的 asyncio
+from asyncio import *
+
+
+async def sleep_ms(ms):
+    await sleep(ms / 1000)
@@ -0,0 +1,2 @@
+# ujson 替身
+from json import dumps, loads, dump, load
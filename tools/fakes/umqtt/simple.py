@@ -0,0 +1,33 @@
+# umqtt.simple 替身：不連 Broker，把 publish 的內容記在 published 清單中
+
+
+class MQTTClient:
+    published = []   # 所有 client 共用，方便測試程式檢查
+
+    def __init__(self, client_id, server, port=0, user=None, password=None,
+                 keepalive=0, ssl=False, ssl_params={}):
+        self.client_id = client_id
+        self.server = server
+        self.connected = False
+
+    def connect(self, clean_session=True):
+        self.connected = True
+        return 0
+
+    def disconnect(self):
+        self.connected = False
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        MQTTClient.published.append((topic, msg))
+
+    def subscribe(self, topic, qos=0):
+        pass
+
+    def set_callback(self, f):
+        pass
+
+    def check_msg(self):
+        pass
+
+    def ping(self):
+        pass
@@ -0,0 +1,33 @@
+# urequests 替身：改用 CPython 的 urllib（只在真的需要上網時才會被呼叫）
+import json
+from urllib import request as _request
+
+
+class Response:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode("utf-8", "ignore")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        pass
+
+
+def request(method, url, data=None, json=None, headers={}):
+    if json is not None:
+        import json as _json
+        data = _json.dumps(json).encode()
+    req = _request.Request(url, data=data, headers=headers, method=method)
+    with _request.urlopen(req) as r:
+        return Response(r.status, r.read())
+
+
+def get(url, **kw):
+    return request("GET", url, **kw)
+
+
+def post(url, **kw):
+    return request("POST", url, **kw)
@@ -0,0 +1,2 @@
+# uselect 替身
+from select import *
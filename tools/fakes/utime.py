@@ -0,0 +1,31 @@
+# utime 替身（真實時間版），模擬器 tools/vclock.py 會改用虛擬時鐘
+import time as _time
+from time import time, sleep, localtime, gmtime
+
+
+def mktime(t):
+    return int(_time.mktime(tuple(t[:8]) + (-1,)))
+
+
+def sleep_ms(ms):
+    _time.sleep(ms / 1000)
+
+
+def sleep_us(us):
+    _time.sleep(us / 1000000)
+
+
+def ticks_ms():
+    return _time.monotonic_ns() // 1000000
+
+
+def ticks_us():
+    return _time.monotonic_ns() // 1000
+
+
+def ticks_add(t, delta):
+    return t + delta
+
+
+def ticks_diff(a, b):
+    return a - b
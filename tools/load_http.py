@@ -0,0 +1,303 @@
+# 主程式的負載測試（在電腦 (CPython) 上執行）：
+# 用 tools/fakes 的 machine / network / umqtt / framebuf 替身匯入 hw3_clock_v2_main，
+# 讓真正的 WebApp 與路由跑在本機迴路位址上（alarm_task 與 journal.run 照常在背景執行），
+# 再以多個持久連線的用戶端依比例混合送出 GET /api/alarms、/api/time、新增 / 刪除鬧鐘等請求。
+#
+# 報告每種並行數的吞吐量、p50 / p90 / p99 / 最大延遲、各狀態碼與錯誤率，
+# 以及各種請求各自的延遲；--json 存成 JSON，--baseline 與上一版存下的 JSON 比較。
+#
+# 用法：
+#   python tools/load_http.py --concurrency 1,4,8 --requests 2000
+#   python tools/load_http.py --mix alarms:50,time:30,post:10,delete:10 --json load.json
+#   python tools/load_http.py --baseline load_old.json
+#
+# 預設關閉 /api/* 的限流（所有用戶端都來自 127.0.0.1，否則只會量到 429）；--limits 保留。
+# 並行數超過 WebApp 的連線名額 + 佇列（6 + 4）時會出現 503，這也算在錯誤率裡。
+
+import os, sys, json, time, random, shutil, tempfile, threading, argparse, platform, subprocess
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+for p in (ROOT, os.path.join(ROOT, "模組", "lib"), os.path.join(ROOT, "模組"), os.path.join(HERE, "fakes"), HERE):
+    sys.path.insert(0, p)
+
+import asyncio
+from bench_http import KeepAliveClient, free_port, percentile
+
+DEFAULT_MIX = "alarms:50,time:30,post:10,delete:10"
+OPS = ("alarms", "time", "post", "delete", "toggle", "since")
+
+
+def load_main(workdir):
+    """在 workdir 裡匯入主程式（匯入期間不執行 asyncio.run(main())），回傳模組"""
+    import uasyncio
+    run = uasyncio.run
+    uasyncio.run = lambda coro: coro.close()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+            import hw3_clock_v2_main as main
+            main.mqtt_init()
+    finally:
+        os.chdir(cwd)
+        uasyncio.run = run
+    return main
+
+
+def seed_alarms(main, n, rnd):
+    with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+        for _ in range(n):
+            main.insert_alarm(main.build_alarm({"y": -1, "m": -1, "d": -1, "h": rnd.randrange(24),
+                                                "min": rnd.randrange(60), "repeat": "weekdays"}))
+    return [rec[main.A_ID] for rec in main.table]
+
+
+class Pool:
+    """用戶端共用的鬧鐘 id：新增時放進來，刪除時取出，同一個 id 不會被兩個用戶端刪"""
+    def __init__(self, ids):
+        self.ids = list(ids)
+        self.lock = threading.Lock()
+        self.version = 0
+
+    def put(self, aid):
+        with self.lock:
+            self.ids.append(aid)
+
+    def take(self, rnd):
+        with self.lock:
+            if not self.ids:
+                return None
+            return self.ids.pop(rnd.randrange(len(self.ids)))
+
+    def pick(self, rnd):
+        with self.lock:
+            return self.ids[rnd.randrange(len(self.ids))] if self.ids else None
+
+
+def parse_mix(text):
+    mix = []
+    for part in text.split(","):
+        name, _, weight = part.partition(":")
+        if name not in OPS:
+            raise SystemExit("未知的請求種類 %r（可用：%s）" % (name, ", ".join(OPS)))
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def build(op, pool, rnd):
+    """回傳 (實際的請求種類, 請求位元組)；沒有鬧鐘可刪 / 切換時改送新增"""
+    body = b""
+    if op in ("delete", "toggle"):
+        aid = pool.take(rnd) if op == "delete" else pool.pick(rnd)
+        if aid is None:
+            op = "post"
+        elif op == "delete":
+            head = "DELETE /api/alarms/%d" % aid
+        else:
+            head = "POST /api/alarms/%d/toggle" % aid
+    if op == "post":
+        body = json.dumps({"h": rnd.randrange(24), "min": rnd.randrange(60), "y": -1, "m": -1, "d": -1,
+                           "repeat": rnd.choice(["weekdays", "weekend", ""])}).encode()
+        head = "POST /api/alarms"
+    elif op == "alarms":
+        head = "GET /api/alarms"
+    elif op == "since":
+        head = "GET /api/alarms?since=%d" % max(pool.version - 2, 0)
+    elif op == "time":
+        head = "GET /api/time"
+    extra = "Content-Type: application/json\r\nContent-Length: %d\r\n" % len(body) if body else ""
+    return op, ("%s HTTP/1.1\r\nHost: load\r\n%s\r\n" % (head, extra)).encode() + body
+
+
+def check(op, head, body, pool):
+    """回傳 (狀態碼, 是否成功)；新增成功時把新的 id 放進 pool"""
+    code = int(head.split(b" ", 2)[1])
+    if code != 200:
+        return code, False
+    if op in ("alarms", "time", "since"):
+        if op != "time":
+            pool.version = json.loads(body).get("version", pool.version)
+        return code, True
+    data = json.loads(body)
+    if not data.get("ok"):
+        return code, False
+    if op == "post" and data["alarms"]:
+        pool.put(max(a["id"] for a in data["alarms"]))
+    return code, True
+
+
+def worker(port, n, mix, pool, seed):
+    """送出 n 個請求，回傳 [(種類, 毫秒, 狀態碼, 是否成功)]；連線斷掉時重新連線，狀態碼記為 0"""
+    rnd = random.Random(seed)
+    names = [m[0] for m in mix]
+    weights = [m[1] for m in mix]
+    c = KeepAliveClient(port)
+    out = []
+    for _ in range(n):
+        op, data = build(rnd.choices(names, weights)[0], pool, rnd)
+        t0 = time.perf_counter()
+        try:
+            if c.sock is None:
+                c._connect()
+            c.sock.sendall(data)
+            head, body = c.read_response()
+            ms = (time.perf_counter() - t0) * 1000
+            code, ok = check(op, head, body, pool)
+        except (OSError, ValueError, IndexError):
+            ms = (time.perf_counter() - t0) * 1000
+            code, ok = 0, False
+            if c.sock:
+                c.sock.close()
+            c.sock = None
+        out.append((op, ms, code, ok))
+    c.close()
+    return out
+
+
+def summarize(samples, wall):
+    lat = [s[1] for s in samples]
+    codes = {}
+    for s in samples:
+        codes[str(s[2])] = codes.get(str(s[2]), 0) + 1
+    errors = sum(1 for s in samples if not s[3])
+    return {
+        "requests": len(samples),
+        "rps": round(len(samples) / wall, 1),
+        "p50_ms": round(percentile(lat, 50), 3),
+        "p90_ms": round(percentile(lat, 90), 3),
+        "p99_ms": round(percentile(lat, 99), 3),
+        "max_ms": round(max(lat), 3),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4),
+        "codes": codes,
+    }
+
+
+async def run(args, mix):
+    workdir = tempfile.mkdtemp(prefix="alarm_load_")
+    rnd = random.Random(args.seed)
+    main = load_main(workdir)
+    app = main.app
+    if not args.limits:
+        app.api_limit = None
+        app._limits.clear()
+    pool = Pool(seed_alarms(main, args.alarms, rnd))
+
+    port = free_port()
+    levels = []
+    cwd = os.getcwd()
+    os.chdir(workdir)  # journal.run 把 alarms.bin / alarms.jnl 寫在暫存資料夾
+    null = open(os.devnull, "w")
+    out, sys.stdout = sys.stdout, null  # 路由與任務的 print 不混進報告
+    tasks = []
+    try:
+        tasks.append(asyncio.ensure_future(app.start(port)))
+        tasks.append(asyncio.ensure_future(main.alarm_task()))
+        tasks.append(asyncio.ensure_future(main.journal.run(lambda: main.table)))
+        await asyncio.sleep(0.2)
+
+        loop = asyncio.get_running_loop()
+        for conc in args.concurrency:
+            per = max(args.requests // conc, 1)
+            pool_exec = ThreadPoolExecutor(conc)
+            t0 = time.perf_counter()
+            parts = await asyncio.gather(*[loop.run_in_executor(pool_exec, worker, port, per, mix, pool,
+                                                                args.seed * 1000 + conc * 100 + i)
+                                           for i in range(conc)])
+            wall = time.perf_counter() - t0
+            pool_exec.shutdown()
+            main.MQTTClient.published.clear()  # 替身會記下每則發佈，別讓它一直長大
+
+            samples = [s for part in parts for s in part]
+            level = summarize(samples, wall)
+            level["concurrency"] = conc
+            level["wall_s"] = round(wall, 3)
+            level["ops"] = {}
+            for op in sorted(set(s[0] for s in samples)):
+                level["ops"][op] = summarize([s for s in samples if s[0] == op], wall)
+            level["alarms_after"] = len(main.table)
+            levels.append(level)
+    finally:
+        for t in tasks:
+            t.cancel()
+        for t in tasks:
+            try:
+                await t
+            except BaseException:
+                pass
+        sys.stdout = out
+        null.close()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return levels, dict(app.stats)
+
+
+def git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(levels, baseline=None):
+    base = {lv["concurrency"]: lv for lv in (baseline or {}).get("levels", [])}
+    print("%6s %9s %9s %9s %9s %9s %8s  %s" % ("並行", "req/s", "p50 ms", "p90 ms", "p99 ms", "max ms", "錯誤率",
+                                               "狀態碼"))
+    for lv in levels:
+        print("%6d %9.0f %9.2f %9.2f %9.2f %9.2f %7.2f%%  %s" % (
+            lv["concurrency"], lv["rps"], lv["p50_ms"], lv["p90_ms"], lv["p99_ms"], lv["max_ms"],
+            lv["error_rate"] * 100, " ".join("%s×%d" % kv for kv in sorted(lv["codes"].items()))))
+        old = base.get(lv["concurrency"])
+        if old:
+            print("%6s %+8.0f%% %+8.0f%% %9s %+8.0f%%   （與基準比較）" % (
+                "", (lv["rps"] / old["rps"] - 1) * 100, (lv["p50_ms"] / old["p50_ms"] - 1) * 100, "",
+                (lv["p99_ms"] / old["p99_ms"] - 1) * 100))
+        for op, s in sorted(lv["ops"].items()):
+            print("%6s   %-8s %6d 次 p50 %.2f ms  p99 %.2f ms  錯誤 %d" % (
+                "", op, s["requests"], s["p50_ms"], s["p99_ms"], s["errors"]))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="以真正的主程式路由做負載測試")
+    ap.add_argument("--concurrency", default="1,4,8", help="並行用戶端數，逗號分隔")
+    ap.add_argument("--requests", type=int, default=2000, help="每種並行數送出的請求總數")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="種類:比重，可用 " + ", ".join(OPS))
+    ap.add_argument("--alarms", type=int, default=20, help="開始前先建立的鬧鐘數")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--limits", action="store_true", help="保留 /api/* 的限流")
+    ap.add_argument("--json", help="把結果寫成 JSON 檔")
+    ap.add_argument("--baseline", help="與先前 --json 存下的結果比較")
+    args = ap.parse_args()
+    args.concurrency = [int(x) for x in args.concurrency.split(",")]
+    mix = parse_mix(args.mix)
+
+    levels, stats = asyncio.run(run(args, mix))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print("混合：%s；開始時 %d 組鬧鐘%s" % (args.mix, args.alarms, "；保留限流" if args.limits else ""))
+    report(levels, baseline)
+    print("伺服器計數：", ", ".join("%s=%d" % kv for kv in sorted(stats.items())))
+
+    if args.json:
+        result = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {"mix": args.mix, "requests": args.requests, "alarms": args.alarms,
+                     "seed": args.seed, "limits": args.limits},
+            "levels": levels,
+            "server": stats,
+        }
+        with open(args.json, "w") as f:
+            json.dump(result, f, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# 在電腦上把網頁資源預先壓縮成 .gz，和原檔一起上傳到板子，
+# static_file() 會在瀏覽器接受 gzip 時改送壓縮檔（板子上不必做壓縮）。
+#
+# 用法：python tools/precompress.py [檔案或資料夾 ...]
+#   不給參數時處理專案根目錄下的 .html / .css / .js / .json / .svg
+#
+# 注意：static_file() 只在 .gz 不比原檔舊時才使用它，所以上傳時請先傳原檔再傳 .gz；
+# 原檔改了卻忘了重新壓縮，板子會自動退回送原檔。
+
+import os, gzip, argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+EXTS = (".html", ".htm", ".css", ".js", ".json", ".svg")
+
+
+def targets(paths):
+    for p in paths:
+        if os.path.isdir(p):
+            for name in sorted(os.listdir(p)):
+                if name.lower().endswith(EXTS):
+                    yield os.path.join(p, name)
+        else:
+            yield p
+
+
+def compress(path, level=9):
+    """寫出 path + ".gz"；壓縮後沒有變小就刪掉 .gz，回傳 (原大小, 壓縮後大小或 None)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    # mtime=0 讓同樣的內容產生同樣的 .gz，ETag 也就不會因為重新壓縮而改變
+    packed = gzip.compress(data, compresslevel=level, mtime=0)
+    out = path + ".gz"
+    if len(packed) >= len(data):
+        if os.path.exists(out):
+            os.remove(out)
+        return len(data), None
+    with open(out, "wb") as f:
+        f.write(packed)
+    return len(data), len(packed)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="預先壓縮網頁資源")
+    ap.add_argument("paths", nargs="*", default=[ROOT])
+    ap.add_argument("--level", type=int, default=9)
+    args = ap.parse_args()
+
+    total = packed_total = 0
+    for path in targets(args.paths):
+        raw, packed = compress(path, args.level)
+        total += raw
+        packed_total += packed or raw
+        if packed is None:
+            print("%-32s %8d B  （壓縮後沒有變小，略過）" % (os.path.relpath(path), raw))
+        else:
+            print("%-32s %8d B → %6d B  (%.0f%%)" % (os.path.relpath(path), raw, packed, packed * 100 / raw))
+    if total:
+        print("合計 %d B → %d B" % (total, packed_total))
+
+
+if __name__ == "__main__":
+    main()
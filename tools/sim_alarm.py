@@ -0,0 +1,237 @@
+# 鬧鐘模擬器：在電腦 (CPython) 上用虛擬時鐘執行主程式的 alarm_task / ring_task
+# （可選 oled_task、mqtt_time_task、journal.run），模擬一整年只需幾秒。
+#
+# 用法：
+#   python tools/sim_alarm.py --days 365 --alarms 50
+#   python tools/sim_alarm.py --days 7 --tasks alarm,ring,oled,mqtt --fires
+#   python tools/sim_alarm.py --file alarms.json --json result.json
+#   python tools/sim_alarm.py --days 3 --jump 30000:5400   # 第 30000 秒時 RTC 往前調 90 分鐘
+#   python tools/sim_alarm.py --days 3 --reset 100000      # 第 100000 秒時清空鬧鐘再逐筆新增回去
+#
+# 報告內容：
+#   fires      每次觸發的 (模擬時間, 鬧鐘 id)
+#   late       補響的次數（觸發時間晚於原定的那一分鐘）
+#   skipped    主程式刻意略過（錯過太久，或補響時已有別的鬧鐘在響）的 (日期, id)
+#   missed     依 is_alarm_match 應該響、卻既沒響也沒被略過的 (日期, id)
+#   duplicate  同一天同一組鬧鐘響了不只一次
+#   extra      響了但 is_alarm_match 認為不該響
+#   wakeups    各任務被喚醒的次數
+#   metrics    主程式登記在 app.metrics 的計數（/api/metrics 的任務部分）
+
+import os, sys, json, random, shutil, tempfile, time, argparse, contextlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+for p in (ROOT, os.path.join(ROOT, "模組", "lib"), os.path.join(ROOT, "模組"), os.path.join(HERE, "fakes"), HERE):
+    sys.path.insert(0, p)
+
+import vclock
+
+
+def parse_date(s):
+    y, m, d = s.split("-")
+    return int(y), int(m), int(d)
+
+
+def gen_alarms(n, start_day, days, seed):
+    """隨機產生單次、每天與各種重複規則的鬧鐘"""
+    from alarm_sched import compile_rule, civil_from_days
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        a = {"h": rnd.randrange(24), "min": rnd.randrange(60),
+             "enabled": rnd.random() > 0.1, "song": "NOTES_STAR", "id": i + 1}
+        kind = rnd.randrange(4)
+        if kind == 0:
+            y, m, d = civil_from_days(start_day + rnd.randrange(days))
+            a.update(y=y, m=m, d=d)
+        else:
+            a.update(y=-1, m=-1, d=-1)
+            spec = [None,
+                    {"repeat": rnd.choice(["weekdays", "weekend"])},
+                    rnd.choice([{"every": rnd.randint(2, 10)},
+                                {"nth": rnd.choice([1, 2, 3, -1]), "wday": rnd.randrange(7)},
+                                {"days": rnd.sample(range(7), 3)}])][kind - 1]
+            if spec:
+                a["repeat"], a["r"] = compile_rule(spec, start_day + rnd.randrange(7))
+        out.append(a)
+    return out
+
+
+def expected_fires(app, alarms, start_day, days):
+    """以 is_alarm_match 逐日計算應觸發的 (日期, id)"""
+    from alarm_sched import civil_from_days
+    from alarm_store import from_dict
+    recs = [(a, from_dict(a)) for a in alarms if a.get("enabled", True)]
+    exp = set()
+    for n in range(start_day, start_day + days):
+        y, m, d = civil_from_days(n)
+        for a, rec in recs:
+            if app.is_alarm_match(rec, (y, m, d, a["h"], a["min"])):
+                exp.add(((y, m, d), a["id"]))
+    return exp
+
+
+def reset_time(alarms, at):
+    """
+    重置的時間點：該分鐘的第 30 秒，並避開有鬧鐘的分鐘
+    （同一分鐘裡清空後再新增，觸發紀錄已清掉，那組鬧鐘會再響一次）
+    """
+    used = set((a["h"], a["min"]) for a in alarms)
+    t = at - at % 60 + 30
+    while (t // 3600 % 24, t // 60 % 60) in used and len(used) < 1440:
+        t += 60
+    return t
+
+
+def reset_alarms(app, alarms):
+    """像 DELETE /api/alarms {"all": true} 一樣清空，再像 POST /api/alarms 一樣逐筆新增回去（沿用原 id）"""
+    app.clear_alarms()
+    for a in sorted(alarms, key=lambda a: a["id"]):
+        app.next_id = a["id"]
+        app.insert_alarm(dict(a))
+    app.next_id = max([a["id"] for a in alarms] + [0]) + 1
+
+
+def simulate(alarms, start=(2026, 1, 1), days=365, tasks=("alarm", "ring"), jumps=(), resets=()):
+    """
+    執行模擬並回傳報告 dict。
+    jumps：[(模擬秒數, 調整秒數), ...]，在指定時間調整 RTC（模擬 NTP 校正）
+    resets：[模擬秒數, ...]，在指定時間清空全部鬧鐘後再新增回去，之後應照常觸發
+    """
+    from alarm_sched import days_from_civil, DAY  # 先匯入以取得日期函式
+    start_day = days_from_civil(*start)
+    clock, loop = vclock.install(start_day * DAY)
+
+    workdir = tempfile.mkdtemp(prefix="alarm_sim_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with open("alarms.json", "w") as f:
+            json.dump(alarms, f)
+        with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+            loop.guard = True
+            import hw3_clock_v2_main as app
+            loop.guard = False
+            app.mqtt_init()
+
+            # 響鈴與略過都會標記觸發紀錄；標記前哪個計數加了一，就是哪一種
+            fires, skipped = [], []
+            mark = app.ledger.mark
+            counts = app.metrics.values
+            seen = [0, 0]
+
+            def record(aid, day):
+                fired, missed = counts["alarm_fired_total"], counts["alarm_missed_total"]
+                if fired > seen[0]:
+                    fires.append((clock.time(), aid, tuple(day)))
+                elif missed > seen[1]:
+                    skipped.append((tuple(day), aid))
+                seen[:] = [fired, missed]
+                mark(aid, day)
+            app.ledger.mark = record
+
+            if "ring" not in tasks:
+                async def ring_task(song):
+                    pass
+                app.ring_task = ring_task
+
+            loop.spawn(app.alarm_task())
+            if "oled" in tasks:
+                loop.spawn(app.oled_task())
+            if "mqtt" in tasks:
+                loop.spawn(app.mqtt_time_task())
+            if "store" in tasks:
+                loop.spawn(app.journal.run(lambda: app.table))
+
+            end = (start_day + days) * DAY  # 牆上時間；時鐘跳動後仍在同一天結束
+            t0 = time.perf_counter()
+            events = [(at, delta, False) for at, delta in jumps]
+            events += [(reset_time(alarms, start_day * DAY + at) - start_day * DAY, 0, True) for at in resets]
+            for at, delta, reset in sorted(events):
+                loop.run_until(start_day * DAY + at)
+                if reset:
+                    reset_alarms(app, alarms)
+                else:
+                    clock.jump(delta)
+            loop.run_until(end)
+            elapsed = time.perf_counter() - t0
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    exp = expected_fires(app, alarms, start_day, days)
+    skipped = set(skipped)
+    by_id = {a["id"]: a for a in alarms}
+    got = {}
+    late = 0
+    for ts, aid, day in fires:
+        key = (day, aid)
+        got[key] = got.get(key, 0) + 1
+        t = app.utime.localtime(ts)
+        if t[:3] != day or t[3:5] != (by_id[aid]["h"], by_id[aid]["min"]):
+            late += 1
+    return {
+        "days": days,
+        "alarms": len(alarms),
+        "fires": [(list(app.utime.localtime(ts)[:6]), aid) for ts, aid, day in fires],
+        "expected": len(exp),
+        "fired": len(fires),
+        "late": late,
+        "skipped": sorted([list(k[0]), k[1]] for k in skipped),
+        "missed": sorted([list(k[0]), k[1]] for k in exp if k not in got and k not in skipped),
+        "duplicate": sorted([list(k[0]), k[1], n] for k, n in got.items() if n > 1),
+        "extra": sorted([list(k[0]), k[1]] for k in got if k not in exp),
+        "wakeups": dict(loop.wakeups),
+        "metrics": dict(app.metrics.values),
+        "errors": loop.errors,
+        "wall_secs": round(elapsed, 3),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="以虛擬時鐘模擬鬧鐘任務")
+    ap.add_argument("--start", default="2026-01-01", help="模擬起始日期 YYYY-MM-DD")
+    ap.add_argument("--days", type=int, default=365)
+    ap.add_argument("--alarms", type=int, default=20, help="隨機產生的鬧鐘數")
+    ap.add_argument("--file", help="改用指定的 alarms.json")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--tasks", default="alarm,ring", help="alarm,ring,oled,mqtt,store")
+    ap.add_argument("--jump", action="append", default=[],
+                    help="AT:DELTA，在模擬第 AT 秒把 RTC 調整 DELTA 秒（可重複）")
+    ap.add_argument("--reset", action="append", type=int, default=[],
+                    help="AT，在模擬第 AT 秒清空全部鬧鐘再新增回去（可重複）")
+    ap.add_argument("--fires", action="store_true", help="列出每次觸發")
+    ap.add_argument("--json", help="把完整報告寫成 JSON 檔")
+    args = ap.parse_args()
+
+    from alarm_sched import days_from_civil
+    start = parse_date(args.start)
+    if args.file:
+        with open(args.file) as f:
+            alarms = json.load(f)
+        for i, a in enumerate(alarms):
+            a.setdefault("id", i + 1)
+    else:
+        alarms = gen_alarms(args.alarms, days_from_civil(*start), args.days, args.seed)
+
+    jumps = [tuple(int(x) for x in j.split(":")) for j in args.jump]
+    rep = simulate(alarms, start, args.days, args.tasks.split(","), jumps, args.reset)
+    if args.fires:
+        for ts, aid in rep["fires"]:
+            print("%04d-%02d-%02d %02d:%02d:%02d  #%d" % (tuple(ts) + (aid,)))
+    print("模擬 %d 天、%d 組鬧鐘，實際耗時 %.2f 秒" % (rep["days"], rep["alarms"], rep["wall_secs"]))
+    print("應觸發 %d 次，實際觸發 %d 次" % (rep["expected"], rep["fired"]))
+    print("漏響 %d、重複 %d、多響 %d、補響 %d、略過 %d" % (
+        len(rep["missed"]), len(rep["duplicate"]), len(rep["extra"]), rep["late"], len(rep["skipped"])))
+    print("喚醒次數：", ", ".join("%s=%d" % kv for kv in sorted(rep["wakeups"].items())))
+    print("任務計數：", ", ".join("%s=%s" % kv for kv in sorted(rep["metrics"].items()) if kv[1]))
+    for e in rep["errors"][:10]:
+        print("⚠️ 任務錯誤：", e)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main()
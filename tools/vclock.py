@@ -0,0 +1,323 @@
+# 虛擬時鐘 + 虛擬 uasyncio：在電腦 (CPython) 上以「模擬時間」執行主程式的非同步任務
+#
+# install(start) 會把 utime、uasyncio 換成本模組提供的版本：
+#   - utime.time()/localtime()/ticks_ms() 讀的是虛擬時鐘
+#   - asyncio.sleep() 不會真的等待，而是把時鐘直接推進到下一個事件
+# 因此模擬一整年只需要幾秒鐘。
+#
+# 用法：
+#   import vclock
+#   clock, loop = vclock.install(start_secs)
+#   import hw3_clock_v2_main as app      # 匯入期間 asyncio.run() 不會執行
+#   loop.spawn(app.alarm_task())
+#   loop.run_until(end_secs)
+
+import heapq, sys, types
+from collections import deque
+
+
+class CancelledError(BaseException):
+    pass
+
+
+class TimeoutError(Exception):
+    pass
+
+
+# ============================================================
+# ⏱ Clock — 單調時間 (ticks) 與牆上時間 (RTC) 分開保存
+# ============================================================
+class Clock:
+    def __init__(self, start_secs=0):
+        self.us = 0                        # 單調時間（微秒），只會前進
+        self.offset = start_secs * 1000000  # 牆上時間 = us + offset
+
+    def time(self):
+        return (self.us + self.offset) // 1000000
+
+    def jump(self, secs):
+        """只調整牆上時間（模擬 set_time / NTP 校正），ticks 不變"""
+        self.offset += int(secs * 1000000)
+
+
+def _make_utime(clock, loop):
+    from alarm_sched import civil_from_days, weekday, days_from_civil, to_secs, DAY
+
+    m = types.ModuleType("utime")
+
+    def localtime(secs=None):
+        if secs is None:
+            secs = clock.time()
+        secs = int(secs)
+        n, rem = divmod(secs, DAY)
+        y, mo, d = civil_from_days(n)
+        yd = n - days_from_civil(y, 1, 1) + 1
+        return (y, mo, d, rem // 3600, rem // 60 % 60, rem % 60, weekday(n), yd)
+
+    def mktime(t):
+        return to_secs(t[0], t[1], t[2], t[3], t[4], t[5])
+
+    def sleep_us(us):
+        # 阻塞式睡眠：時間前進，但期間不會切換任務
+        clock.us += int(us)
+        loop.blocked_us += int(us)
+
+    m.time = clock.time
+    m.localtime = m.gmtime = localtime
+    m.mktime = mktime
+    m.sleep = lambda s: sleep_us(s * 1000000)
+    m.sleep_ms = lambda ms: sleep_us(ms * 1000)
+    m.sleep_us = sleep_us
+    m.ticks_ms = lambda: clock.us // 1000
+    m.ticks_us = lambda: clock.us
+    m.ticks_add = lambda t, delta: t + delta
+    m.ticks_diff = lambda a, b: a - b
+    return m
+
+
+# ============================================================
+# 🔁 虛擬事件迴圈
+# ============================================================
+class Future:
+    def __init__(self):
+        self.done = False
+        self.result = None
+        self.exc = None
+        self._cbs = []
+
+    def set(self, result=None, exc=None):
+        if self.done:
+            return
+        self.done = True
+        self.result = result
+        self.exc = exc
+        cbs, self._cbs = self._cbs, []
+        for cb in cbs:
+            cb(self)
+
+    def __await__(self):
+        if not self.done:
+            yield self
+        if self.exc is not None:
+            raise self.exc
+        return self.result
+
+
+class Task(Future):
+    def __init__(self, loop, coro):
+        super().__init__()
+        self.loop = loop
+        self.coro = coro
+        self.name = getattr(coro, "__name__", "task")
+        self._waiting = None
+
+    def _wake(self, fut):
+        self._waiting = None
+        self.loop._ready.append((self, None))
+
+    def _step(self, exc):
+        loop = self.loop
+        loop.wakeups[self.name] = loop.wakeups.get(self.name, 0) + 1
+        try:
+            fut = self.coro.throw(exc) if exc is not None else self.coro.send(None)
+        except StopIteration as e:
+            self.set(e.value)
+        except CancelledError as e:
+            self.set(exc=e)
+        except Exception as e:
+            loop.errors.append((loop.clock.time(), self.name, repr(e)))
+            self.set(exc=e)
+        else:
+            self._waiting = fut
+            fut._cbs.append(self._wake)
+
+    def cancel(self):
+        if self.done:
+            return
+        fut = self._waiting
+        if fut is not None and self._wake in fut._cbs:
+            fut._cbs.remove(self._wake)
+        self._waiting = None
+        self.loop._ready.append((self, CancelledError()))
+
+
+class Loop:
+    def __init__(self, clock):
+        self.clock = clock
+        self.guard = False      # True 時 asyncio.run() 直接丟棄協程（匯入主程式用）
+        self.wakeups = {}       # 任務名稱 -> 被喚醒次數
+        self.errors = []
+        self.blocked_us = 0
+        self._ready = deque()
+        self._timers = []
+        self._seq = 0
+
+    def call_at(self, us, cb):
+        self._seq += 1
+        h = [cb]
+        heapq.heappush(self._timers, (us, self._seq, h))
+        return h
+
+    def spawn(self, coro):
+        t = Task(self, coro)
+        self._ready.append((t, None))
+        return t
+
+    def run_until(self, end_secs, stop=None):
+        """執行到牆上時間 end_secs，或 stop (Future) 完成為止"""
+        clock = self.clock
+        while True:
+            ready = self._ready
+            while ready:
+                task, exc = ready.popleft()
+                if not task.done:
+                    task._step(exc)
+            if stop is not None and stop.done:
+                return
+            if not self._timers:
+                return
+            us, _, h = self._timers[0]
+            if (max(us, clock.us) + clock.offset) // 1000000 >= end_secs:
+                return
+            heapq.heappop(self._timers)
+            if h[0] is None:
+                continue  # 已取消的計時器
+            if us > clock.us:
+                clock.us = us
+            h[0]()
+
+
+def _make_uasyncio(loop):
+    m = types.ModuleType("uasyncio")
+    clock = loop.clock
+
+    def sleep(s):
+        f = Future()
+        loop.call_at(clock.us + int(s * 1000000), f.set)
+        return f
+
+    def sleep_ms(ms):
+        return sleep(ms / 1000)
+
+    def create_task(coro):
+        return loop.spawn(coro)
+
+    async def gather(*aws, return_exceptions=False):
+        tasks = [a if isinstance(a, Future) else loop.spawn(a) for a in aws]
+        out = []
+        for t in tasks:
+            try:
+                out.append(await t)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                out.append(e)
+        return out
+
+    async def wait_for(aw, timeout):
+        task = aw if isinstance(aw, Task) else loop.spawn(aw)
+        if timeout is None:
+            return await task
+        first = Future()
+        h = loop.call_at(clock.us + int(timeout * 1000000), first.set)
+        task._cbs.append(lambda f: first.set())
+        await first
+        if task.done:
+            h[0] = None
+            return await task
+        task.cancel()
+        raise TimeoutError()
+
+    def wait_for_ms(aw, timeout):
+        return wait_for(aw, timeout / 1000)
+
+    class Event:
+        def __init__(self):
+            self.state = False
+            self._waiters = []
+
+        def is_set(self):
+            return self.state
+
+        def set(self):
+            self.state = True
+            waiters, self._waiters = self._waiters, []
+            for f in waiters:
+                f.set()
+
+        def clear(self):
+            self.state = False
+
+        async def wait(self):
+            if not self.state:
+                f = Future()
+                self._waiters.append(f)
+                await f
+            return True
+
+    class Lock:
+        def __init__(self):
+            self._locked = False
+            self._waiters = deque()
+
+        def locked(self):
+            return self._locked
+
+        async def acquire(self):
+            while self._locked:
+                f = Future()
+                self._waiters.append(f)
+                await f
+            self._locked = True
+            return True
+
+        def release(self):
+            self._locked = False
+            if self._waiters:
+                self._waiters.popleft().set()
+
+        async def __aenter__(self):
+            return await self.acquire()
+
+        async def __aexit__(self, *args):
+            self.release()
+
+    def run(coro):
+        if loop.guard:
+            coro.close()
+            return None
+        t = loop.spawn(coro)
+        loop.run_until(1 << 62, stop=t)
+        return t.result
+
+    def get_event_loop():
+        return loop
+
+    m.sleep = sleep
+    m.sleep_ms = sleep_ms
+    m.create_task = create_task
+    m.gather = gather
+    m.wait_for = wait_for
+    m.wait_for_ms = wait_for_ms
+    m.Event = Event
+    m.Lock = Lock
+    m.run = run
+    m.get_event_loop = get_event_loop
+    m.new_event_loop = get_event_loop
+    m.CancelledError = CancelledError
+    m.TimeoutError = TimeoutError
+    m.Task = Task
+    return m
+
+
+def install(start_secs=0):
+    """建立虛擬時鐘與事件迴圈，並替換 sys.modules 中的 utime / uasyncio"""
+    clock = Clock(start_secs)
+    loop = Loop(clock)
+    # 已匯入的模組可能綁著真的 asyncio，一律重新匯入
+    for name in ("alarm_sched", "alarm_store", "aiot_tools", "hw3_clock_v2_main"):
+        sys.modules.pop(name, None)
+    # 先放 uasyncio，之後匯入的 alarm_sched 等模組才會拿到虛擬版本
+    sys.modules["uasyncio"] = _make_uasyncio(loop)
+    sys.modules["utime"] = _make_utime(clock, loop)
+    return clock, loop
@@ -1,13 +1,24 @@
 """A simple HTTP server that only accept GET request
 It adopt the programming style of ESP8266WebServer 
 library in ESP8266 Arduino Core
+
+begin(port, nonBlocking=True) switches handleClient() to a mode that
+polls the listening socket and every client socket together and never
+waits on a single client: each connection is a small state machine
+(read header -> send response -> close) and files are streamed from one
+shared buffer filled with readinto().
 """
 
 import network
 import machine
 import socket
 import uselect
+import utime
 import os
+try:
+    import errno
+except ImportError:
+    import uerrno as errno
 
 server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -22,6 +33,10 @@ notFoundHandler = None
 docPath = "/"
 # Data for template
 tplData = {}
+# Compiled .p.html templates: path -> (mtime, segments)
+templates = {}
+KEY_MAX = 32
+TPL_CHUNK = 1024
 
 # MIME types
 mimeTypes = {
@@ -30,18 +45,44 @@ mimeTypes = {
     ".png":"image/png",
 }
 
-def begin(port=80):
+# Non-blocking mode (see begin())
+useNonBlocking = False
+clientLimit = 4
+clientTimeout = 5000  # ms without progress before a client is dropped
+clients = {}          # poll key -> __Conn
+buf = None            # shared send/receive buffer
+bufView = None
+HEAD_MAX = 1024       # request line + headers
+SEND_BUDGET = 4       # buffers sent per client per handleClient() call
+# errno values meaning "try again later" on a non-blocking socket; some
+# ports raise ETIMEDOUT instead of EAGAIN
+WOULD_BLOCK = (errno.EAGAIN, getattr(errno, "ETIMEDOUT", errno.EAGAIN))
+
+def begin(port=80, nonBlocking=False, maxClients=4, bufSize=1024):
     """Function to start http server
+
+    nonBlocking=True serves up to maxClients clients at once; bufSize
+    (1-4 KB) is the shared buffer used for reading requests and files
     """
-    global server, poller
+    global server, poller, buf, bufView, useNonBlocking, clientLimit
     server.bind(('0.0.0.0', port))
-    server.listen(1)
+    useNonBlocking = nonBlocking
+    clientLimit = maxClients
+    if nonBlocking:
+        buf = bytearray(min(max(bufSize, 1024), 4096))
+        bufView = memoryview(buf)
+        server.listen(maxClients)
+        server.setblocking(False)
+    else:
+        server.listen(1)
     # Register for checking new client connection
     poller.register(server, uselect.POLLIN)
 
 def close():
     """Function to stop http server
     """
+    for conn in list(clients.values()):
+        __drop(conn)
     poller.unregister(server)
     server.close()
 
@@ -49,13 +90,19 @@ def handleClient():
     """Check for new client connection and process the request
     """
     global server, poller
+    if useNonBlocking:
+        __serviceAll()
+        return
     # Note:don't call poll() with 0, that would randomly cause
     # reset with "Fatal exception 28(LoadProhibitedCause)" message
     res = poller.poll(1)
     if res:  # There's a new client connection
         (socket, sockaddr) = server.accept()
         socket.settimeout(0.02) # set timeout for readline to avoid blocking
-        handle(socket)
+        try:
+            handle(socket)
+        except Exception as e:
+            print(e)
         socket.close()
 
 def __sendPage(socket, filePath):
@@ -154,21 +201,8 @@ def handle(socket):
     elif not path.startswith(docPath): # Check for wrong path
         err(socket, "400", "Bad Request")
     else: # find file in the document path
-        filePath = path
-        fileFound = True
-        # find the file 
-        if not __fileExist(filePath):
-            if not path.endswith("/"):
-                fileFound = False
-            else:
-                filePath = path + "index.html"
-                # find index.html in the path
-                if not __fileExist(filePath):
-                    filePath = path + "index.p.html"
-                    # find index.p.html in the path
-                    if not __fileExist(filePath): # no default html file found
-                        fileFound = False
-        if not fileFound: # file or default html file specified in path not found
+        filePath = __findFile(path)
+        if not filePath: # file or default html file specified in path not found
             if notFoundHandler:
                 notFoundHandler(socket)
             else:
@@ -176,21 +210,310 @@ def handle(socket):
             return
         # Responds the header first
         socket.write("HTTP/1.1 200 OK\r\n")
-        contentType = "text/html"
-        for ext in mimeTypes:
-            if filePath.endswith(ext):
-                contentType = mimeTypes[ext]
-        socket.write("Content-Type: " + contentType + "\r\n\r\n")
+        socket.write("Content-Type: " + __contentType(filePath) + "\r\n\r\n")
         # Responds the file content
         if filePath.endswith(".p.html"):
             print("template file.")
-            f = open(filePath, "r")
-            for l in f:
-                socket.write(l.format(**tplData))
-            f.close()
+            __sendTemplate(socket, filePath)
         else:
             __sendPage(socket, filePath)
 
+def __findFile(path):
+    """Map a request path to a file, trying index.html and index.p.html
+    for directories; None if nothing matches
+    """
+    if __fileExist(path):
+        return path
+    if not path.endswith("/"):
+        return None
+    for name in ("index.html", "index.p.html"):
+        if __fileExist(path + name):
+            return path + name
+    return None
+
+def __contentType(filePath):
+    contentType = "text/html"
+    for ext in mimeTypes:
+        if filePath.endswith(ext):
+            contentType = mimeTypes[ext]
+    return contentType
+
+def __sendTemplate(socket, filePath):
+    """Fill a .p.html template with tplData; segments and values are
+    written to socket in pieces of about TPL_CHUNK bytes
+    """
+    parts = []
+    size = 0
+    for seg in __template(filePath):
+        if type(seg) is str:
+            if seg in tplData:
+                seg = str(tplData[seg]).encode()
+            else:
+                seg = b"{" + seg.encode() + b"}"  # unknown names are left as they are
+        parts.append(seg)
+        size += len(seg)
+        if size >= TPL_CHUNK:
+            socket.write(b"".join(parts))
+            parts = []
+            size = 0
+    if parts:
+        socket.write(b"".join(parts))
+
+def __template(filePath):
+    """Compiled template for filePath, recompiled when its mtime changes
+    """
+    mtime = os.stat(filePath)[8]
+    cached = templates.get(filePath)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    f = open(filePath, "rb")
+    data = f.read()
+    f.close()
+    segs = __compile(data)
+    templates[filePath] = (mtime, segs)
+    return segs
+
+def __compile(data):
+    """Split a template into literal bytes and placeholder names; only
+    {name} with a name of letters, digits and underscores is a
+    placeholder; every other brace, including the }} that closes nested
+    CSS and JavaScript blocks, passes through as written
+    """
+    segs = []
+    start = 0
+    i = data.find(b"{")
+    while i >= 0:
+        j = data.find(b"}", i + 1, i + 2 + KEY_MAX)
+        if j > 0 and __isKey(data, i + 1, j):
+            if i > start:
+                segs.append(data[start:i])
+            segs.append(str(data[i + 1:j], "utf-8"))
+            start = j + 1
+            i = data.find(b"{", start)
+        else:
+            i = data.find(b"{", i + 1)
+    if start < len(data):
+        segs.append(data[start:])
+    return segs
+
+def __isKey(data, s, e):
+    if s >= e:
+        return False
+    for i in range(s, e):
+        c = data[i]
+        if not (c == 0x5F or 0x61 <= c <= 0x7A or 0x41 <= c <= 0x5A or (i > s and 0x30 <= c <= 0x39)):
+            return False
+    return True
+
+# ---- Non-blocking mode ----
+
+class __Conn:
+    """State of one client connection: reading the request, then sending
+    out (status line, headers, handler output) followed by file
+    """
+    def __init__(self, sock, key):
+        self.sock = sock
+        self.key = key
+        self.head = bytearray()
+        self.sending = False
+        self.out = b""
+        self.outPos = 0
+        self.file = None
+        self.filePos = 0
+        self.fileLeft = 0
+        self.stamp = utime.ticks_ms()
+
+class __Writer:
+    """Collects what handlers write with socket.write() so it can be
+    sent without blocking
+    """
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(data.encode() if isinstance(data, str) else bytes(data))
+
+def __key(obj):
+    # MicroPython's poll() returns the socket, CPython's returns its fd
+    return obj.fileno() if hasattr(obj, "fileno") else obj
+
+def __serviceAll():
+    """Accept new clients and give every ready client one turn
+    """
+    now = utime.ticks_ms()
+    for obj, event in poller.poll(1):
+        key = obj if isinstance(obj, int) else __key(obj)
+        if key == __key(server):
+            __accept()
+            continue
+        conn = clients.get(key)
+        if conn is None:
+            continue
+        if event & (uselect.POLLHUP | uselect.POLLERR):
+            __drop(conn)
+            continue
+        try:
+            if __step(conn):
+                conn.stamp = now
+        except Exception as e:
+            # A failing handler or a broken client only costs its own connection
+            print(e)
+            __drop(conn)
+    for conn in list(clients.values()):
+        if utime.ticks_diff(now, conn.stamp) > clientTimeout:
+            __drop(conn)
+
+def __accept():
+    while len(clients) < clientLimit:
+        try:
+            sock, sockaddr = server.accept()
+        except OSError:
+            return  # no more pending connections
+        sock.setblocking(False)
+        conn = __Conn(sock, __key(sock))
+        clients[conn.key] = conn
+        poller.register(sock, uselect.POLLIN)
+    # Full: leave further connections in the backlog until a slot frees
+    poller.modify(server, 0)
+
+def __drop(conn):
+    clients.pop(conn.key, None)
+    try:
+        poller.unregister(conn.sock)
+    except Exception:
+        pass
+    if conn.file:
+        conn.file.close()
+    conn.sock.close()
+    if len(clients) == clientLimit - 1:
+        poller.modify(server, uselect.POLLIN)
+
+def __step(conn):
+    """Advance one connection; returns True if any data moved
+    """
+    if not conn.sending:
+        return __readHead(conn)
+    moved = False
+    for _ in range(SEND_BUDGET):
+        n = __sendMore(conn)
+        if n is None:
+            __drop(conn)  # response finished or client went away
+            return moved
+        if n == 0:
+            return moved  # socket buffer full, wait for POLLOUT
+        moved = True
+    return moved
+
+def __readHead(conn):
+    try:
+        n = conn.sock.readinto(bufView) if hasattr(conn.sock, "readinto") else conn.sock.recv_into(bufView)
+    except OSError as e:
+        if e.args[0] in WOULD_BLOCK:
+            return False
+        n = 0
+    if n is None:
+        return False
+    if not n:
+        __drop(conn)
+        return False
+    conn.head += bufView[:n]
+    end = conn.head.find(b"\r\n\r\n")
+    if end < 0:
+        if len(conn.head) > HEAD_MAX:
+            __respond(conn, None)
+        return True
+    __respond(conn, bytes(conn.head[:conn.head.find(b"\r\n")]))
+    return True
+
+def __respond(conn, line):
+    """Route the request line like handle() does; output is queued in
+    conn and static files are left open to stream
+    """
+    w = __Writer()
+    try:
+        request = str(line, "utf-8").split(" ") if line else ()
+    except UnicodeError:
+        request = ()
+    if len(request) != 3:
+        err(w, "400", "Bad Request")
+    else:
+        __route(conn, w, request)
+    conn.head = None
+    conn.out = b"".join(w.parts)
+    conn.sending = True
+    poller.modify(conn.sock, uselect.POLLOUT)
+
+def __route(conn, w, request):
+    (method, url, version) = request
+    if "?" in url:
+        (path, query) = url.split("?", 1)
+    else:
+        (path, query) = (url, "")
+    args = {}
+    if query:
+        for argPair in query.split("&"):
+            arg = argPair.split("=")
+            if len(arg) == 2:
+                args[arg[0]] = arg[1]
+    if version != "HTTP/1.0" and version != "HTTP/1.1":
+        err(w, "505", "Version Not Supported")
+    elif method != "GET":
+        err(w, "501", "Not Implemented")
+    elif path in handlers:
+        handlers[path](w, args)
+    elif not path.startswith(docPath):
+        err(w, "400", "Bad Request")
+    else:
+        filePath = __findFile(path)
+        if not filePath:
+            if notFoundHandler:
+                notFoundHandler(w)
+            else:
+                err(w, "404", "Not Found")
+        elif filePath.endswith(".p.html"):
+            page = __Writer()
+            __sendTemplate(page, filePath)
+            size = 0
+            for part in page.parts:
+                size += len(part)
+            w.write("HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: %d\r\n"
+                    "Connection: close\r\n\r\n" % size)
+            w.parts += page.parts
+        else:
+            size = os.stat(filePath)[6]
+            w.write("HTTP/1.1 200 OK\r\nContent-Type: %s\r\nContent-Length: %d\r\n"
+                    "Connection: close\r\n\r\n" % (__contentType(filePath), size))
+            conn.file = open(filePath, "rb")
+            conn.fileLeft = size
+
+def __sendMore(conn):
+    """Send the next piece of the response; returns bytes sent, 0 when
+    the socket would block, None when the response is done or failed
+    """
+    if conn.outPos < len(conn.out):
+        data = memoryview(conn.out)[conn.outPos:]
+    elif conn.fileLeft > 0:
+        n = conn.file.readinto(bufView[:min(len(buf), conn.fileLeft)])
+        if not n:
+            return None
+        data = bufView[:n]
+    else:
+        return None
+    try:
+        sent = conn.sock.send(data)
+    except OSError as e:
+        sent = 0 if e.args[0] in WOULD_BLOCK else None
+    if sent is None:
+        return None
+    if conn.outPos < len(conn.out):
+        conn.outPos += sent
+    else:
+        conn.filePos += sent
+        conn.fileLeft -= sent
+        if sent < len(data):
+            conn.file.seek(conn.filePos)  # unsent bytes are read again next turn
+    return sent
+
 def onPath(path, handler):
     """Register handler for processing request of specified path
     """
@@ -2,9 +2,13 @@ from machine import Pin, PWM, RTC
 #from umqtt.robust import MQTTClient
 import network, urequests, ujson
 import time, ntptime, utime
-import sys, select
+import sys, select, os
 import uasyncio as asyncio
 import socket
+try:
+    import hashlib, binascii
+except ImportError:
+    import uhashlib as hashlib, ubinascii as binascii
 
 
 # 初始化 Wi-Fi 連線指示燈
@@ -35,6 +39,109 @@ NOTES = [262, 330, 294, 196, 0,
 # ============================================================
 # 🧩 render_template() — 簡易 HTML 模板渲染
 # ============================================================
+TEMPLATE_CHUNK = 512  # 編譯與輸出樣板時每次讀取的位元組數
+MAX_KEY = 32          # {key} 佔位符名稱的最大長度
+
+_templates = {}       # 檔名 → Template
+
+
+def _is_key(data, s, e):
+    """data[s:e] 是否為合法的佔位符名稱（英數字與底線，不以數字開頭）"""
+    if s >= e:
+        return False
+    for i in range(s, e):
+        c = data[i]
+        if not (c == 0x5F or 0x61 <= c <= 0x7A or 0x41 <= c <= 0x5A or (i > s and 0x30 <= c <= 0x39)):
+            return False
+    return True
+
+
+class Template:
+    """
+    編譯後的樣板：parts 依序是字面片段的長度 (int) 與佔位符名稱 (str)。
+    只記位置不記內容，輸出時再從檔案分段讀出，樣板本身不佔常駐記憶體。
+    """
+    def __init__(self, file, mtime):
+        self.file = file
+        self.mtime = mtime
+        self.parts = []
+        with open(file, "rb") as f:
+            self._compile(f)
+
+    def _compile(self, f):
+        parts = self.parts
+        lit = 0    # 目前字面片段在檔案中的起點
+        base = 0   # data[0] 在檔案中的位置
+        data = b""
+        while True:
+            chunk = f.read(TEMPLATE_CHUNK)
+            data = data + chunk if data else chunk
+            n = len(data)
+            i = 0
+            while True:
+                s = data.find(b"{", i)
+                if s < 0:
+                    i = n
+                    break
+                e = data.find(b"}", s + 1, s + MAX_KEY + 2)
+                if e < 0:
+                    if chunk and n - s < MAX_KEY + 2:
+                        i = s  # 佔位符可能跨到下一塊，留到下一輪
+                        break
+                    i = s + 1
+                elif _is_key(data, s + 1, e):
+                    parts.append(base + s - lit)
+                    parts.append(str(data[s + 1:e], "ascii"))
+                    lit = base + e + 1
+                    i = e + 1
+                else:
+                    i = s + 1
+            if not chunk:
+                break
+            base += i
+            data = data[i:]
+        parts.append(base + len(data) - lit)
+
+    def render(self, kwargs):
+        """回傳 Stream；各段長度事先算好，所以能帶 Content-Length 沿用持久連線"""
+        values = {}
+        length = 0
+        for p in self.parts:
+            if isinstance(p, int):
+                length += p
+            else:
+                if p not in values:
+                    # 沒給值的佔位符原樣輸出（頁面裡的 JavaScript 也會用到大括號）
+                    v = kwargs[p] if p in kwargs else "{" + p + "}"
+                    values[p] = str(v).encode()
+                length += len(values[p])
+        return Stream(self._chunks(values), "text/html", length)
+
+    def _chunks(self, values):
+        buf = bytearray(TEMPLATE_CHUNK)
+        mv = memoryview(buf)
+        pos = 0
+        with open(self.file, "rb", 0) as f:  # 不另配讀取緩衝，只用上面這塊
+            for p in self.parts:
+                if isinstance(p, int):
+                    f.seek(pos)
+                    yield from _read_span(f, p, mv)
+                    pos += p
+                else:
+                    yield values[p]
+                    pos += len(p) + 2
+
+
+def _read_span(f, left, mv):
+    """從 f 目前的位置讀出 left 個位元組，每段最多填滿 mv 一次"""
+    while left:
+        k = f.readinto(mv[:min(left, len(mv))])
+        if not k:
+            return
+        yield mv[:k]
+        left -= k
+
+
 def render_template(file, **kwargs):
     """
     讀取指定 HTML 檔案，將內容中 {key} 替換成 kwargs 的值。
@@ -43,18 +150,90 @@ def render_template(file, **kwargs):
     HTML 範例：
         <p>目前時間：{time}</p>
         <ul>{alarms}</ul>
+
+    樣板第一次使用時編譯並快取，檔案修改時間改變才重新編譯；
+    回傳的 Stream 會分段送出，不必把整頁讀進記憶體。
     """
     try:
-        with open(file, "r") as f:
-            html = f.read()
+        mtime = os.stat(file)[8]
+        t = _templates.get(file)
+        if t is None or t.mtime != mtime:
+            t = _templates[file] = Template(file, mtime)
     except Exception as e:
+        _templates.pop(file, None)
         return "<h1>404 File Not Found</h1><p>%s</p>" % e
+    return t.render(kwargs)
+
+
+# ============================================================
+# 📦 static_file() — 靜態檔案（ETag / 304 / 預先壓縮的 .gz）
+# ============================================================
+MIME_TYPES = {
+    "html": "text/html", "htm": "text/html", "css": "text/css",
+    "js": "application/javascript", "json": "application/json",
+    "svg": "image/svg+xml", "png": "image/png", "jpg": "image/jpeg",
+    "ico": "image/x-icon", "txt": "text/plain",
+}
+
+_etags = {}  # 檔名 → (mtime, 大小, ETag)
+
+
+def _file_etag(file, st):
+    """檔案內容的 SHA-1 當強 ETag；依修改時間與大小快取，內容沒變就不重算"""
+    hit = _etags.get(file)
+    if hit and hit[0] == st[8] and hit[1] == st[6]:
+        return hit[2]
+    h = hashlib.sha1()
+    buf = bytearray(TEMPLATE_CHUNK)
+    mv = memoryview(buf)
+    with open(file, "rb", 0) as f:
+        for chunk in _read_span(f, st[6], mv):
+            h.update(chunk)
+    etag = '"%s"' % str(binascii.hexlify(h.digest()[:8]), "ascii")
+    _etags[file] = (st[8], st[6], etag)
+    return etag
+
+
+def _file_chunks(file, size):
+    buf = bytearray(TEMPLATE_CHUNK)
+    with open(file, "rb", 0) as f:
+        yield from _read_span(f, size, memoryview(buf))
+
+
+def static_file(req, file, content_type=None, cache="no-cache"):
+    """
+    回傳靜態檔案，可直接當路由的回傳值：
+      - 帶強 ETag；瀏覽器送來相同的 If-None-Match 時回 304，不再傳本文
+      - 用戶端接受 gzip 且旁邊有不比原檔舊的 file + ".gz"（用 tools/precompress.py 產生）時改送壓縮檔
+      - 本文以 Stream 分段送出並帶 Content-Length，可沿用持久連線
+    cache 是 Cache-Control 的值；預設 no-cache 表示每次都要用 ETag 確認（多半只拿到 304）
+    """
+    if content_type is None:
+        content_type = MIME_TYPES.get(file.rsplit(".", 1)[-1].lower(), "application/octet-stream")
+    try:
+        st = os.stat(file)
+    except OSError:
+        raise HttpError("404 NOT FOUND")
+
+    send, encoding = file, None
+    if "gzip" in req.headers.get("accept-encoding", ""):
+        try:
+            gz = os.stat(file + ".gz")
+            if gz[8] >= st[8]:
+                send, st, encoding = file + ".gz", gz, "gzip"
+        except OSError:
+            pass
+
+    # 同一個網址的原檔與壓縮檔是不同的表示，ETag 各自計算
+    etag = _file_etag(send, st)
+    headers = "ETag: %s\r\nCache-Control: %s\r\nVary: Accept-Encoding" % (etag, cache)
+    if encoding:
+        headers += "\r\nContent-Encoding: " + encoding
+    inm = req.headers.get("if-none-match")
+    if inm and (etag in inm or inm.strip() == "*"):
+        return "304 Not Modified", content_type, b"", headers
+    return Stream(_file_chunks(send, st[6]), content_type, st[6], headers)
 
-    # 簡單字串替換
-    for key, value in kwargs.items():
-        html = html.replace("{" + key + "}", str(value))
-        
-    return html
 
 def now_time(tz=8, sync=False):
     """
@@ -83,43 +262,1060 @@ def now_time(tz=8, sync=False):
         return "0000-00-00 00:00:00"
     
 
+# ============================================================
+# 🧩 JsonSplitter — 串流 JSON 解析
+# ============================================================
+_JSON_SEP = b" \t\r\n,[]"
+
+class JsonSplitter:
+    """
+    把一段段送進來的 bytes 切成最上層的 JSON 物件 {...}，
+    同時支援 JSON 陣列 [{...}, {...}] 與 JSON Lines（一行一個物件）。
+    只保留目前這一個物件的內容，不必把整個請求讀進記憶體；
+    格式錯誤或單一物件超過 max_size 位元組時丟出 ValueError。
+    """
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._buf = bytearray()
+        self._depth = 0
+        self._in_str = self._esc = False
+
+    def feed(self, chunk):
+        """送入一段資料，回傳這段資料中完成的物件清單"""
+        out = []
+        buf = self._buf
+        depth, in_str, esc = self._depth, self._in_str, self._esc
+        for c in chunk:
+            if depth == 0:
+                if c == 0x7B:  # {
+                    depth = 1
+                    buf.append(c)
+                elif c not in _JSON_SEP:
+                    raise ValueError("不是 JSON 物件")
+                continue
+            buf.append(c)
+            if in_str:
+                if esc:
+                    esc = False
+                elif c == 0x5C:  # \
+                    esc = True
+                elif c == 0x22:  # "
+                    in_str = False
+            elif c == 0x22:
+                in_str = True
+            elif c == 0x7B:
+                depth += 1
+            elif c == 0x7D:  # }
+                depth -= 1
+                if depth == 0:
+                    out.append(ujson.loads(str(buf, "utf-8")))
+                    buf = self._buf = bytearray()
+            if len(buf) > self.max_size:
+                raise ValueError("JSON 物件太大")
+        self._depth, self._in_str, self._esc = depth, in_str, esc
+        return out
+
+    def close(self):
+        if self._depth:
+            raise ValueError("JSON 不完整")
+
+
+def iter_json_objects(chunks, max_size=1024):
+    """從可迭代的 bytes 片段中逐一取出 JSON 物件（JsonSplitter 的同步版）"""
+    sp = JsonSplitter(max_size)
+    for chunk in chunks:
+        for obj in sp.feed(chunk):
+            yield obj
+    sp.close()
+
+
+# ============================================================
+# 🌐 HTTP 請求解析
+# ============================================================
+MAX_LINE = 1024     # 請求行 / 單一標頭的長度上限
+MAX_HEADERS = 32    # 標頭數量上限
+
+
+class HttpError(Exception):
+    """請求格式錯誤等情況，直接以 status 回應並關閉連線"""
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class _SockReader:
+    """
+    把阻塞式 socket 包成與 StreamReader 相同的 readline() / read() / readexactly()（舊版輪詢模式用）。
+    readline() 以 size 為單位分段讀，超過 MAX_LINE 還沒看到換行就停下，回傳的過長行由呼叫端回 414 / 431
+    """
+    def __init__(self, sock, size=512):
+        self.sock = sock
+        self.size = size
+        self.buf = b""
+
+    async def _recv(self, n):
+        return self.sock.recv(n)
+
+    async def readline(self):
+        while b"\n" not in self.buf and len(self.buf) <= MAX_LINE:
+            data = await self._recv(self.size)
+            if not data:
+                break
+            self.buf += data
+        i = self.buf.find(b"\n") + 1 or len(self.buf)
+        line, self.buf = self.buf[:i], self.buf[i:]
+        return line
+
+    async def read(self, n):
+        if not self.buf:
+            return await self._recv(n)
+        data, self.buf = self.buf[:n], self.buf[n:]
+        return data
+
+    async def readexactly(self, n):
+        out = b""
+        while len(out) < n:
+            data = await self.read(n - len(out))
+            if not data:
+                raise EOFError()
+            out += data
+        return out
+
+
+class _StreamReader(_SockReader):
+    """
+    事件驅動模式用：StreamReader.readline() 沒有長度上限（uasyncio 會把整行讀進 heap，
+    CPython 超過 64 KiB 則丟出 ValueError），改成與 _SockReader 一樣分段讀、超過 MAX_LINE 就停。
+    多讀到的資料留在 buf 給本文或下一個請求，所以同一條連線要一直用同一個物件
+    """
+    def __init__(self, reader, size=512):
+        super().__init__(None, size)
+        self.reader = reader
+
+    async def _recv(self, n):
+        return await self.reader.read(n)
+
+    async def fill(self):
+        """等到有資料可讀（持久連線等下一個請求用）；連線已關閉時回傳 False"""
+        if not self.buf:
+            self.buf = await self._recv(self.size)
+        return bool(self.buf)
+
+    async def readexactly(self, n):
+        data, self.buf = self.buf[:n], self.buf[n:]
+        if len(data) < n:
+            data += await self.reader.readexactly(n - len(data))
+        return data
+
+
+async def _readline(reader, timeout):
+    line = await asyncio.wait_for(reader.readline(), timeout)
+    if len(line) > MAX_LINE:
+        raise HttpError("431 Request Header Fields Too Large")
+    return line
+
+
 class WebRequest:
-    """封裝簡易的 HTTP 請求物件"""
-    def __init__(self, method, path, args, body=""):
+    """
+    封裝 HTTP 請求物件。
+      headers ：標頭 dict（名稱一律小寫）
+      body    ：本文字串，第一次使用時才從 raw 解碼；本文超過伺服器預讀上限時丟出 HttpError (413)
+      read(n) ：逐段讀取本文（bytes-like），讀完時回傳 b""；Content-Length 與 chunked 皆可
+    """
+    def __init__(self, method, path, args, body="", raw=b"", length=0, reader=None,
+                 headers=None, version="HTTP/1.1", timeout=3):
         self.method = method
         self.path = path
         self.args = args
-        self.body = body
+        self.headers = headers or {}
+        self.version = version
+        self.params = {}            # 路徑參數，例如 /api/alarms/<id> 的 {"id": "3"}
+        self.remote = None          # 用戶端 IP（由伺服器填入）
+        self.head_size = 0          # 請求行與標頭的位元組數
+        self.received = 0           # 已從連線讀到的本文位元組數
+        self.raw = raw              # 已預讀的本文
+        self.length = length        # Content-Length（chunked 時為 -1）
+        self.timeout = timeout
+        self._body = body or None
+        self._pos = 0
+        self._left = max(length - len(raw), 0)
+        self._chunk_left = 0
+        self._reader = reader
+
+    @property
+    def body(self):
+        if self._body is None:
+            if self._left or self.length < 0 and self._reader is not None:
+                raise HttpError("413 Payload Too Large")  # 超過預讀上限的本文請用 read() 串流讀取
+            self._body = bytes(self.raw).decode("utf-8", "ignore") if self.raw else ""
+        return self._body
+
+    def keep_alive(self):
+        conn = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.1":
+            return conn != "close"
+        return conn == "keep-alive"
+
+    async def _read_chunked(self, n):
+        reader, t = self._reader, self.timeout
+        if self._chunk_left == 0:
+            line = await _readline(reader, t)
+            try:
+                size = int(line.split(b";")[0].strip().decode(), 16)
+            except ValueError:
+                raise HttpError("400 Bad Request")
+            if size == 0:
+                # 讀掉結尾的 trailer，連線才能接著處理下一個請求
+                while (await _readline(reader, t)) not in (b"\r\n", b"\n", b""):
+                    pass
+                self._reader = None
+                return b""
+            self._chunk_left = size
+        data = await asyncio.wait_for(reader.read(min(n, self._chunk_left)), t)
+        if not data:
+            self._reader = None
+            return b""
+        self.received += len(data)
+        self._chunk_left -= len(data)
+        if self._chunk_left == 0:
+            await asyncio.wait_for(reader.readexactly(2), t)  # 區塊後的 CRLF
+        return data
+
+    async def _read_more(self, n):
+        """從連線讀取下一段尚未預讀的本文"""
+        if self._reader is None:
+            return b""
+        if self.length < 0:
+            return await self._read_chunked(n)
+        if self._left <= 0:
+            return b""
+        data = await asyncio.wait_for(self._reader.read(min(n, self._left)), self.timeout)
+        self._left = self._left - len(data) if data else 0
+        self.received += len(data)
+        return data
+
+    async def prefetch(self, limit):
+        """先把 limit 以內的本文讀進 raw；Content-Length 一次讀完，不逐段串接"""
+        if self.length > 0:
+            n = min(self.length, limit)
+            try:
+                self.raw = await asyncio.wait_for(self._reader.readexactly(n), self.timeout)
+            except EOFError:
+                raise HttpError("400 Bad Request")
+            self._left = self.length - n
+            self.received = n
+        elif self.length < 0:
+            buf = bytearray()
+            while len(buf) < limit:
+                data = await self._read_chunked(limit - len(buf))
+                if not data:
+                    break
+                buf += data
+            self.raw = buf
+
+    async def read(self, n=512):
+        """讀取下一段請求本文（bytes-like），讀完時回傳 b""；本文不必一次讀進記憶體"""
+        if self._pos < len(self.raw):
+            data = memoryview(self.raw)[self._pos:self._pos + n]
+            self._pos += len(data)
+            return data
+        return await self._read_more(n)
+
+    async def discard(self):
+        """丟掉路由沒讀完的本文"""
+        self._pos = len(self.raw)
+        while await self._read_more(512):
+            pass
+
+
+class Stream:
+    """
+    路由回傳 Stream 時，回應本文由 chunks（str、bytes 或 memoryview）逐段送出，不必先組成整個字串。
+    事先知道總長度時給 length，回應會帶 Content-Length 並可沿用持久連線；
+    headers 是額外的標頭行（例如 ETag）。
+    """
+    def __init__(self, chunks, content_type="application/json", length=None, headers=None):
+        self.chunks = chunks
+        self.content_type = content_type
+        self.length = length
+        self.headers = headers  # 額外標頭，多行以 "\r\n" 分隔
+
+
+def _close_stream(result):
+    """路由回傳的 Stream 不會再送出時，讓 chunks 關檔 / 取消訂閱"""
+    if isinstance(result, Stream):
+        close = getattr(result.chunks, "close", None)
+        if close:
+            close()
+
+
+def _put_int(buf, pos, n):
+    """把非負整數的十進位數字直接寫進 buf[pos:]，回傳新的位置（不產生字串）"""
+    end = pos
+    m = n
+    while True:
+        end += 1
+        m //= 10
+        if not m:
+            break
+    i = end
+    while True:
+        i -= 1
+        buf[i] = 0x30 + n % 10
+        n //= 10
+        if not n:
+            break
+    return end
+
+
+def _parse_request_line(line):
+    """解析 "GET /path?a=1 HTTP/1.1"，回傳 (method, path, args, version)"""
+    parts = line.split(" ")
+    if len(parts) != 3:
+        raise HttpError("400 Bad Request")
+    method, path, version = parts
+    args = {}
+    if "?" in path:
+        base, query = path.split("?", 1)
+        path = base
+        for kv in query.split("&"):
+            if "=" in kv:
+                k, v = kv.split("=", 1)
+                args[k] = v
+    return method, path, args, version
+
+
+async def read_request(reader, timeout=3, idle=3, body_max=2048):
+    """
+    從 reader 逐行讀出一個請求：請求行、標頭（到空行為止），再預讀 body_max 以內的本文。
+    等待請求行最多 idle 秒；之後的標頭與預讀的本文合計要在 timeout 秒內到齊，
+    一行一行慢慢送的用戶端不能一直佔著連線名額。
+    連線已關閉時回傳 None。格式錯誤時丟出 HttpError。
+    """
+    line = await asyncio.wait_for(reader.readline(), idle)
+    if not line:
+        return None
+    if len(line) > MAX_LINE:
+        raise HttpError("414 URI Too Long")
+    method, path, args, version = _parse_request_line(line.decode("utf-8", "ignore").strip())
+    try:
+        request = await asyncio.wait_for(_read_head(reader, method, path, args, version, timeout, body_max), timeout)
+    except asyncio.TimeoutError:
+        raise HttpError("408 Request Timeout")
+    request.head_size += len(line)
+    return request
+
+
+async def _read_head(reader, method, path, args, version, timeout, body_max):
+    headers = {}
+    size = 0
+    while True:
+        h = await reader.readline()
+        size += len(h)
+        if len(h) > MAX_LINE:
+            raise HttpError("431 Request Header Fields Too Large")
+        if h in (b"\r\n", b"\n", b""):
+            break
+        i = h.find(b":")
+        if i <= 0 or len(headers) >= MAX_HEADERS:
+            raise HttpError("400 Bad Request")
+        headers[h[:i].strip().lower().decode()] = h[i + 1:].strip().decode("utf-8", "ignore")
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        length = -1
+    else:
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HttpError("400 Bad Request")
+        if length < 0:
+            raise HttpError("400 Bad Request")
+    request = WebRequest(method, path, args, "", b"", length, reader, headers, version, timeout)
+    request.head_size = size
+    await request.prefetch(body_max)
+    return request
+
+
+# ============================================================
+# 📣 EventHub — Server-Sent Events 推播
+# ============================================================
+def _sse(event, data):
+    """組成一則 SSE 訊息；data 一律轉成 JSON（字串也是），網頁端統一用 JSON.parse"""
+    return ("event: %s\ndata: %s\n\n" % (event, ujson.dumps(data))).encode()
+
+
+class EventHub:
+    """
+    程式內的變更通知。資料來源用 source(事件, 函式) 登記，狀態改變時呼叫 publish(事件)；
+    每條 SSE 連線是一個 EventStream，連上時先收到每個來源的目前狀態，之後只收變更。
+    沒有任何連線時 publish() 直接返回，不會產生資料。
+    """
+    def __init__(self, tick=30, max_streams=2):
+        self.sources = {}             # 事件名稱 → 產生目前資料的函式
+        self.streams = []
+        self.tick = tick              # 沒有事件時多久送一次 "time"（兼作連線存活檢查）
+        self.max_streams = max_streams
+
+    def source(self, event, func):
+        self.sources[event] = func
+
+    def publish(self, event, data=None):
+        """通知所有連線；data 省略時由 sources[event]() 產生，所有連線共用同一份訊息"""
+        if not self.streams:
+            return
+        msg = _sse(event, self.sources[event]() if data is None else data)
+        for s in self.streams:
+            s.push(event, msg)
+
+    def stream(self):
+        """給路由回傳的 Stream：text/event-stream，連線期間一直保持開啟"""
+        if len(self.streams) >= self.max_streams:
+            raise HttpError("503 Service Unavailable")
+        return Stream(EventStream(self), "text/event-stream", None, "Cache-Control: no-cache")
 
 
+class EventStream:
+    """
+    單一 SSE 連線的待送事件。同一事件只保留最新的一則，
+    用戶端收得慢時只會跳過中間的狀態，不會越積越多。
+    """
+    def __init__(self, hub):
+        self.hub = hub
+        self.flag = asyncio.Event()
+        # None 表示送出時再向資料來源取目前的狀態
+        self.pending = dict.fromkeys(hub.sources)
+        self.first = True
+        hub.streams.append(self)
+
+    def push(self, event, msg):
+        self.pending[event] = msg
+        self.flag.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.first:
+            self.first = False
+            return b"retry: 3000\n\n"  # 斷線後瀏覽器 3 秒重連
+        while not self.pending:
+            try:
+                await asyncio.wait_for(self.flag.wait(), self.hub.tick)
+            except asyncio.TimeoutError:
+                if "time" in self.hub.sources:
+                    self.pending["time"] = None
+                else:
+                    return b": ping\n\n"
+            self.flag.clear()
+        event, msg = self.pending.popitem()
+        return msg if msg is not None else _sse(event, self.hub.sources[event]())
+
+    def close(self):
+        if self in self.hub.streams:
+            self.hub.streams.remove(self)
+
+
+# ============================================================
+# 🚦 RateLimiter — 每個用戶端一個權杖桶
+# ============================================================
+_UNIT = 1000000  # 一個權杖 = 10^6 單位，補充量全部用整數計算（ESP32 的 float 只有單精度）
+
+
+class RateLimiter:
+    """
+    權杖桶限流：每個用戶端位址每秒補 rate 個權杖，最多存 burst 個，每個請求用掉一個。
+    桶放在固定 size 格的表裡（預先配置，不隨用戶端數增長）；表滿時擠掉最久沒出現的位址，
+    被擠掉的位址下次出現時視為滿桶。
+    """
+    def __init__(self, rate=5, burst=10, size=16):
+        self.rate = rate
+        self.per_ms = int(rate * 1000)          # 每毫秒補充的單位數
+        self.cap = burst * _UNIT
+        self.fill_ms = self.cap // max(self.per_ms, 1)
+        self.keys = [None] * size
+        self.tokens = [0] * size
+        self.stamps = [0] * size
+
+    def _slot(self, key, now):
+        keys = self.keys
+        for i in range(len(keys)):
+            if keys[i] == key:
+                return i
+        # 新位址：用空格或最久沒出現的那一格
+        stamps = self.stamps
+        old = 0
+        for i in range(len(keys)):
+            if keys[i] is None:
+                old = i
+                break
+            if utime.ticks_diff(now, stamps[i]) > utime.ticks_diff(now, stamps[old]):
+                old = i
+        keys[old] = key
+        self.tokens[old] = self.cap
+        stamps[old] = now
+        return old
+
+    def take(self, key):
+        """用掉一個權杖；成功回傳 0，不夠時回傳建議等待的秒數（Retry-After）"""
+        now = utime.ticks_ms()
+        i = self._slot(key, now)
+        elapsed = min(utime.ticks_diff(now, self.stamps[i]), self.fill_ms)
+        t = min(self.tokens[i] + elapsed * self.per_ms, self.cap)
+        self.stamps[i] = now
+        if t >= _UNIT:
+            self.tokens[i] = t - _UNIT
+            return 0
+        self.tokens[i] = t
+        per_s = max(self.per_ms * 1000, 1)
+        return (_UNIT - t + per_s - 1) // per_s  # 無條件進位到整秒
+
+
+# ============================================================
+# 📊 Metrics — 路由延遲直方圖與計數器（Prometheus 文字格式）
+# ============================================================
+LATENCY_BUCKETS = 15  # 延遲上限 128 µs × 2^0 … 2^14（約 2.1 秒），另加一格 +Inf
+_LE = ["%d.%06d" % ((128 << i) // 1000000, (128 << i) % 1000000) for i in range(LATENCY_BUCKETS)] + ["+Inf"]
+
+
+class RouteStats:
+    """
+    一條路由的統計。buckets[i] 是耗時落在第 i 格的請求數（不累計，輸出時才累加）；
+    總耗時拆成 sum_ms 與不足 1 ms 的 rem_us，整數不會大到需要配置記憶體。
+    """
+    def __init__(self, path, methods):
+        self.labels = 'route="%s",method="%s"' % (path, ",".join(methods) if methods else "*")
+        self.count = 0
+        self.errors = 0
+        self.sum_ms = 0
+        self.rem_us = 0
+        self.buckets = [0] * (LATENCY_BUCKETS + 1)
+
+
+def _family(name, kind, text):
+    return "# HELP %s %s\n# TYPE %s %s\n" % (name, text, name, kind)
+
+
+class Metrics:
+    """
+    執行期間的統計。記錄時只改預先配置好的整數與串列，不配置記憶體；
+    lines() 被抓取時才逐段組出 Prometheus 文字格式。
+      observe(func, us, error) ：記錄一次路由處理（WebApp 自動呼叫）
+      counter(名稱, 說明, func=None) / inc(名稱, n)：累計值
+      gauge(名稱, 說明, func=None)   / set(名稱, 值)：目前值
+    給 func 時不存數值，抓取時才呼叫 func() 取值（例如 len(table)）。
+    """
+    def __init__(self):
+        self.routes = {}      # 處理函式 → RouteStats，依註冊順序輸出
+        self.order = []
+        self.unmatched = 0    # 404 / 405
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.values = {}
+        self.meta = []        # (名稱, 型別, 說明, func)
+
+    def route(self, func, path, methods):
+        if func not in self.routes:
+            self.routes[func] = RouteStats(path, methods)
+            self.order.append(self.routes[func])
+
+    def observe(self, func, us, error=False):
+        s = self.routes[func]
+        s.count += 1
+        if error:
+            s.errors += 1
+        i = 0
+        v = (max(us, 1) - 1) >> 7
+        while v and i < LATENCY_BUCKETS:
+            v >>= 1
+            i += 1
+        s.buckets[i] += 1
+        us += s.rem_us
+        s.sum_ms += us // 1000
+        s.rem_us = us % 1000
+
+    def counter(self, name, text, func=None):
+        self._add(name, "counter", text, func)
+
+    def gauge(self, name, text, func=None):
+        self._add(name, "gauge", text, func)
+
+    def _add(self, name, kind, text, func):
+        if name not in self.values:
+            self.values[name] = 0
+            self.meta.append((name, kind, text, func))
+
+    def inc(self, name, n=1):
+        self.values[name] += n
+
+    def set(self, name, value):
+        self.values[name] = value
+
+    def lines(self):
+        """依序產生 Prometheus 文字格式的片段；還沒有請求的路由不輸出"""
+        used = [s for s in self.order if s.count]
+        yield _family("webapp_requests_total", "counter", "路由處理次數")
+        for s in used:
+            yield "webapp_requests_total{%s} %d\n" % (s.labels, s.count)
+        yield _family("webapp_request_errors_total", "counter", "回應 4xx / 5xx 的次數")
+        for s in used:
+            yield "webapp_request_errors_total{%s} %d\n" % (s.labels, s.errors)
+        yield _family("webapp_request_duration_seconds", "histogram", "路由處理函式的耗時")
+        for s in used:
+            out = []
+            n = 0
+            for i in range(LATENCY_BUCKETS + 1):
+                n += s.buckets[i]
+                out.append('webapp_request_duration_seconds_bucket{%s,le="%s"} %d\n' % (s.labels, _LE[i], n))
+            out.append("webapp_request_duration_seconds_sum{%s} %d.%06d\n"
+                       % (s.labels, s.sum_ms // 1000, s.sum_ms % 1000 * 1000 + s.rem_us))
+            out.append("webapp_request_duration_seconds_count{%s} %d\n" % (s.labels, s.count))
+            yield "".join(out)
+        for name, kind, text, value in (
+                ("webapp_unmatched_total", "counter", "找不到路由或方法不符（404 / 405）", self.unmatched),
+                ("webapp_received_bytes_total", "counter", "收到的請求位元組數（標頭 + 本文）", self.bytes_in),
+                ("webapp_sent_bytes_total", "counter", "送出的回應位元組數", self.bytes_out)):
+            yield _family(name, kind, text) + "%s %d\n" % (name, value)
+        for name, kind, text, func in self.meta:
+            value = func() if func else self.values[name]
+            yield _family(name, kind, text) + "%s %s\n" % (name, value)
+
+
+# ============================================================
+# 🧭 Router — 註冊時編譯好的路由表
+# ============================================================
+class Router:
+    """
+    靜態路徑放在 dict，O(1) 查詢；含 <參數> 的路徑放進以「/」分段的樹 (trie)，
+    查詢成本只和路徑段數有關，不會隨路由數量增加。
+    每個路徑對應 {方法: 處理函式}，"*" 代表不限方法。
+    樹節點為 [子節點 dict, 參數名稱, 參數子節點, 方法表]。
+    """
+    def __init__(self):
+        self.static = {}
+        self.tree = [{}, None, None, None]
+
+    def add(self, path, methods, func):
+        if "<" not in path:
+            table = self.static.setdefault(path, {})
+        else:
+            node = self.tree
+            for seg in path.strip("/").split("/"):
+                if seg[:1] == "<" and seg[-1:] == ">":
+                    if node[2] is None:
+                        node[1], node[2] = seg[1:-1], [{}, None, None, None]
+                    elif node[1] != seg[1:-1]:
+                        raise ValueError("同一層的路徑參數名稱必須相同: " + path)
+                    node = node[2]
+                else:
+                    node = node[0].setdefault(seg, [{}, None, None, None])
+            if node[3] is None:
+                node[3] = {}
+            table = node[3]
+        for m in methods or ("*",):
+            table[m.upper()] = func
+
+    def match(self, path):
+        """回傳 (方法表, 路徑參數)；找不到時回傳 (None, None)"""
+        table = self.static.get(path)
+        if table is not None:
+            return table, {}
+        params = {}
+        table = self._walk(self.tree, path.strip("/").split("/"), 0, params)
+        return (table, params) if table is not None else (None, None)
+
+    def _walk(self, node, segs, i, params):
+        if i == len(segs):
+            return node[3]
+        # 固定的路徑段優先，其次才是參數
+        child = node[0].get(segs[i])
+        if child is not None:
+            table = self._walk(child, segs, i + 1, params)
+            if table is not None:
+                return table
+        if node[2] is not None and segs[i]:
+            params[node[1]] = segs[i]
+            table = self._walk(node[2], segs, i + 1, params)
+            if table is not None:
+                return table
+            del params[node[1]]
+        return None
+
+
+# ============================================================
+# 🌐 WebApp — 非同步網頁伺服器
+# ============================================================
 class WebApp:
-    def __init__(self, title="MicroPython WebApp"):
+    """
+    簡易的非同步網頁伺服器。
+      @app.route(path, methods=None)
+                        註冊路由；路徑可含 <參數>（放在 req.params），methods 省略時不限方法，
+                        方法不符時自動回 405。處理函式收到 WebRequest，可以是一般函式或 async 函式，
+                        回傳 dict/list（JSON）、字串（HTML）或 Stream（逐段送出）
+      metrics           每條路由的次數、錯誤與延遲直方圖，以及連線計數；metrics_stream() 輸出
+      start(port)       以 asyncio.start_server 事件驅動接受連線；
+                        start(port, mode="poll") 為舊版輪詢 accept() 的做法
+    事件驅動模式支援 HTTP/1.1 持久連線與管線化（pipelining）：同一條連線上的請求依序處理，
+    閒置超過 idle_timeout 秒或處理滿 max_requests 個請求後關閉；有連線在排隊時閒置的持久連線會提早關閉讓出名額。
+    """
+    def __init__(self, title="MicroPython WebApp", timeout=3, body_max=2048,
+                 idle_timeout=5, max_requests=100, out_size=1024,
+                 max_conns=6, max_queue=4, queue_timeout=2, write_timeout=5):
         self.title = title
-        self.routes = {}
+        self.router = Router()
+        self.timeout = timeout            # 讀取請求的逾時秒數
+        self.body_max = body_max          # 先讀進 req.body 的本文上限，其餘由 req.read() 串流讀取
+        self.idle_timeout = idle_timeout  # 持久連線等待下一個請求的秒數
+        self.max_requests = max_requests  # 每條連線最多處理幾個請求
+        # 回應序列化：狀態行 + Content-Type 的前綴依組合快取，連線標頭事先組好，
+        # 整個回應寫進同一塊可重複使用的緩衝區後一次送出
+        self._heads = {}
+        self._tail_keep = ("\r\nConnection: keep-alive\r\nKeep-Alive: timeout=%d, max=%d\r\n\r\n"
+                           % (idle_timeout, max_requests)).encode()
+        self._tail_close = b"\r\nConnection: close\r\n\r\n"
+        self._out = bytearray(out_size)
+        self._mv = memoryview(self._out)
+        self.events = EventHub()          # Server-Sent Events 推播，見 events.stream()
+        # 連線名額：同時最多 max_conns 條連線在處理，再多的最多排 max_queue 條、
+        # 等 queue_timeout 秒，其餘立刻回 503；寫回應超過 write_timeout 秒就放棄這條連線
+        self.max_conns = max_conns
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.write_timeout = write_timeout
+        self._waiters = []
+        self.stats = {"active": 0, "peak": 0, "queued": 0, "rejected": 0, "served": 0, "timeouts": 0,
+                      "limited": 0}
+        # /api/* 每個用戶端的預設限流；設成 None 可關閉，個別路由用 route(limit=...) 調整
+        self.api_limit = RateLimiter(5, 10)
+        self._limits = {}
+        # 每條路由的次數 / 錯誤 / 延遲直方圖與收送位元組數，metrics_stream() 以 Prometheus 格式輸出
+        self.metrics = Metrics()
+        st, m = self.stats, self.metrics
+        m.gauge("webapp_connections_active", "處理中的連線", lambda: st["active"])
+        m.gauge("webapp_connections_peak", "同時處理的連線數最大值", lambda: st["peak"])
+        m.gauge("webapp_connections_queued", "排隊等名額的連線", lambda: st["queued"])
+        m.counter("webapp_rejected_total", "名額與佇列都滿而回 503 的連線", lambda: st["rejected"])
+        m.counter("webapp_served_total", "處理完的請求", lambda: st["served"])
+        m.counter("webapp_timeouts_total", "讀取或寫入逾時", lambda: st["timeouts"])
+        m.counter("webapp_limited_total", "被限流而回 429 的請求", lambda: st["limited"])
+        m.gauge("webapp_sse_streams", "連線中的 SSE 串流", lambda: len(self.events.streams))
 
-    def route(self, path):
+    def route(self, path, methods=None, limit=None):
+        """
+        註冊路由。limit 可給 (每秒請求數, 突發上限) 或 RateLimiter，
+        取代 /api/* 預設的 api_limit；不在 /api/ 底下的路由預設不限流。
+        """
         def wrapper(func):
-            self.routes[path] = func
+            self.router.add(path, methods, func)
+            self.metrics.route(func, path, methods)
+            if limit is not None:
+                self._limits[func] = limit if isinstance(limit, RateLimiter) else RateLimiter(*limit)
             return func
         return wrapper
 
-    async def start(self, port=80):
-        s = socket.socket()
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind(('0.0.0.0', port))
-        s.listen(5)
-        s.setblocking(False)
+    def metrics_stream(self):
+        """/api/metrics 用：以 Prometheus 文字格式逐段送出 self.metrics"""
+        return Stream(self.metrics.lines(), "text/plain; version=0.0.4; charset=utf-8")
 
+    def _show_ip(self, port):
         sta = network.WLAN(network.STA_IF)
         ap = network.WLAN(network.AP_IF)
         print("STA:", sta.ifconfig())
         print("AP:", ap.ifconfig())
         print("🌐 WebApp running on http://%s:%d/" % (sta.ifconfig()[0], port))
 
+    # ---- 連線名額 ----
+    async def _acquire(self):
+        """取得處理名額；回傳 False 表示要回 503"""
+        st = self.stats
+        if st["active"] < self.max_conns:
+            st["active"] += 1
+            if st["active"] > st["peak"]:
+                st["peak"] = st["active"]
+            return True
+        if len(self._waiters) >= self.max_queue:
+            st["rejected"] += 1
+            return False
+        ev = asyncio.Event()
+        self._waiters.append(ev)
+        st["queued"] = len(self._waiters)
+        try:
+            await asyncio.wait_for(ev.wait(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not ev.is_set():
+                self._waiters.remove(ev)
+                st["rejected"] += 1
+                return False
+        finally:
+            st["queued"] = len(self._waiters)
+        return True
+
+    def _release(self):
+        if self._waiters:
+            self._waiters.pop(0).set()  # 名額直接交給排最久的連線
+            self.stats["queued"] = len(self._waiters)
+        else:
+            self.stats["active"] -= 1
+
+    async def _drain(self, writer):
+        try:
+            await asyncio.wait_for(writer.drain(), self.write_timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise OSError("write timeout")  # 用戶端不收資料：當成斷線處理
+
+    def _busy(self):
+        return self._response(("503 Service Unavailable", "text/html",
+                               "<h1>503 Service Unavailable</h1>", "Retry-After: 1"), False)
+
+    async def start(self, port=80, mode="stream"):
+        self._show_ip(port)
+        if mode == "poll":
+            await self._poll_loop(port)
+            return
+        # 有連線時才由事件迴圈喚醒，閒置時不佔用任何喚醒
+        server = await asyncio.start_server(self.handle_stream, "0.0.0.0", port, backlog=5)
+        await server.wait_closed()
+
+    # ---- 路由分派（兩種模式共用）----
+    async def _dispatch(self, request):
+        """呼叫路由處理函式，回傳 Stream 或 (狀態, Content-Type, 本文[, 額外標頭])"""
+        table, params = self.router.match(request.path)
+        if table is None:
+            self.metrics.unmatched += 1
+            return "404 NOT FOUND", "text/html", "<h1>404 Not Found</h1>"
+        func = table.get(request.method) or table.get("*")
+        if func is None:
+            self.metrics.unmatched += 1
+            return ("405 Method Not Allowed", "text/html", "<h1>405 Method Not Allowed</h1>",
+                    "Allow: " + ", ".join(sorted(table)))
+        request.params = params
+        limiter = self._limits.get(func)
+        if limiter is None and request.path.startswith("/api/"):
+            limiter = self.api_limit
+        if limiter is not None and request.remote is not None:
+            wait = limiter.take(request.remote)
+            if wait:
+                self.stats["limited"] += 1
+                return "429 Too Many Requests", "text/plain", b"", "Retry-After: %d" % wait
+        t0 = utime.ticks_us()
+        try:
+            result = func(request)
+            if not isinstance(result, (str, bytes, dict, list, tuple, Stream)) and hasattr(result, "send"):
+                result = await result  # async 路由
+        except HttpError as e:
+            result = e.status, "text/html", "<h1>%s</h1>" % e.status
+        except Exception as e:
+            print("⚠️ 路由錯誤:", request.path, e)
+            result = "500 Internal Server Error", "text/html", "<h1>500 Internal Server Error</h1>"
+        # 只量處理函式本身；Stream 的本文在送出時才產生，不算在內
+        self.metrics.observe(func, utime.ticks_diff(utime.ticks_us(), t0),
+                             isinstance(result, tuple) and result[0] >= "4")
+        if isinstance(result, (tuple, Stream)):
+            return result  # 路由自己決定狀態與標頭，例如 static_file() 的 304
+        if isinstance(result, (dict, list)):
+            return "200 OK", "application/json", ujson.dumps(result)
+        return "200 OK", "text/html", result if isinstance(result, (str, bytes)) else str(result)
+
+    def _response(self, result, keep):
+        """
+        把 (狀態, Content-Type, 本文[, 額外標頭]) 序列化，回傳要依序送出的片段。
+        帶 Content-Length，持久連線時瀏覽器才知道本文在哪裡結束；
+        304 / 204 沒有本文，也不能帶與 200 不同的 Content-Length（RFC 9110 §8.6），所以不送這個標頭。
+        放得進緩衝區時整個回應只是緩衝區的一段 memoryview，不另外串接字串。
+        """
+        status, ctype, body = result[0], result[1], result[2]
+        bare = status[:3] in ("304", "204")
+        if bare:
+            body = b""
+        elif isinstance(body, str):
+            body = body.encode()
+        key = status + ctype
+        prefix = self._heads.get(key)
+        if prefix is None:
+            head = "HTTP/1.1 %s\r\nContent-Type: %s" % (status, ctype)
+            prefix = self._heads[key] = (head if bare else head + "\r\nContent-Length: ").encode()
+        tail = self._tail_keep if keep else self._tail_close
+        if len(result) > 3:
+            tail = b"\r\n" + result[3].encode() + tail
+        mv = self._mv
+        n = len(prefix)
+        mv[:n] = prefix
+        if not bare:
+            n = _put_int(self._out, n, len(body))
+        mv[n:n + len(tail)] = tail
+        n += len(tail)
+        if n + len(body) > len(mv):
+            return mv[:n], body  # 本文太大：標頭與本文分兩次送
+        mv[n:n + len(body)] = body
+        return (mv[:n + len(body)],)
+
+    def _write(self, writer, parts):
+        for part in parts:
+            writer.write(part)
+            self.metrics.bytes_out += len(part)
+        # uasyncio 的 write() 會複製送不完的資料；CPython 的 transport 可能直接保留這段
+        # memoryview，此時改用新的緩衝區，避免下一個回應蓋掉還沒送出的內容
+        transport = getattr(writer, "transport", None)
+        if transport is not None and transport.get_write_buffer_size():
+            self._out = bytearray(len(self._out))
+            self._mv = memoryview(self._out)
+
+    def _error(self, e):
+        return self._response((e.status, "text/html", "<h1>%s</h1>" % e.status), False)
+
+    def _stream_head(self, result, keep):
+        # 串流回應：不知道長度時沒有 Content-Length，以關閉連線表示結束
+        head = "HTTP/1.1 200 OK\r\nContent-Type: " + result.content_type
+        if result.headers:
+            head += "\r\n" + result.headers
+        if result.length is None:
+            return (head + "\r\nConnection: close\r\n\r\n").encode()
+        head = (head + "\r\nContent-Length: %d" % result.length).encode()
+        return head + (self._tail_keep if keep else self._tail_close)
+
+    async def _send_stream(self, writer, result, head):
+        """
+        送出 Stream 的標頭 head 與本文；writer 可以是 StreamWriter 或輪詢模式的 socket。
+        不論在哪一步失敗都會關閉 chunks（EventStream 在這時才離開 hub.streams）
+        """
+        chunks = result.chunks
+        try:
+            if hasattr(writer, "sendall"):
+                self._sendall(writer, (head,))
+            else:
+                self._write(writer, (head,))
+            if hasattr(chunks, "__anext__"):
+                async for chunk in chunks:  # 例如 EventStream：有事件才產生下一段
+                    await self._send_chunk(writer, chunk)
+            else:
+                for chunk in chunks:
+                    await self._send_chunk(writer, chunk)
+        finally:
+            _close_stream(result)  # 用戶端中途斷線時也要讓產生器關檔、讓訂閱者退出
+
+    async def _send_chunk(self, writer, chunk):
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        self.metrics.bytes_out += len(chunk)
+        if hasattr(writer, "sendall"):
+            writer.sendall(chunk)
+            return
+        # 板子上 write() 會複製送不完的資料；CPython 的 transport 可能保留 memoryview，
+        # 而 chunks 常是重複使用的緩衝區，所以在電腦上先轉成 bytes
+        if isinstance(chunk, memoryview) and hasattr(writer, "transport"):
+            chunk = bytes(chunk)
+        writer.write(chunk)
+        await self._drain(writer)
+
+    # ---- 事件驅動模式 ----
+    async def _handle_one(self, reader, writer, idle, last, peer):
+        """處理連線上的一個請求，回傳是否繼續使用這條連線"""
+        request = await read_request(reader, self.timeout, idle, self.body_max)
+        if request is None:
+            return False
+        request.remote = peer
+        keep = request.keep_alive() and not last
+
+        result = await self._dispatch(request)
+        # 路由沒讀完的本文要丟掉，管線化的下一個請求才會從正確的位置開始
+        try:
+            await request.discard()
+        except BaseException:
+            _close_stream(result)  # 還沒開始送：SSE 連線不能留在 hub.streams 佔名額
+            raise
+        self.stats["served"] += 1
+        self.metrics.bytes_in += request.head_size + request.received
+        if isinstance(result, Stream):
+            keep = keep and result.length is not None
+            await self._send_stream(writer, result, self._stream_head(result, keep))
+            return keep
+
+        self._write(writer, self._response(result, keep))
+        await self._drain(writer)
+        return keep
+
+    async def _idle_wait(self, reader):
+        """
+        持久連線等下一個請求，最多 idle_timeout 秒，回傳是否有資料到達。
+        每 queue_timeout / 4 秒檢查一次是否有連線在排隊，有的話就放手：
+        閒置的連線不能佔著名額，讓排隊的用戶端等到 queue_timeout 而收到 503
+        """
+        step = self.queue_timeout / 4
+        left = self.idle_timeout
+        while left > 0 and not self._waiters:
+            try:
+                return await asyncio.wait_for(reader.fill(), min(step, left))
+            except asyncio.TimeoutError:
+                left -= step
+        return False
+
+    async def handle_stream(self, reader, writer):
+        if not await self._acquire():
+            await self._reject(reader, writer)
+            return
+        try:
+            # 第一個請求用一般逾時；之後的請求在持久連線上由 _idle_wait 等到有資料才開始讀
+            n = 1
+            peer = writer.get_extra_info("peername")
+            peer = peer[0] if peer else None
+            reader = _StreamReader(reader)
+            while await self._handle_one(reader, writer, self.timeout, n >= self.max_requests, peer):
+                if not await self._idle_wait(reader):
+                    break
+                n += 1
+
+        except HttpError as e:
+            if e.status.startswith("408"):
+                self.stats["timeouts"] += 1
+            self._write(writer, self._error(e))
+            await self._drain(writer)
+        except asyncio.TimeoutError:
+            pass
+        except (OSError, EOFError):
+            pass  # 若客戶端中斷，忽略即可
+        except Exception as e:
+            print("⚠️ handle_stream error:", e)
+
+        finally:
+            self._release()
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def _reject(self, reader, writer):
+        """名額與佇列都滿了：不解析請求，直接回 503 並關閉連線"""
+        try:
+            # 先收下已送達的請求，避免關閉時還有未讀資料而送出 RST，讓用戶端收不到 503
+            await asyncio.wait_for(reader.read(MAX_LINE), 0.1)
+        except Exception:
+            pass
+        try:
+            self._write(writer, self._busy())
+            await self._drain(writer)
+            writer.close()
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+    # ---- 舊版輪詢模式 ----
+    def _sendall(self, client, parts):
+        for part in parts:
+            client.sendall(part)
+            self.metrics.bytes_out += len(part)
+
+    async def _poll_loop(self, port):
+        s = socket.socket()
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(('0.0.0.0', port))
+        s.listen(5)
+        s.setblocking(False)
+
         while True:
             try:
                 client, addr = s.accept()  # non-blocking 模式下，若無連線會丟 OSError
-                asyncio.create_task(self.handle_client(client))
+                asyncio.create_task(self.handle_client(client, addr))
             except OSError:
                 # 沒有連線就先讓出控制權
                 await asyncio.sleep(0.05)
@@ -127,76 +1323,40 @@ class WebApp:
                 sys.print_exception(e)
                 await asyncio.sleep(0.5)
 
-    async def handle_client(self, client):
+    async def handle_client(self, client, addr=None):
+        if not await self._acquire():
+            try:
+                self._sendall(client, self._busy())
+            except OSError:
+                pass
+            client.close()
+            return
         try:
             client.settimeout(3)
 
-            # 嘗試接收資料（HTTP 請求）
+            # ---- 解析 HTTP（與事件驅動模式共用同一個解析器）----
             try:
-                req = client.recv(1024)
-            except OSError as e:
-                # 若 timeout 或 socket 被中斷
-                if e.args[0] == 116:  # ETIMEDOUT
-                    client.close()
-                    return
-                raise e
-
-            if not req:
-                client.close()
+                request = await read_request(_SockReader(client), self.timeout, self.timeout, self.body_max)
+            except HttpError as e:
+                self._sendall(client, self._error(e))
                 return
-
-            # ---- 解析 HTTP ----
-            req = req.decode("utf-8", "ignore")
-            line = req.split("\r\n")[0]
-            parts = line.split(" ")
-            method = parts[0]
-            path = parts[1] if len(parts) > 1 else "/"
-            
-            body = ""
-            if "\r\n\r\n" in req:
-                _, body = req.split("\r\n\r\n", 1)
-
-            # ---- 查詢參數解析 ----
-            args = {}
-            if "?" in path:
-                base, query = path.split("?", 1)
-                path = base
-                for kv in query.split("&"):
-                    if "=" in kv:
-                        k, v = kv.split("=", 1)
-                        args[k] = v
-
-            # ---- 建立請求物件 ----
-            request = WebRequest(method, path, args, body)
+            except (OSError, EOFError):
+                return  # timeout 或 socket 被中斷
+            if request is None:
+                return
+            request.remote = addr[0] if addr else None
 
             # ---- 路由分派 ----
-            if path in self.routes:
-                result = self.routes[path](request)
-                if isinstance(result, (dict, list)):
-                    content = (
-                        "HTTP/1.1 200 OK\r\n"
-                        "Content-Type: application/json\r\n"
-                        "Connection: close\r\n\r\n"
-                        + str(result)
-                    )
-                else:
-                    content = (
-                        "HTTP/1.1 200 OK\r\n"
-                        "Content-Type: text/html\r\n"
-                        "Connection: close\r\n\r\n"
-                        + str(result)
-                    )
-            else:
-                content = (
-                    "HTTP/1.1 404 NOT FOUND\r\n"
-                    "Content-Type: text/html\r\n"
-                    "Connection: close\r\n\r\n"
-                    "<h1>404 Not Found</h1>"
-                )
+            result = await self._dispatch(request)
+            self.stats["served"] += 1
+            self.metrics.bytes_in += request.head_size + request.received
 
             # ---- 傳送資料 ----
             try:
-                client.send(content.encode())
+                if isinstance(result, Stream):
+                    await self._send_stream(client, result, self._stream_head(result, False))
+                else:
+                    self._sendall(client, self._response(result, False))
             except OSError:
                 pass  # 若客戶端中斷，忽略即可
 
@@ -204,6 +1364,7 @@ class WebApp:
             print("⚠️ handle_client error:", e)
 
         finally:
+            self._release()
             client.close()
             await asyncio.sleep(0)
 
@@ -0,0 +1,472 @@
+# 鬧鐘排程工具：以 (時, 分) 分鐘桶索引鬧鐘，並以最小堆積 (min-heap)
+# 保存每一桶的下一次觸發時間。alarm_task 只需睡到最早的期限，
+# 醒來後只檢查當下那一分鐘的鬧鐘，不必每秒掃過整個 alarms 清單。
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+try:
+    import heapq
+except ImportError:
+    import uheapq as heapq
+
+
+DAY = 86400
+MAX_SLEEP = 60  # 最長睡眠秒數，讓時鐘校正等變化最遲一分鐘內被察覺
+
+# 鬧鐘紀錄 (record) 是 tuple，欄位順序如下；由 alarm_store 從緊湊的二進位格式解出
+# (id, y, m, d, h, min, enabled, song, mask, every, anchor)
+#   y/m/d 為 -1 表示每天；mask/every/anchor 為已編譯的重複規則，mask=0 表示沒有規則
+A_ID, A_Y, A_M, A_D, A_H, A_MIN, A_ON, A_SONG, A_MASK, A_EVERY, A_ANCHOR = range(11)
+
+_MDAYS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+# ============================================================
+# 🧮 日期換算（不依賴 mktime，MicroPython / CPython 結果一致）
+# ============================================================
+def is_leap(y):
+    return y % 4 == 0 and (y % 100 != 0 or y % 400 == 0)
+
+def days_in_month(y, m):
+    if m == 2 and is_leap(y):
+        return 29
+    return _MDAYS[m - 1]
+
+def days_from_civil(y, m, d):
+    """回傳 y/m/d 距離 2000-01-01 的天數"""
+    y -= m <= 2
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (m + (-3 if m > 2 else 9)) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 730425
+
+def civil_from_days(n):
+    """days_from_civil 的反函式，回傳 (y, m, d)"""
+    n += 730425
+    era = n // 146097
+    doe = n - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    d = doy - (153 * mp + 2) // 5 + 1
+    m = mp + 3 if mp < 10 else mp - 9
+    return yoe + era * 400 + (m <= 2), m, d
+
+def weekday(n):
+    """天數 → 星期 (0=一 ... 6=日)；2000-01-01 是星期六"""
+    return (n + 5) % 7
+
+def to_secs(y, m, d, h=0, mi=0, s=0):
+    """本地時間 → 自 2000-01-01 00:00:00 起算的秒數"""
+    return days_from_civil(y, m, d) * DAY + h * 3600 + mi * 60 + s
+
+def localtime_secs(t):
+    """utime.localtime() 的 tuple → 秒數"""
+    return to_secs(t[0], t[1], t[2], t[3], t[4], t[5])
+
+
+# ============================================================
+# 🔁 重複規則：存檔時編譯成位元遮罩，比對時只測位元
+# ============================================================
+# r = [mask, every, anchor]
+#   mask  bit 0~6   ：星期一 ~ 星期日
+#         bit 7~18  ：1 ~ 12 月
+#         bit 19~23 ：當月第 1 ~ 5 個（該星期）
+#         bit 24    ：當月最後一個（該星期）
+#   every ：每 N 天（0 表示不限），anchor 為起算日（天數）
+WD_ALL = 0x7F
+MON_SHIFT = 7
+MON_ALL = 0xFFF << MON_SHIFT
+NTH_SHIFT = 19
+LAST_BIT = 1 << 24
+NTH_ALL = 0x1F << NTH_SHIFT | LAST_BIT
+MAX_SCAN = 3000  # 尋找下一次觸發日最多掃描的次數（約 8 年）
+
+REPEATS = {
+    "daily": WD_ALL,
+    "weekdays": 0x1F,   # 一 ~ 五
+    "weekend": 0x60,    # 六、日
+}
+
+def compile_rule(data, anchor):
+    """
+    把 POST 內容中的重複設定編譯成 (標籤, r)，沒有重複設定時回傳 None。
+    支援欄位：
+      repeat ："daily" / "weekdays" / "weekend"
+      days   ：星期清單，例如 [0, 2, 4]（0=一）
+      every  ：每 N 天，從 anchor（天數）起算
+      nth, wday：每月第 nth 個星期 wday，nth=-1 表示最後一個
+      months ：限定月份清單，例如 [1, 7]；單獨使用時為這幾個月的每一天
+    """
+    rep = data.get("repeat")
+    days = data.get("days")
+    every = int(data.get("every", 0) or 0)
+    nth = data.get("nth")
+    months = data.get("months")
+    if not (rep or days or every or nth is not None or months):
+        return None
+
+    label = []
+    wmask = WD_ALL
+    if rep:
+        if rep not in REPEATS:
+            raise ValueError("unknown repeat: %s" % rep)
+        wmask = REPEATS[rep]
+        label.append(rep)
+    if days:
+        wmask = 0
+        for w in days:
+            wmask |= 1 << (int(w) % 7)
+        label.append("days:" + ",".join(str(int(w) % 7) for w in days))
+    mask = wmask
+    if nth is not None:
+        nth = int(nth)
+        wday = int(data.get("wday", 0)) % 7
+        if nth == -1:
+            mask = (1 << wday) | LAST_BIT
+        elif 1 <= nth <= 5:
+            mask = (1 << wday) | (1 << (NTH_SHIFT + nth - 1))
+        else:
+            raise ValueError("nth must be 1..5 or -1")
+        label.append("nth:%d/%d" % (nth, wday))
+    if months:
+        for mo in months:
+            if not 1 <= int(mo) <= 12:
+                raise ValueError("months must be 1..12")
+            mask |= 1 << (MON_SHIFT + int(mo) - 1)
+        label.append("months:" + ",".join(str(int(mo)) for mo in months))
+    else:
+        mask |= MON_ALL
+    if every < 0:
+        raise ValueError("every must be >= 0")
+    if every:
+        label.append("every:%d" % every)
+    return " ".join(label), [mask, every, anchor if every else 0]
+
+def rule_label(r):
+    """由已編譯的規則反推出 compile_rule 使用的標籤（顯示用）"""
+    mask, every, anchor = r
+    label = []
+    wmask = mask & WD_ALL
+    if mask & NTH_ALL:
+        w = 0
+        while not (wmask >> w) & 1:
+            w += 1
+        if mask & LAST_BIT:
+            n = -1
+        else:
+            n = 1
+            while not (mask >> (NTH_SHIFT + n - 1)) & 1:
+                n += 1
+        label.append("nth:%d/%d" % (n, w))
+    elif wmask != WD_ALL:
+        for name, v in REPEATS.items():
+            if v == wmask:
+                label.append(name)
+                break
+        else:
+            label.append("days:" + ",".join(str(w) for w in range(7) if (wmask >> w) & 1))
+    elif not every:
+        label.append("daily")
+    if mask & MON_ALL != MON_ALL:
+        label.append("months:" + ",".join(str(mo) for mo in range(1, 13)
+                                         if (mask >> (MON_SHIFT + mo - 1)) & 1))
+    if every:
+        label.append("every:%d" % every)
+    return " ".join(label)
+
+def rule_match(r, y, m, d):
+    """比對某一天是否符合已編譯的規則；成本固定，與規則複雜度無關"""
+    mask, every, anchor = r
+    n = days_from_civil(y, m, d)
+    if not (mask >> weekday(n)) & 1 or not (mask >> (MON_SHIFT - 1 + m)) & 1:
+        return False
+    if mask & NTH_ALL and not (
+            (mask >> (NTH_SHIFT + (d - 1) // 7)) & 1
+            or (mask & LAST_BIT and d + 7 > days_in_month(y, m))):
+        return False
+    return not every or (n >= anchor and (n - anchor) % every == 0)
+
+def _next_rule_day(r, day):
+    """從第 day 天起找出第一個符合規則的日子"""
+    every, anchor = r[1], r[2]
+    step = 1
+    if every:
+        if day < anchor:
+            day = anchor
+        else:
+            day += (anchor - day) % every
+        step = every
+    for _ in range(MAX_SCAN):
+        y, m, d = civil_from_days(day)
+        if rule_match(r, y, m, d):
+            return day
+        day += step
+    return None
+
+
+def next_fire(rec, now):
+    """
+    回傳鬧鐘紀錄在 now（秒）之後的下一次觸發時間（該分鐘的第 0 秒）。
+    若該分鐘尚未結束也算數，與 is_alarm_match 以「分鐘」比對一致。
+    單次鬧鐘已過期或日期無效時回傳 None。
+    """
+    y, m, d, h, mi = rec[A_Y], rec[A_M], rec[A_D], rec[A_H], rec[A_MIN]
+    if not (0 <= h < 24 and 0 <= mi < 60):
+        return None
+    if rec[A_MASK]:
+        r = (rec[A_MASK], rec[A_EVERY], rec[A_ANCHOR])
+        tod = h * 3600 + mi * 60
+        day = now // DAY
+        if day * DAY + tod + 60 <= now:
+            day += 1
+        day = _next_rule_day(r, day)
+        return None if day is None else day * DAY + tod
+    if y == -1 and m == -1 and d == -1:
+        # 每天鬧鐘：今天的時間已過就排到明天
+        t = now - now % DAY + h * 3600 + mi * 60
+        if t + 60 <= now:
+            t += DAY
+        return t
+    if not (1 <= m <= 12 and 1 <= d <= days_in_month(y, m)):
+        return None  # 部分欄位為 -1 或日期不存在，is_alarm_match 永遠不會成立
+    t = to_secs(y, m, d, h, mi)
+    return t if t + 60 > now else None
+
+
+# ============================================================
+# 📋 觸發紀錄
+# ============================================================
+class TriggerLedger:
+    """
+    記錄每組鬧鐘 (以 id 為鍵) 最後一次觸發的日期，防止同一天重複響。
+    日期往前推進時自動清掉舊日期的紀錄，不需要在刪除或排序時整個清空。
+    """
+    def __init__(self):
+        self._day = None
+        self._fired = {}   # alarm id -> (y, m, d)
+
+    def __len__(self):
+        return len(self._fired)
+
+    def _prune(self, day):
+        # 只在日期往前推進時清理；補響較早日期或時鐘倒退時不清
+        if self._day is None or day > self._day:
+            self._day = day
+            self._fired = {k: v for k, v in self._fired.items() if v >= day}
+
+    def fired(self, aid, day):
+        self._prune(day)
+        return self._fired.get(aid) == day
+
+    def mark(self, aid, day):
+        self._prune(day)
+        cur = self._fired.get(aid)
+        if cur is None or day > cur:
+            self._fired[aid] = day
+
+    def forget(self, aid):
+        self._fired.pop(aid, None)
+
+    def clear(self):
+        self._fired = {}
+
+
+# ============================================================
+# ⏰ AlarmScheduler — 期限驅動的鬧鐘排程 + 分鐘索引
+# ============================================================
+class AlarmScheduler:
+    """
+    index 以 (時, 分) 分桶保存啟用中鬧鐘的 id，同一分鐘的鬧鐘放在同一桶，
+    需要欄位時再向 table（alarm_store.AlarmTable）查紀錄。
+    最小堆積保存 (期限, (時, 分))，每桶只有一個有效項目，
+    所以堆積最多 1440 筆，與鬧鐘數量無關；醒來時只檢查當下那一桶。
+    期限變更採惰性標記，過期項目在 pop 時略過，累積過多時才重建堆積。
+    """
+    def __init__(self, table):
+        self.table = table
+        self.index = {}    # (h, min) -> [id, ...]
+        self._n = 0
+        self._heap = []
+        self._due = {}     # (h, min) -> 目前有效的期限
+        self._stale = 0
+        self._event = asyncio.Event()
+
+    def __len__(self):
+        return self._n
+
+    def _set_due(self, key, t):
+        old = self._due.get(key)
+        if old == t:
+            return
+        if old is not None:
+            self._stale += 1
+        if t is None:
+            self._due.pop(key, None)
+        else:
+            self._due[key] = t
+            heapq.heappush(self._heap, (t, key))
+        if self._stale > 16 and self._stale > len(self._due):
+            self._compact()
+
+    def _compact(self):
+        due = self._due
+        self._heap = [(t, k) for k, t in due.items()]
+        heapq.heapify(self._heap)
+        self._stale = 0
+
+    def _wake(self):
+        self._event.set()
+
+    # ---- 變更介面 ----
+    def rebuild(self, table, now):
+        """整批重建（開機、重置或時鐘倒退時使用）"""
+        self.table = table
+        self.index = {}
+        self._n = 0
+        self._heap = []
+        self._due = {}
+        self._stale = 0
+        for rec in table:
+            self.add(rec, now, wake=False)
+        self._wake()
+
+    def add(self, rec, now, wake=True):
+        """加入一筆鬧鐘紀錄；停用或已過期的鬧鐘不進索引"""
+        self._unlink(rec)
+        if rec[A_ON]:
+            t = next_fire(rec, now)
+            if t is not None:
+                key = (rec[A_H], rec[A_MIN])
+                self.index.setdefault(key, []).append(rec[A_ID])
+                self._n += 1
+                cur = self._due.get(key)
+                if cur is None or t < cur:
+                    self._set_due(key, t)
+        if wake:
+            self._wake()
+
+    def update(self, rec, now):
+        """鬧鐘內容或啟用狀態改變後呼叫"""
+        self.add(rec, now)
+
+    def _unlink(self, rec):
+        key = (rec[A_H], rec[A_MIN])
+        bucket = self.index.get(key)
+        if not bucket or rec[A_ID] not in bucket:
+            return
+        bucket.remove(rec[A_ID])
+        self._n -= 1
+        if not bucket:
+            # 空桶不再需要期限；非空桶保留原期限，頂多多醒一次
+            del self.index[key]
+            self._set_due(key, None)
+
+    def remove(self, rec):
+        self._unlink(rec)
+        self._wake()
+
+    def clear(self):
+        """清空索引與期限；紀錄表由呼叫端先清空，這裡仍沿用同一個 table 查紀錄"""
+        self.rebuild(self.table, 0)
+
+    # ---- 查詢介面 ----
+    def next_deadline(self):
+        """最早的有效期限；沒有鬧鐘時回傳 None"""
+        heap, due = self._heap, self._due
+        while heap and due.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+            self._stale -= 1
+        return heap[0][0] if heap else None
+
+    def pop_due(self, now):
+        """取出期限 <= now 的分鐘桶，回傳 [(期限, (時, 分)), ...]"""
+        out = []
+        heap, due = self._heap, self._due
+        while heap and heap[0][0] <= now:
+            t, key = heapq.heappop(heap)
+            if due.get(key) != t:
+                self._stale -= 1
+                continue
+            del due[key]
+            out.append((t, key))
+        return out
+
+    def bucket(self, key):
+        """某一分鐘啟用中的鬧鐘紀錄"""
+        get = self.table.get
+        out = []
+        for aid in self.index.get(key, ()):
+            rec = get(aid)
+            if rec is not None:
+                out.append(rec)
+        return out
+
+    def reschedule(self, key, after):
+        """
+        該桶處理完後，依桶內鬧鐘排入 after（秒）之後的下一次期限；
+        不會再觸發的單次鬧鐘順便移出索引。
+        """
+        ids = self.index.get(key)
+        if not ids:
+            return
+        best = None
+        keep = []
+        get = self.table.get
+        for aid in ids:
+            rec = get(aid)
+            t = None if rec is None else next_fire(rec, after)
+            if t is None:
+                self._n -= 1
+                continue
+            keep.append(aid)
+            if best is None or t < best:
+                best = t
+        if keep:
+            self.index[key] = keep
+        else:
+            del self.index[key]
+        self._set_due(key, best)
+
+    def missed(self, key, since, before, window):
+        """
+        範圍查詢：桶內每組鬧鐘在 [since, before) 之間錯過的觸發，回傳 [(時間, 紀錄, 可補響), ...]。
+        只逐次展開最近 window 秒內的觸發（取最後一次，可補響）；更早的部分只檢查一次，
+        有的話回報最早那一次（可補響為 False），讓呼叫端記錄、計數並標記為已處理。
+        所以時鐘從 2000 年跳到現在也只多查一次，不會逐日掃過中間幾十年。
+        用於時鐘前跳或任務卡住後補響，只看到期的桶，不掃整份清單。
+        """
+        lo = max(since, before - window)
+        out = []
+        for rec in self.bucket(key):
+            if lo > since:
+                t = next_fire(rec, since)
+                if t is not None and t < lo:
+                    out.append((t, rec, False))
+            last = None
+            t = next_fire(rec, lo)
+            while t is not None and t < before:
+                last = t
+                t = next_fire(rec, t + 60)
+            if last is not None:
+                out.append((last, rec, True))
+        return out
+
+    def defer(self, key, t):
+        """暫緩到 t 秒再檢查該桶（例如正在響鈴時）"""
+        self._set_due(key, t)
+
+    async def wait(self, now):
+        """睡到最早期限，或被變更喚醒，最多 MAX_SLEEP 秒"""
+        t = self.next_deadline()
+        delay = MAX_SLEEP if t is None else min(max(t - now, 0), MAX_SLEEP)
+        if delay > 0:
+            try:
+                await asyncio.wait_for(self._event.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        self._event.clear()
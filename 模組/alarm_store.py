@@ -0,0 +1,651 @@
+# 鬧鐘存檔工具：緊湊的二進位紀錄 + 快照 (alarms.bin) + 只往後附加的異動日誌 (alarms.jnl)
+#
+# 每組鬧鐘在記憶體與檔案中都是固定 18 位元組的紀錄（struct 打包），
+# 全部放在一個 bytearray 裡；只有在網頁 / MQTT 等 API 邊界才轉成 dict。
+#
+# 每次新增 / 切換 / 刪除只在日誌尾端附加一筆 19 位元組的異動，不必重寫整個檔案；
+# 開機時先讀快照再重播日誌，日誌超過門檻時由背景任務壓縮回快照。
+#
+# 寫入採「合併延遲」：異動先放在記憶體，最後一次異動後 debounce_ms
+# 或第一筆異動後 max_latency_ms 才一次寫入，網頁連續操作只會寫一次。
+# 快照先寫到暫存檔再改名取代，斷電也不會留下只寫一半的快照。
+# 快照與日誌都帶世代編號：每次壓縮 / 批次匯入寫新快照時加一，開機時只重播同一代的日誌，
+# 在「新快照已改名、舊日誌還沒清空」之間斷電也不會把舊異動套到新快照上。
+#
+# 舊版的 alarms.json / alarms.log 在第一次開機時自動轉換成新格式。
+
+import os, json, struct
+from alarm_sched import rule_label, A_ID, A_Y, A_M, A_D, A_H, A_MIN, A_ON, A_SONG, A_MASK, A_EVERY, A_ANCHOR
+
+try:
+    import utime as time
+except ImportError:
+    import time
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+
+# ============================================================
+# 📦 紀錄格式
+# ============================================================
+# 欄位：id(u32) 年-2000 月 日 時 分(u8 各一) 旗標(u8) 規則遮罩(u32) 每N天(u16) 起算日(u16)
+#   u8 欄位以 255 表示 -1（每天）；年份無效時存 254，讀回為 0（永不觸發）
+#   旗標：bit7 = 啟用，低 7 位 = 曲目 id
+REC_FMT = "<IBBBBBBIHH"
+REC_SIZE = struct.calcsize(REC_FMT)   # 18
+MAGIC = b"ALM2"                        # 快照：MAGIC + 世代(u32) + 紀錄
+MAGIC_V1 = b"ALM1"                     # 舊版快照沒有世代，視為第 0 代
+GEN_FMT = "<I"
+SNAP_HEAD = len(MAGIC) + 4
+NONE = 255
+BAD_YEAR = 254
+ON_BIT = 0x80
+FLAGS_OFF = 9                          # 旗標在紀錄中的位移
+
+# 🎵 曲目 id：檔案只存索引，新曲目請加在最後面，不要改動既有順序
+SONGS = ("NOTES_STAR", "NOTES_SKYCASTLE", "NOTES_HAPPYBIRTHDAY")
+
+# 日誌異動種類：寫入 / 刪除 / 清空，後面接一筆完整紀錄
+OP_PUT = b"P"
+OP_DEL = b"D"
+OP_CLEAR = b"C"
+# 日誌的第一筆：這份日誌接在第幾代快照之後（世代放在紀錄的位置，其餘補 0）；沒有時視為第 0 代
+OP_GEN = b"G"
+ENTRY_SIZE = 1 + REC_SIZE
+_BLANK = bytes(REC_SIZE)
+
+# 差異查詢用的變更紀錄：(版本, id, 種類)，只保留最近 CHANGES_MAX 筆
+CH_ADD, CH_PUT, CH_DEL = 0, 1, 2
+CHANGES_MAX = 64
+
+
+def song_id(name):
+    try:
+        return SONGS.index(name)
+    except ValueError:
+        return 0
+
+
+def song_name(i):
+    return SONGS[i] if i < len(SONGS) else SONGS[0]
+
+
+def _u8(v, name):
+    if v == -1:
+        return NONE
+    if not 0 <= v < BAD_YEAR:
+        raise ValueError("%s 超出範圍: %r" % (name, v))
+    return v
+
+
+def pack(rec):
+    """紀錄 tuple → REC_SIZE 位元組；超出範圍的欄位丟出 ValueError"""
+    aid, y, m, d, h, mi, on, song, mask, every, anchor = rec
+    if y == -1:
+        yb = NONE
+    elif 2000 <= y < 2000 + BAD_YEAR:
+        yb = y - 2000
+    else:
+        yb = BAD_YEAR
+    # MicroPython 的 struct 不檢查範圍，超出的值會被默默截斷
+    if not (0 < aid <= 0xFFFFFFFF and 0 <= song < ON_BIT and 0 <= mask <= 0xFFFFFFFF
+            and 0 <= every <= 0xFFFF and 0 <= anchor <= 0xFFFF):
+        raise ValueError("鬧鐘欄位超出範圍")
+    return struct.pack(REC_FMT, aid, yb, _u8(m, "m"), _u8(d, "d"), _u8(h, "h"), _u8(mi, "min"),
+                       (ON_BIT if on else 0) | song, mask, every, anchor)
+
+
+def unpack(buf, off=0):
+    """從 buf 的 off 位置解出一筆紀錄 tuple"""
+    aid, y, m, d, h, mi, flags, mask, every, anchor = struct.unpack_from(REC_FMT, buf, off)
+    return (aid,
+            -1 if y == NONE else (0 if y == BAD_YEAR else y + 2000),
+            -1 if m == NONE else m,
+            -1 if d == NONE else d,
+            -1 if h == NONE else h,
+            -1 if mi == NONE else mi,
+            bool(flags & ON_BIT), flags & 0x7F, mask, every, anchor)
+
+
+def from_dict(a):
+    """API 送來的 dict → 紀錄 tuple（r 為已編譯的重複規則）"""
+    r = a.get("r") or (0, 0, 0)
+    return (int(a["id"]), int(a["y"]), int(a["m"]), int(a["d"]), int(a["h"]), int(a["min"]),
+            bool(a.get("enabled", True)), song_id(a.get("song", SONGS[0])),
+            int(r[0]), int(r[1]), int(r[2]))
+
+
+def renumber(buf, first):
+    """把打包紀錄的 id 依序改成 first, first + 1, …（就地修改，不另外配置）"""
+    for off in range(0, len(buf), REC_SIZE):
+        struct.pack_into("<I", buf, off, first + off // REC_SIZE)
+
+
+def to_dict(rec):
+    """紀錄 tuple → API 使用的 dict"""
+    a = {"id": rec[A_ID], "y": rec[A_Y], "m": rec[A_M], "d": rec[A_D],
+         "h": rec[A_H], "min": rec[A_MIN], "enabled": rec[A_ON], "song": song_name(rec[A_SONG])}
+    if rec[A_MASK]:
+        r = [rec[A_MASK], rec[A_EVERY], rec[A_ANCHOR]]
+        a["repeat"] = rule_label(r)
+        a["r"] = r
+    return a
+
+
+def sort_key(rec):
+    """顯示順序：日期、時間（每天的鬧鐘 y/m/d 為 -1，排在最前面）"""
+    return rec[A_Y:A_MIN + 1]
+
+
+# ============================================================
+# 🗃 AlarmTable — 依 id 排序的緊湊紀錄表
+# ============================================================
+class AlarmTable:
+    """
+    以一個 bytearray 保存全部鬧鐘，每筆 REC_SIZE 位元組、依 id 遞增排列。
+    id 只增不減，新增的鬧鐘通常直接接在尾端；查詢與刪除用二分搜尋。
+    version 每次變更加一，讓顯示等快取知道何時需要重算；
+    changes 記下最近的變更，讓 API 只回傳某個版本之後的差異。
+    epoch 每次開機不同，版本從 0 重新算起時舊的版本號不會被誤認。
+    """
+    def __init__(self, data=b""):
+        if len(data) % REC_SIZE:
+            raise ValueError("鬧鐘資料長度錯誤")
+        self.buf = bytearray(data)
+        self.epoch = struct.unpack("<H", os.urandom(2))[0]
+        self.rebase()
+
+    def rebase(self):
+        """把目前的內容當成版本 0（開機載入完成後呼叫），清掉變更紀錄"""
+        self.version = 0
+        self.changes = []
+        self.floor = 0    # 能回答差異查詢的最舊版本
+
+    def _bump(self, aid, kind):
+        self.version += 1
+        self.changes.append((self.version, aid, kind))
+        if len(self.changes) > CHANGES_MAX:
+            self.floor = self.changes.pop(0)[0]
+
+    def _forget(self):
+        """變更太多記不下：之後的差異查詢一律要整份重抓"""
+        self.changes = []
+        self.floor = self.version
+
+    def changes_since(self, since):
+        """
+        since 版本之後新增、修改與刪除的 id：(added, changed, removed)。
+        since 早於保留的紀錄或晚於目前版本時回傳 None，呼叫端改回傳整份清單。
+        """
+        if since < self.floor or since > self.version:
+            return None
+        seen = {}  # id → [第一筆是否為新增, 最後一筆種類]
+        for v, aid, kind in self.changes:
+            if v <= since:
+                continue
+            st = seen.get(aid)
+            if st is None:
+                seen[aid] = [kind == CH_ADD, kind]
+            else:
+                st[1] = kind
+        added, changed, removed = [], [], []
+        for aid, (new, last) in seen.items():
+            if last == CH_DEL:
+                if not new:
+                    removed.append(aid)  # 期間內新增又刪除的，對方根本沒看過
+            elif new:
+                added.append(aid)
+            else:
+                changed.append(aid)
+        return added, changed, removed
+
+    def __len__(self):
+        return len(self.buf) // REC_SIZE
+
+    def __iter__(self):
+        buf = self.buf
+        for off in range(0, len(buf), REC_SIZE):
+            yield unpack(buf, off)
+
+    def _id_at(self, i):
+        return struct.unpack_from("<I", self.buf, i * REC_SIZE)[0]
+
+    def _find(self, aid):
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._id_at(mid) < aid:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _has(self, i, aid):
+        return i < len(self) and self._id_at(i) == aid
+
+    def next_id(self):
+        n = len(self)
+        return self._id_at(n - 1) + 1 if n else 1
+
+    def get(self, aid):
+        i = self._find(aid)
+        return unpack(self.buf, i * REC_SIZE) if self._has(i, aid) else None
+
+    def put(self, rec):
+        """新增或取代一筆紀錄，回傳存入後的紀錄"""
+        data = pack(rec)
+        i = self._find(rec[A_ID])
+        off = i * REC_SIZE
+        if self._has(i, rec[A_ID]):
+            self.buf[off:off + REC_SIZE] = data
+            self._bump(rec[A_ID], CH_PUT)
+        else:
+            if off == len(self.buf):
+                self.buf.extend(data)
+            else:
+                self.buf[off:off] = data
+            self._bump(rec[A_ID], CH_ADD)
+        return unpack(data)
+
+    def remove(self, aid):
+        """刪除一筆紀錄，回傳被刪除的紀錄（不存在時回傳 None）"""
+        i = self._find(aid)
+        if not self._has(i, aid):
+            return None
+        off = i * REC_SIZE
+        rec = unpack(self.buf, off)
+        self.buf[off:off + REC_SIZE] = b""
+        self._bump(aid, CH_DEL)
+        return rec
+
+    def set_enabled(self, aid, on):
+        """只改旗標位元組，回傳更新後的紀錄"""
+        i = self._find(aid)
+        if not self._has(i, aid):
+            return None
+        off = i * REC_SIZE + FLAGS_OFF
+        self.buf[off] = (self.buf[off] & 0x7F) | (ON_BIT if on else 0)
+        self._bump(aid, CH_PUT)
+        return unpack(self.buf, i * REC_SIZE)
+
+    def merge(self, data):
+        """
+        把另一段依 id 排序的打包紀錄一次合併進來。
+        新 id 都比現有的大時（批次匯入的一般情況）直接接在尾端；
+        有 id 與現有的重複時丟出 ValueError，紀錄表不做任何修改。
+        """
+        if len(data) % REC_SIZE:
+            raise ValueError("鬧鐘資料長度錯誤")
+        if not data:
+            return
+        a, n = self.buf, len(self.buf)
+        # 整批算一次變更（同一個版本）；筆數超過變更紀錄的容量就直接要求整份重抓
+        version = self.version + 1
+        log = len(data) // REC_SIZE + len(self.changes) <= CHANGES_MAX
+        if not n or struct.unpack_from("<I", data, 0)[0] > self._id_at(n // REC_SIZE - 1):
+            a.extend(data)
+            if log:
+                for j in range(0, len(data), REC_SIZE):
+                    self.changes.append((version, struct.unpack_from("<I", data, j)[0], CH_ADD))
+        else:
+            out = bytearray()
+            i = j = 0
+            while i < n and j < len(data):
+                ia = struct.unpack_from("<I", a, i)[0]
+                ib = struct.unpack_from("<I", data, j)[0]
+                if ia == ib:
+                    raise ValueError("鬧鐘 id 重複: %d" % ib)
+                if ia < ib:
+                    out += a[i:i + REC_SIZE]
+                    i += REC_SIZE
+                else:
+                    out += data[j:j + REC_SIZE]
+                    j += REC_SIZE
+            out += a[i:]
+            out += data[j:]
+            self.buf = out
+            if log:
+                for k in range(0, len(data), REC_SIZE):
+                    self.changes.append((version, struct.unpack_from("<I", data, k)[0], CH_ADD))
+        self.version = version
+        if not log:
+            self._forget()
+
+    def clear(self):
+        self.buf = bytearray()
+        self.version += 1
+        self._forget()
+
+    def dicts(self):
+        """依顯示順序轉成 dict 清單（僅供 API 使用）"""
+        recs = list(self)
+        recs.sort(key=sort_key)
+        return [to_dict(r) for r in recs]
+
+
+def _size(path):
+    try:
+        return os.stat(path)[6]
+    except OSError:
+        return -1
+
+
+def _ticks_ms():
+    try:
+        return time.ticks_ms()
+    except AttributeError:
+        return int(time.time() * 1000)
+
+
+def _ticks_diff(a, b):
+    try:
+        return time.ticks_diff(a, b)
+    except AttributeError:
+        return a - b
+
+
+def _sync():
+    try:
+        os.sync()
+    except Exception:
+        pass
+
+
+def replay(alarms, ops):
+    """
+    把舊版 JSON 日誌中的異動套用到鬧鐘清單，回傳新的清單（轉換舊檔用）。
+    每種異動都是冪等的（以 id 為鍵），重播兩次結果相同。
+    """
+    by_id = {}
+    order = []
+    for a in alarms:
+        if a.get("id") not in by_id:
+            order.append(a.get("id"))
+        by_id[a.get("id")] = a
+    for op in ops:
+        kind = op.get("op")
+        if kind == "add":
+            a = op["a"]
+            if a["id"] not in by_id:
+                order.append(a["id"])
+            by_id[a["id"]] = a
+        elif kind == "set":
+            a = by_id.get(op["id"])
+            if a is not None:
+                a.update(op["v"])
+        elif kind == "del":
+            by_id.pop(op["id"], None)
+        elif kind == "clear":
+            by_id = {}
+            order = []
+    return [by_id[k] for k in order if k in by_id]
+
+
+def _read_json_log(path):
+    """讀舊版一行一筆 JSON 的異動日誌"""
+    ops = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    ops.append(json.loads(line))
+                except ValueError:
+                    break
+    except OSError:
+        pass
+    return ops
+
+
+class AlarmJournal:
+    """
+    快照 + 異動日誌，內容都是二進位紀錄。
+      append(op, rec) ：記下一筆異動（OP_PUT / OP_DEL / OP_CLEAR），稍後合併寫入
+      flush()         ：立即把累積的異動寫入日誌
+      load()          ：讀快照並重播日誌，回傳 AlarmTable
+      compact(table)  ：把目前的紀錄表寫成快照並清空日誌
+      run(get)        ：背景任務，負責延遲寫入與壓縮
+    stats 記錄載入耗時、寫入次數、位元組與合併的異動數，方便量測。
+    """
+    def __init__(self, snapshot="alarms.bin", log="alarms.jnl", legacy=("alarms.json", "alarms.log"),
+                 limit=4096, debounce_ms=500, max_latency_ms=3000):
+        self.snapshot = snapshot
+        self.tmp = snapshot + ".tmp"
+        self.log = log
+        self.legacy = legacy                  # 舊版 JSON 快照與日誌，快照不存在時轉換
+        self.limit = limit                    # 日誌超過這麼多位元組就壓縮
+        self.debounce_ms = debounce_ms        # 最後一次異動後等多久才寫
+        self.max_latency_ms = max_latency_ms  # 第一筆異動最多等多久
+        self.log_size = 0
+        self.gen = 0                          # 目前快照的世代，日誌開頭記著同一個數字
+        self._pending = bytearray()
+        self._first = 0
+        self._last = 0
+        self._dirty = asyncio.Event()
+        self.stats = {
+            "load_ms": 0,           # 開機載入耗時
+            "replayed": 0,          # 開機時重播的異動筆數
+            "migrated": 0,          # 從舊版 JSON 轉換的鬧鐘數
+            "mutations": 0,         # 收到的異動筆數
+            "coalesced": 0,         # 與其他異動合併寫入而省下的寫入次數
+            "flushes": 0,           # 實際寫入檔案的次數（日誌 + 快照）
+            "bytes_written": 0,     # 寫入的總位元組
+            "compactions": 0,
+        }
+
+    def dirty(self):
+        return bool(self._pending)
+
+    # ---- 載入 ----
+    def _parse(self, path):
+        """讀快照檔，回傳 (世代, 紀錄)"""
+        with open(path, "rb") as f:
+            data = f.read()
+        head = SNAP_HEAD if data[:4] == MAGIC else 4 if data[:4] == MAGIC_V1 else -1
+        if head < 0 or len(data) < head or (len(data) - head) % REC_SIZE:
+            raise ValueError("快照格式錯誤")
+        gen = struct.unpack_from(GEN_FMT, data, 4)[0] if head == SNAP_HEAD else 0
+        return gen, data[head:]
+
+    def _read_snapshot(self):
+        """讀快照；若上次寫入中途斷電，改用完整的暫存檔；都沒有時回傳 None"""
+        data = None
+        try:
+            self.gen, data = self._parse(self.snapshot)
+        except OSError:
+            pass
+        except ValueError as e:
+            print("⚠️ 載入鬧鐘失敗:", e)
+        if _size(self.tmp) >= 0:
+            if data is None:
+                try:
+                    self.gen, data = self._parse(self.tmp)
+                    self._replace(self.tmp, self.snapshot)
+                    print("♻️ 已從暫存檔還原鬧鐘快照")
+                except (OSError, ValueError):
+                    pass
+            try:
+                os.remove(self.tmp)  # 快照完好時，暫存檔只是寫到一半的殘留
+            except OSError:
+                pass
+        if data is None and _size(self.snapshot) >= 0:
+            data = b""  # 快照損毀：從空表開始，不再轉換舊檔
+        return data
+
+    def _migrate(self):
+        """把舊版 alarms.json + alarms.log 轉成紀錄表並寫成快照"""
+        snap, log = self.legacy
+        alarms = []
+        try:
+            with open(snap, "r") as f:
+                alarms = json.load(f)
+        except OSError:
+            pass
+        except ValueError as e:
+            print("⚠️ 載入舊版鬧鐘失敗:", e)
+        # 更舊的快照沒有 id，先補上才能重播以 id 為鍵的日誌
+        next_id = max([a["id"] for a in alarms if "id" in a] + [0]) + 1
+        for a in alarms:
+            if "id" not in a:
+                a["id"] = next_id
+                next_id += 1
+        ops = _read_json_log(log)
+        if ops:
+            alarms = replay(alarms, ops)
+        table = AlarmTable()
+        for a in alarms:
+            try:
+                table.put(from_dict(a))
+            except (KeyError, TypeError, ValueError) as e:
+                print("⚠️ 略過無法轉換的鬧鐘:", a, e)
+        self._write_snapshot(table.buf)
+        self.stats["migrated"] = len(table)
+        if alarms:
+            print("📦 已把 %d 組鬧鐘從 %s 轉成二進位格式" % (len(table), snap))
+        return table
+
+    def _replay(self, table):
+        """
+        把二進位日誌套用到紀錄表；結尾不完整的異動（斷電）會被忽略。
+        日誌屬於較舊的快照世代時整份略過並清空，回傳 -1
+        """
+        try:
+            with open(self.log, "rb") as f:
+                data = f.read()
+        except OSError:
+            return 0
+        start = 0
+        gen = 0
+        if data[:1] == OP_GEN and len(data) >= ENTRY_SIZE:
+            gen = struct.unpack_from(GEN_FMT, data, 1)[0]
+            start = ENTRY_SIZE
+        if gen != self.gen:
+            print("⚠️ 異動日誌屬於較舊的快照（第 %d 代，快照第 %d 代），已略過" % (gen, self.gen))
+            self._reset_log()
+            return -1
+        n = 0
+        for off in range(start, len(data) - ENTRY_SIZE + 1, ENTRY_SIZE):
+            op = data[off:off + 1]
+            try:
+                if op == OP_PUT:
+                    table.put(unpack(data, off + 1))
+                elif op == OP_DEL:
+                    table.remove(unpack(data, off + 1)[A_ID])
+                elif op == OP_CLEAR:
+                    table.clear()
+                else:
+                    raise ValueError(op)
+            except ValueError:
+                print("⚠️ 異動日誌有損毀的紀錄，已忽略之後的內容")
+                break
+            n += 1
+        if len(data) % ENTRY_SIZE:
+            print("⚠️ 異動日誌結尾不完整，已忽略")
+        return n
+
+    def load(self):
+        t0 = _ticks_ms()
+        data = self._read_snapshot()
+        table = self._migrate() if data is None else AlarmTable(data)
+        n = self._replay(table)
+        table.rebase()
+        self.log_size = max(_size(self.log), 0)
+        self.stats["replayed"] = max(n, 0)
+        self.stats["load_ms"] = _ticks_diff(_ticks_ms(), t0)
+        return table
+
+    # ---- 寫入 ----
+    def append(self, op, rec=None):
+        """記下一筆異動；實際寫入由 run() 合併延遲處理"""
+        now = _ticks_ms()
+        if self._pending:
+            self.stats["coalesced"] += 1
+        else:
+            self._first = now
+        self._last = now
+        self._pending += op
+        self._pending += pack(rec) if rec is not None else _BLANK
+        self.stats["mutations"] += 1
+        self._dirty.set()
+
+    def flush(self):
+        """把累積的異動一次附加到日誌"""
+        if not self._pending:
+            return 0
+        data = self._pending
+        with open(self.log, "ab") as f:
+            if self.log_size == 0 and self.gen:
+                f.write(self._gen_entry())  # 新日誌先記下接在哪一代快照後面
+                self.log_size = ENTRY_SIZE
+            f.write(data)
+        _sync()
+        self._pending = bytearray()
+        self.log_size += len(data)
+        self.stats["flushes"] += 1
+        self.stats["bytes_written"] += len(data)
+        return len(data)
+
+    def needs_compact(self):
+        return self.log_size > self.limit
+
+    def _replace(self, src, dst):
+        try:
+            os.rename(src, dst)
+        except OSError:
+            # 部分檔案系統不能改名蓋過既有檔案；此時若斷電，load() 會從暫存檔還原
+            os.remove(dst)
+            os.rename(src, dst)
+
+    def _gen_entry(self):
+        return OP_GEN + struct.pack(GEN_FMT, self.gen) + _BLANK[4:]
+
+    def _write_snapshot(self, buf):
+        """以下一個世代寫成快照；先寫暫存檔再改名取代，快照不會只寫一半"""
+        self.gen += 1
+        with open(self.tmp, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack(GEN_FMT, self.gen))
+            f.write(buf)
+        _sync()
+        self._replace(self.tmp, self.snapshot)
+        self.stats["flushes"] += 1
+        self.stats["bytes_written"] += SNAP_HEAD + len(buf)
+
+    def _reset_log(self):
+        """清空日誌，開頭只留目前的世代"""
+        with open(self.log, "wb") as f:
+            f.write(self._gen_entry())
+        _sync()
+        self.log_size = ENTRY_SIZE
+
+    def compact(self, table):
+        """把目前的紀錄表寫成快照並清空日誌（尚未寫入的異動已包含在快照中）"""
+        self._write_snapshot(table.buf)
+        # 若在這裡斷電，日誌開頭還是上一代的世代編號，開機時整份略過，不會套到新快照上
+        self._reset_log()
+        self.stats["compactions"] += 1
+
+    async def run(self, get_table):
+        """背景任務：有異動時等到 debounce / 最長延遲到期再一次寫入，必要時壓縮"""
+        while True:
+            await self._dirty.wait()
+            while True:
+                now = _ticks_ms()
+                wait = min(self.debounce_ms - _ticks_diff(now, self._last),
+                           self.max_latency_ms - _ticks_diff(now, self._first))
+                if wait <= 0:
+                    break
+                await asyncio.sleep_ms(wait)
+            self._dirty.clear()
+            try:
+                self.flush()
+                if self.needs_compact():
+                    self.compact(get_table())
+                    print("🗜 異動日誌已壓縮為快照")
+            except Exception as e:
+                print("⚠️ 寫入鬧鐘失敗:", e)